@@ -0,0 +1,210 @@
+# Copyright 2017 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Queue-based logging, so threads under study don't block on file I/O.
+
+Records are appended to an in-memory queue by the logging thread and
+formatted and written in batches by a single writer thread. When the
+queue is full, records are either dropped (and counted) or the logging
+thread waits for the writer to catch up.
+"""
+
+import collections
+import logging
+import numbers
+import threading
+
+import six
+
+
+BLOCK = 'block'
+DROP = 'drop'
+POLICIES = (BLOCK, DROP)
+DEFAULT_CAPACITY = 65536
+DEFAULT_FLUSH_INTERVAL = 0.05  # seconds
+THREAD_NAME = 'Thread-AsyncLogWriter'
+STATS_TEMPLATE = """\
+Async logging stats:
+   enqueued=%d
+    written=%d
+    dropped=%d
+    blocked=%d
+    batches=%d
+  max depth=%d"""
+_IMMUTABLE = (
+    type(None), bool, numbers.Number, six.binary_type, six.text_type)
+
+
+def _deferrable(args):
+    """Check if the arguments can be formatted on another thread.
+
+    Only immutable values are safe: anything else (e.g. a list of
+    managed calls) may change before the writer gets to it.
+    """
+    if isinstance(args, tuple):
+        return all(isinstance(arg, _IMMUTABLE) for arg in args)
+    return isinstance(args, _IMMUTABLE)
+
+
+class AsyncHandler(logging.Handler):
+    """Writes records to a file in batches on a writer thread.
+
+    Args:
+        filename (str): Where formatted records are written.
+        mode (str): The mode used to open ``filename``.
+        capacity (int): The maximum number of queued records.
+        policy (str): What to do when the queue is full, either
+            ``BLOCK`` (wait for space) or ``DROP`` (discard the record).
+        flush_interval (float): How long the writer waits for records
+            to accumulate before writing a batch.
+    """
+
+    def __init__(
+            self, filename, mode='w', capacity=DEFAULT_CAPACITY,
+            policy=BLOCK, flush_interval=DEFAULT_FLUSH_INTERVAL):
+        if policy not in POLICIES:
+            raise ValueError('Unknown policy', policy, POLICIES)
+        super(AsyncHandler, self).__init__()
+        self.stream = open(filename, mode)
+        self.capacity = capacity
+        self.policy = policy
+        self.flush_interval = flush_interval
+        self._records = collections.deque()
+        self._queue_lock = threading.Lock()
+        self._not_empty = threading.Condition(self._queue_lock)
+        self._not_full = threading.Condition(self._queue_lock)
+        self._drained = threading.Condition(self._queue_lock)
+        self._closed = False
+        self.num_enqueued = 0
+        self.num_written = 0
+        self.num_dropped = 0
+        self.num_blocked = 0
+        self.num_batches = 0
+        self.max_depth = 0
+        self._writer = threading.Thread(target=self._run, name=THREAD_NAME)
+        self._writer.daemon = True
+        self._writer.start()
+
+    def _prepare(self, record):
+        # NOTE: Tracebacks and mutable arguments must be rendered on the
+        #       logging thread, everything else is left for the writer.
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(
+                record.exc_info)
+            record.exc_info = None
+        if record.args and not _deferrable(record.args):
+            record.msg = record.getMessage()
+            record.args = None
+
+    def handle(self, record):
+        # NOTE: Skip the handler's I/O lock since ``emit()`` does its own
+        #       locking. Otherwise, a thread blocked on a full queue would
+        #       hold it and the writer could deadlock if it logs.
+        is_emitted = self.filter(record)
+        if is_emitted:
+            self.emit(record)
+        return is_emitted
+
+    def emit(self, record):
+        try:
+            self._prepare(record)
+        except Exception:
+            self.handleError(record)
+            return
+
+        with self._queue_lock:
+            if self._closed:
+                return
+            if len(self._records) >= self.capacity:
+                # NOTE: The writer can't wait for itself (e.g. when it
+                #       logs an error via the redirected ``stderr``).
+                if (self.policy == DROP or
+                        threading.current_thread() is self._writer):
+                    self.num_dropped += 1
+                    return
+                self.num_blocked += 1
+                self._not_empty.notify()
+                while (len(self._records) >= self.capacity and
+                       not self._closed):
+                    self._not_full.wait()
+            self._records.append(record)
+            self.num_enqueued += 1
+            self.max_depth = max(self.max_depth, len(self._records))
+
+    def _format_batch(self, batch):
+        lines = []
+        for record in batch:
+            try:
+                lines.append(self.format(record))
+            except Exception:
+                self.handleError(record)
+        if lines:
+            return '\n'.join(lines) + '\n'
+        return ''
+
+    def _run(self):
+        while True:
+            with self._queue_lock:
+                if not self._records and not self._closed:
+                    self._not_empty.wait(self.flush_interval)
+                batch = self._records
+                self._records = collections.deque()
+                self._not_full.notify_all()
+                if self._closed and not batch:
+                    self._drained.notify_all()
+                    return
+
+            if batch:
+                text = self._format_batch(batch)
+                if text:
+                    self.stream.write(text)
+                    self.stream.flush()
+
+            with self._queue_lock:
+                self.num_written += len(batch)
+                self.num_batches += 1 if batch else 0
+                self._drained.notify_all()
+
+    def flush(self):
+        """Wait until every record queued so far has been written."""
+        with self._queue_lock:
+            target = self.num_enqueued
+            self._not_empty.notify()
+            while self.num_written < target and self._writer.is_alive():
+                self._drained.wait(self.flush_interval)
+
+    def stats(self):
+        # Returns: Tuple[int, ...] (the values for ``STATS_TEMPLATE``)
+        with self._queue_lock:
+            return (
+                self.num_enqueued, self.num_written, self.num_dropped,
+                self.num_blocked, self.num_batches, self.max_depth)
+
+    def close(self):
+        """Stop the writer (after draining the queue) and log the stats.
+
+        The stats are written directly, since the queue is closed.
+        """
+        with self._queue_lock:
+            already_closed = self._closed
+            self._closed = True
+            self._not_empty.notify()
+        if not already_closed:
+            self._writer.join()
+            record = logging.LogRecord(
+                __name__, logging.INFO, __file__, 0, STATS_TEMPLATE,
+                self.stats(), None)
+            self.stream.write(self._format_batch([record]))
+            self.stream.close()
+        super(AsyncHandler, self).close()
@@ -0,0 +1,357 @@
+# Copyright 2017 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Compact binary logs, with a decoder back to ``utils.LOG_FORMAT``.
+
+A log is a sequence of segment files (``<base>-00000.binlog``, ...).
+Each segment starts with a header and then holds zlib compressed blocks,
+each prefixed by its compressed and raw sizes. Uncompressed, a block is
+a sequence of length-prefixed frames, either
+
+* a string definition, interning a logger or thread name, or
+* a record: a monotonic timestamp (in nanoseconds), the TID, the level,
+  the IDs of the logger and thread names, the message and any traceback.
+
+Interned IDs are local to a segment, so every segment can be decoded on
+its own.
+
+Usage:
+
+.. code-block:: bash
+
+   $ python binary_log.py decode issue-4238/0.29.4-*.binlog > decoded.txt
+"""
+
+from __future__ import print_function
+
+import argparse
+import logging
+import os
+import struct
+import sys
+import threading
+import time
+import zlib
+
+import log_records
+
+
+MAGIC = b'PSBLOG\x01\n'
+SEGMENT_HEADER = struct.Struct('<q')  # monotonic ns at ``logging._startTime``
+BLOCK_HEADER = struct.Struct('<II')  # compressed size, raw size
+FRAME_HEADER = struct.Struct('<IB')  # payload size, frame type
+STRING_HEADER = struct.Struct('<I')  # string ID
+# ns, TID, level, logger ID, thread name ID, message size
+RECORD_HEADER = struct.Struct('<qQBIII')
+STRING_FRAME = 1
+RECORD_FRAME = 2
+ENCODING = 'utf-8'
+DEFAULT_BLOCK_SIZE = 64 * 1024  # raw bytes
+DEFAULT_SEGMENT_SIZE = 32 * 1024 * 1024  # compressed bytes
+SEGMENT_TEMPLATE = '{}-{:05d}.binlog'
+
+try:
+    _monotonic_ns = time.monotonic_ns
+except AttributeError:  # Python < 3.7
+    def _monotonic_ns():
+        return int(1e9 * time.monotonic())
+_TID_CACHE = threading.local()
+
+
+def _trailer(record):
+    """Get the text ``logging.Formatter`` appends after the format.
+
+    In the text log, tracebacks (and stacks) come **after** the
+    separator, so they are kept apart from the message.
+
+    Returns:
+        str: The text (may be empty).
+    """
+    parts = []
+    if record.exc_info and not record.exc_text:
+        record.exc_text = logging.Formatter().formatException(
+            record.exc_info)
+    if record.exc_text:
+        parts.append(record.exc_text)
+    stack_info = getattr(record, 'stack_info', None)
+    if stack_info:
+        parts.append(stack_info)
+    return '\n'.join(parts)
+
+
+def _current_tid():
+    # NOTE: Cached per thread, since getting the TID is a system call.
+    tid = getattr(_TID_CACHE, 'tid', None)
+    if tid is None:
+        # NOTE: Import at **runtime** since ``thread_names`` imports
+        #       ``utils`` (which imports this module).
+        import thread_names
+        tid = thread_names.get_thread_id()
+        _TID_CACHE.tid = tid
+    return tid
+
+
+class BinaryHandler(logging.Handler):
+    """Writes records to rotating, block compressed binary segments.
+
+    Args:
+        filename_base (str): The path of the segments, without the
+            ``-NNNNN.binlog`` suffix.
+        block_size (int): The raw size at which a block is compressed
+            and written.
+        segment_size (int): The (compressed) size at which a new segment
+            is started.
+        max_segments (Optional[int]): If set, the oldest segments are
+            removed so no more than this many are kept.
+    """
+
+    def __init__(
+            self, filename_base, block_size=DEFAULT_BLOCK_SIZE,
+            segment_size=DEFAULT_SEGMENT_SIZE, max_segments=None):
+        super(BinaryHandler, self).__init__()
+        self.filename_base = filename_base
+        self.block_size = block_size
+        self.segment_size = segment_size
+        self.max_segments = max_segments
+        # NOTE: Timestamps are relative to the same origin as
+        #       ``relativeCreated``.
+        self.monotonic_base = _monotonic_ns() - int(
+            1e9 * (time.time() - logging._startTime))
+        self.segment_index = -1
+        self.segments = []
+        self._file_obj = None
+        self._segment_bytes = 0
+        self._block = bytearray()
+        self._strings = {}
+        self._open_segment()
+
+    def _open_segment(self):
+        if self._file_obj is not None:
+            self._file_obj.close()
+        self.segment_index += 1
+        filename = SEGMENT_TEMPLATE.format(
+            self.filename_base, self.segment_index)
+        self._file_obj = open(filename, 'wb')
+        self._file_obj.write(MAGIC + SEGMENT_HEADER.pack(self.monotonic_base))
+        self._segment_bytes = 0
+        self._strings = {}
+        self.segments.append(filename)
+
+        if self.max_segments is not None:
+            while len(self.segments) > self.max_segments:
+                os.remove(self.segments.pop(0))
+
+    def _frame(self, frame_type, payload):
+        self._block += FRAME_HEADER.pack(len(payload), frame_type)
+        self._block += payload
+
+    def _intern(self, value):
+        string_id = self._strings.get(value)
+        if string_id is None:
+            string_id = len(self._strings)
+            self._strings[value] = string_id
+            self._frame(
+                STRING_FRAME,
+                STRING_HEADER.pack(string_id) + value.encode(ENCODING))
+        return string_id
+
+    def _write_block(self):
+        if not self._block:
+            return
+        compressed = zlib.compress(bytes(self._block))
+        self._file_obj.write(
+            BLOCK_HEADER.pack(len(compressed), len(self._block)))
+        self._file_obj.write(compressed)
+        self._file_obj.flush()
+        self._segment_bytes += BLOCK_HEADER.size + len(compressed)
+        self._block = bytearray()
+        if self._segment_bytes >= self.segment_size:
+            self._open_segment()
+
+    def emit(self, record):
+        try:
+            timestamp = _monotonic_ns()
+            message = record.getMessage().encode(ENCODING)
+            trailer = _trailer(record).encode(ENCODING)
+
+            logger_id = self._intern(record.name)
+            thread_id = self._intern(record.threadName)
+            header = RECORD_HEADER.pack(
+                timestamp - self.monotonic_base, _current_tid(),
+                record.levelno, logger_id, thread_id, len(message))
+            self._frame(RECORD_FRAME, header + message + trailer)
+
+            # NOTE: Don't let errors sit in an unwritten block.
+            if (len(self._block) >= self.block_size or
+                    record.levelno >= logging.ERROR):
+                self._write_block()
+        except Exception:
+            self.handleError(record)
+
+    def flush(self):
+        self.acquire()
+        try:
+            if self._file_obj is not None:
+                self._write_block()
+        finally:
+            self.release()
+
+    def close(self):
+        self.acquire()
+        try:
+            if self._file_obj is not None:
+                self._write_block()
+                self._file_obj.close()
+                self._file_obj = None
+        finally:
+            self.release()
+        super(BinaryHandler, self).close()
+
+
+class DecodedRecord(object):
+
+    __slots__ = (
+        'relative_ns', 'tid', 'levelno', 'logger', 'thread_name', 'message',
+        'trailer')
+
+    def __init__(
+            self, relative_ns, tid, levelno, logger, thread_name, message,
+            trailer):
+        self.relative_ns = relative_ns
+        self.tid = tid
+        self.levelno = levelno
+        self.logger = logger
+        self.thread_name = thread_name
+        self.message = message
+        # trailer: str (a traceback, written after the separator)
+        self.trailer = trailer
+
+    @property
+    def relative_created(self):
+        # Returns: float (milliseconds, as in ``LogRecord.relativeCreated``)
+        return self.relative_ns / 1e6
+
+    @property
+    def text(self):
+        # Returns: str (the record in ``utils.LOG_FORMAT``)
+        text = log_records.RECORD_TEMPLATE.format(
+            int(self.relative_created), logging.getLevelName(self.levelno),
+            self.logger, self.thread_name, self.message,
+            log_records.TEXT_SEPARATOR)
+        if self.trailer:
+            text += '\n' + self.trailer
+        return text
+
+
+def _iter_blocks(file_obj):
+    while True:
+        header = file_obj.read(BLOCK_HEADER.size)
+        if len(header) < BLOCK_HEADER.size:
+            # NOTE: A truncated block means the writer didn't finish.
+            return
+        compressed_size, raw_size = BLOCK_HEADER.unpack(header)
+        compressed = file_obj.read(compressed_size)
+        if len(compressed) < compressed_size:
+            return
+        block = zlib.decompress(compressed)
+        if len(block) != raw_size:
+            raise ValueError('Corrupt block', raw_size, len(block))
+        yield block
+
+
+def iter_segment(filename):
+    """Decode the records in a single segment.
+
+    Yields:
+        DecodedRecord: The records, in the order they were written.
+    """
+    with open(filename, 'rb') as file_obj:
+        magic = file_obj.read(len(MAGIC))
+        if magic != MAGIC:
+            raise ValueError('Not a binary log segment', filename)
+        file_obj.read(SEGMENT_HEADER.size)
+
+        strings = {}
+        for block in _iter_blocks(file_obj):
+            position = 0
+            while position < len(block):
+                size, frame_type = FRAME_HEADER.unpack_from(block, position)
+                position += FRAME_HEADER.size
+                payload = block[position:position + size]
+                position += size
+
+                if frame_type == STRING_FRAME:
+                    string_id, = STRING_HEADER.unpack_from(payload)
+                    strings[string_id] = payload[
+                        STRING_HEADER.size:].decode(ENCODING)
+                elif frame_type == RECORD_FRAME:
+                    (relative_ns, tid, levelno, logger_id, thread_id,
+                     message_size) = RECORD_HEADER.unpack_from(payload)
+                    message_end = RECORD_HEADER.size + message_size
+                    message = payload[RECORD_HEADER.size:message_end]
+                    yield DecodedRecord(
+                        relative_ns, tid, levelno, strings[logger_id],
+                        strings[thread_id], message.decode(ENCODING),
+                        payload[message_end:].decode(ENCODING))
+                else:
+                    raise ValueError('Unknown frame type', frame_type)
+
+
+def decode(filenames, file_obj):
+    """Render binary log segments in ``utils.LOG_FORMAT``.
+
+    Args:
+        filenames (List[str]): The segments, in order.
+        file_obj (file): Where the text is written.
+
+    Returns:
+        int: The number of records.
+    """
+    count = 0
+    for filename in filenames:
+        for record in iter_segment(filename):
+            file_obj.write(record.text + '\n')
+            count += 1
+    return count
+
+
+def get_args():
+    parser = argparse.ArgumentParser(
+        description='Decode binary log segments.')
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+
+    decode_parser = subparsers.add_parser(
+        'decode', help='Render segments in the text log format.')
+    decode_parser.add_argument('filenames', nargs='+')
+    decode_parser.add_argument(
+        '--output', help='The text file to write (default: stdout).')
+
+    return parser.parse_args()
+
+
+def main():
+    args = get_args()
+    filenames = sorted(args.filenames)
+    if args.output is None:
+        decode(filenames, sys.stdout)
+        return
+
+    with open(args.output, 'w') as file_obj:
+        count = decode(filenames, file_obj)
+    print('Decoded {:d} records to {}'.format(count, args.output))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,533 @@
+# Copyright 2017 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""In-memory stand-in for the Pub / Sub backend.
+
+Implements enough of the ``Publisher`` and ``Subscriber`` gRPC services
+for the scenarios to run without a network: topics, subscriptions,
+in-memory backlogs and redelivery when an ack deadline expires.
+
+Threads created by the server are named with ``THREAD_PREFIX`` so
+that ``thread_names`` can leave them out of the thread tree.
+"""
+
+from __future__ import print_function
+
+import argparse
+import collections
+import contextlib
+import heapq
+import itertools
+import threading
+import time
+
+from concurrent import futures
+from google.cloud.pubsub_v1 import types
+from google.protobuf import empty_pb2
+import grpc
+
+
+PROJECT = 'fake-project'
+THREAD_PREFIX = 'FakePubSub'
+PUBLISHER_SERVICE = 'google.pubsub.v1.Publisher'
+SUBSCRIBER_SERVICE = 'google.pubsub.v1.Subscriber'
+DEFAULT_ACK_DEADLINE = 10
+MAX_RECEIVED = 100
+POLL_INTERVAL = 0.1  # 100ms
+MAX_WORKERS = 32
+SERVER_LOCK = threading.Lock()
+SERVER_STATE = {}
+_STARTING = threading.local()
+
+
+class _Subscription(object):
+
+    def __init__(self, name, topic, ack_deadline):
+        # name: str
+        # topic: str
+        # ack_deadline: int
+        self.name = name
+        self.topic = topic
+        self.ack_deadline = ack_deadline or DEFAULT_ACK_DEADLINE
+        # backlog: Deque[types.PubsubMessage]
+        self.backlog = collections.deque()
+        # outstanding: Dict[str, Tuple[float, types.PubsubMessage]]
+        self.outstanding = {}
+        # expiries: List[Tuple[float, str]] (heap, lazily invalidated)
+        self.expiries = []
+        self.deleted = False
+        self.delivered = 0
+        self.redelivered = 0
+        self.acked = 0
+
+    def lease(self, ack_id, message, deadline):
+        self.outstanding[ack_id] = deadline, message
+        heapq.heappush(self.expiries, (deadline, ack_id))
+
+    def expire(self, now):
+        """Move messages with an expired ack deadline back to the backlog.
+
+        Returns the number of messages that were moved.
+        """
+        count = 0
+        while self.expiries and self.expiries[0][0] <= now:
+            deadline, ack_id = heapq.heappop(self.expiries)
+            info = self.outstanding.get(ack_id)
+            # Skip entries that were acked or had their deadline modified.
+            if info is None or info[0] != deadline:
+                continue
+            del self.outstanding[ack_id]
+            self.backlog.appendleft(info[1])
+            count += 1
+
+        self.redelivered += count
+        return count
+
+
+class Backend(object):
+    """In-memory topics and subscriptions, guarded by a single condition."""
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        # topics: Dict[str, Set[str]] (topic -> subscription names)
+        self.topics = {}
+        # subscriptions: Dict[str, _Subscription]
+        self.subscriptions = {}
+        self._message_ids = itertools.count(1)
+        self._ack_ids = itertools.count(1)
+
+    def create_topic(self, name):
+        with self.condition:
+            if name in self.topics:
+                return False
+            self.topics[name] = set()
+            return True
+
+    def has_topic(self, name):
+        with self.condition:
+            return name in self.topics
+
+    def delete_topic(self, name):
+        with self.condition:
+            return self.topics.pop(name, None) is not None
+
+    def create_subscription(self, name, topic, ack_deadline):
+        with self.condition:
+            if topic not in self.topics:
+                raise KeyError(topic)
+            if name in self.subscriptions:
+                return None
+            subscription = _Subscription(name, topic, ack_deadline)
+            self.subscriptions[name] = subscription
+            self.topics[topic].add(name)
+            return subscription
+
+    def get_subscription(self, name):
+        with self.condition:
+            return self.subscriptions.get(name)
+
+    def delete_subscription(self, name):
+        with self.condition:
+            subscription = self.subscriptions.pop(name, None)
+            if subscription is None:
+                return False
+            subscription.deleted = True
+            self.topics.get(subscription.topic, set()).discard(name)
+            # Wake up any streams so they can report the deletion.
+            self.condition.notify_all()
+            return True
+
+    def publish(self, topic, messages):
+        # topic: str
+        # messages: Iterable[types.PubsubMessage]
+        # Returns: Optional[List[str]]
+        with self.condition:
+            subscription_names = self.topics.get(topic)
+            if subscription_names is None:
+                return None
+
+            message_ids = []
+            for message in messages:
+                published = types.PubsubMessage()
+                published.CopyFrom(message)
+                published.message_id = '{:d}'.format(next(self._message_ids))
+                published.publish_time.GetCurrentTime()
+                message_ids.append(published.message_id)
+                for name in subscription_names:
+                    self.subscriptions[name].backlog.append(published)
+
+            self.condition.notify_all()
+            return message_ids
+
+    def pull(self, name, max_messages, ack_deadline, timeout):
+        """Lease up to ``max_messages`` from a subscription backlog.
+
+        Blocks for at most ``timeout`` seconds when nothing is available.
+
+        Returns:
+            Optional[List[types.ReceivedMessage]]: The leased messages or
+            :data:`None` if the subscription no longer exists.
+        """
+        with self.condition:
+            subscription = self.subscriptions.get(name)
+            if subscription is None:
+                return None
+
+            now = time.time()
+            subscription.expire(now)
+            if not subscription.backlog:
+                self.condition.wait(timeout)
+                if subscription.deleted:
+                    return None
+                now = time.time()
+                subscription.expire(now)
+
+            received = []
+            deadline = now + (ack_deadline or subscription.ack_deadline)
+            while subscription.backlog and len(received) < max_messages:
+                message = subscription.backlog.popleft()
+                ack_id = '{:d}'.format(next(self._ack_ids))
+                subscription.lease(ack_id, message, deadline)
+                received.append(
+                    types.ReceivedMessage(ack_id=ack_id, message=message))
+
+            subscription.delivered += len(received)
+            return received
+
+    def acknowledge(self, name, ack_ids):
+        with self.condition:
+            subscription = self.subscriptions.get(name)
+            if subscription is None:
+                return False
+            for ack_id in ack_ids:
+                if subscription.outstanding.pop(ack_id, None) is not None:
+                    subscription.acked += 1
+            return True
+
+    def modify_ack_deadline(self, name, ack_ids, seconds):
+        # NOTE: A deadline of ``0`` is a "nack" and makes the message
+        #       available for immediate redelivery.
+        with self.condition:
+            subscription = self.subscriptions.get(name)
+            if subscription is None:
+                return False
+            now = time.time()
+            nacked = False
+            for ack_id, ack_seconds in zip(ack_ids, _per_ack_id(seconds)):
+                info = subscription.outstanding.get(ack_id)
+                if info is None:
+                    continue
+                subscription.lease(ack_id, info[1], now + ack_seconds)
+                nacked = nacked or ack_seconds == 0
+            if nacked:
+                self.condition.notify_all()
+            return True
+
+
+def _per_ack_id(seconds):
+    # seconds: Union[int, List[int]]
+    if isinstance(seconds, list):
+        return seconds
+    return itertools.repeat(seconds)
+
+
+def _not_found(context, kind, name):
+    context.set_code(grpc.StatusCode.NOT_FOUND)
+    context.set_details('Resource not found ({}={}).'.format(kind, name))
+
+
+def _already_exists(context, kind, name):
+    context.set_code(grpc.StatusCode.ALREADY_EXISTS)
+    context.set_details('Resource already exists ({}={}).'.format(kind, name))
+
+
+class Servicer(object):
+    """Handlers for the subset of RPCs used by the scenarios."""
+
+    def __init__(self, backend):
+        self.backend = backend
+
+    def create_topic(self, request, context):
+        if not self.backend.create_topic(request.name):
+            _already_exists(context, 'topic', request.name)
+        return types.Topic(name=request.name)
+
+    def get_topic(self, request, context):
+        if not self.backend.has_topic(request.topic):
+            _not_found(context, 'topic', request.topic)
+        return types.Topic(name=request.topic)
+
+    def delete_topic(self, request, context):
+        if not self.backend.delete_topic(request.topic):
+            _not_found(context, 'topic', request.topic)
+        return empty_pb2.Empty()
+
+    def publish(self, request, context):
+        message_ids = self.backend.publish(request.topic, request.messages)
+        if message_ids is None:
+            _not_found(context, 'topic', request.topic)
+            message_ids = ()
+        return types.PublishResponse(message_ids=message_ids)
+
+    def create_subscription(self, request, context):
+        try:
+            subscription = self.backend.create_subscription(
+                request.name, request.topic, request.ack_deadline_seconds)
+        except KeyError:
+            _not_found(context, 'topic', request.topic)
+            return types.Subscription(name=request.name)
+
+        if subscription is None:
+            _already_exists(context, 'subscription', request.name)
+            return types.Subscription(name=request.name)
+
+        return types.Subscription(
+            name=request.name, topic=request.topic,
+            ack_deadline_seconds=subscription.ack_deadline)
+
+    def get_subscription(self, request, context):
+        subscription = self.backend.get_subscription(request.subscription)
+        if subscription is None:
+            _not_found(context, 'subscription', request.subscription)
+            return types.Subscription(name=request.subscription)
+
+        return types.Subscription(
+            name=subscription.name, topic=subscription.topic,
+            ack_deadline_seconds=subscription.ack_deadline)
+
+    def delete_subscription(self, request, context):
+        if not self.backend.delete_subscription(request.subscription):
+            _not_found(context, 'subscription', request.subscription)
+        return empty_pb2.Empty()
+
+    def pull(self, request, context):
+        timeout = 0.0 if request.return_immediately else POLL_INTERVAL
+        received = self.backend.pull(
+            request.subscription, request.max_messages or MAX_RECEIVED,
+            None, timeout)
+        if received is None:
+            _not_found(context, 'subscription', request.subscription)
+            received = ()
+        return types.PullResponse(received_messages=received)
+
+    def acknowledge(self, request, context):
+        if not self.backend.acknowledge(
+                request.subscription, request.ack_ids):
+            _not_found(context, 'subscription', request.subscription)
+        return empty_pb2.Empty()
+
+    def modify_ack_deadline(self, request, context):
+        if not self.backend.modify_ack_deadline(
+                request.subscription, request.ack_ids,
+                request.ack_deadline_seconds):
+            _not_found(context, 'subscription', request.subscription)
+        return empty_pb2.Empty()
+
+    def _handle_stream_request(self, name, request):
+        if request.ack_ids:
+            self.backend.acknowledge(name, request.ack_ids)
+        if request.modify_deadline_ack_ids:
+            self.backend.modify_ack_deadline(
+                name, request.modify_deadline_ack_ids,
+                list(request.modify_deadline_seconds))
+
+    def _consume_stream(self, name, request_iterator, closed):
+        try:
+            for request in request_iterator:
+                self._handle_stream_request(name, request)
+        except grpc.RpcError:
+            pass
+        finally:
+            closed.set()
+
+    def streaming_pull(self, request_iterator, context):
+        try:
+            first = next(request_iterator)
+        except StopIteration:
+            return
+
+        name = first.subscription
+        if self.backend.get_subscription(name) is None:
+            _not_found(context, 'subscription', name)
+            return
+
+        ack_deadline = first.stream_ack_deadline_seconds
+        self._handle_stream_request(name, first)
+
+        # NOTE: Requests (acks / modacks) are consumed on a separate
+        #       thread so that responses can be sent while the client
+        #       is idle.
+        closed = threading.Event()
+        consumer = threading.Thread(
+            target=self._consume_stream,
+            args=(name, request_iterator, closed),
+            name='{}-StreamConsumer'.format(THREAD_PREFIX),
+        )
+        consumer.daemon = True
+        consumer.start()
+
+        while context.is_active() and not closed.is_set():
+            received = self.backend.pull(
+                name, MAX_RECEIVED, ack_deadline, POLL_INTERVAL)
+            if received is None:
+                _not_found(context, 'subscription', name)
+                return
+            if received:
+                yield types.StreamingPullResponse(received_messages=received)
+
+
+def _unary(behavior, request_class, response_class):
+    return grpc.unary_unary_rpc_method_handler(
+        behavior,
+        request_deserializer=request_class.FromString,
+        response_serializer=response_class.SerializeToString,
+    )
+
+
+def generic_handlers(servicer):
+    publisher_handlers = {
+        'CreateTopic': _unary(
+            servicer.create_topic, types.Topic, types.Topic),
+        'GetTopic': _unary(
+            servicer.get_topic, types.GetTopicRequest, types.Topic),
+        'DeleteTopic': _unary(
+            servicer.delete_topic, types.DeleteTopicRequest,
+            empty_pb2.Empty),
+        'Publish': _unary(
+            servicer.publish, types.PublishRequest, types.PublishResponse),
+    }
+    subscriber_handlers = {
+        'CreateSubscription': _unary(
+            servicer.create_subscription, types.Subscription,
+            types.Subscription),
+        'GetSubscription': _unary(
+            servicer.get_subscription, types.GetSubscriptionRequest,
+            types.Subscription),
+        'DeleteSubscription': _unary(
+            servicer.delete_subscription, types.DeleteSubscriptionRequest,
+            empty_pb2.Empty),
+        'Pull': _unary(
+            servicer.pull, types.PullRequest, types.PullResponse),
+        'Acknowledge': _unary(
+            servicer.acknowledge, types.AcknowledgeRequest, empty_pb2.Empty),
+        'ModifyAckDeadline': _unary(
+            servicer.modify_ack_deadline, types.ModifyAckDeadlineRequest,
+            empty_pb2.Empty),
+        'StreamingPull': grpc.stream_stream_rpc_method_handler(
+            servicer.streaming_pull,
+            request_deserializer=types.StreamingPullRequest.FromString,
+            response_serializer=(
+                types.StreamingPullResponse.SerializeToString),
+        ),
+    }
+    return (
+        grpc.method_handlers_generic_handler(
+            PUBLISHER_SERVICE, publisher_handlers),
+        grpc.method_handlers_generic_handler(
+            SUBSCRIBER_SERVICE, subscriber_handlers),
+    )
+
+
+@contextlib.contextmanager
+def _untracked_spawns():
+    # NOTE: ``grpc`` spawns its own (unnamed) threads when a server
+    #       starts and stops, so we flag the current thread while that
+    #       happens.
+    _STARTING.active = True
+    try:
+        yield
+    finally:
+        _STARTING.active = False
+
+
+def is_untracked(kwargs):
+    """Check if a thread about to be created belongs to the fake server.
+
+    Args:
+        kwargs (dict): The keyword arguments passed to ``threading.Thread``.
+
+    Returns:
+        bool: Indicates if the thread should be left out of tracking.
+    """
+    if getattr(_STARTING, 'active', False):
+        return True
+    name = kwargs.get('name') or ''
+    return name.startswith(THREAD_PREFIX)
+
+
+def serve(address='localhost:0', backend=None):
+    """Start a fake Pub / Sub server.
+
+    Returns:
+        Tuple[grpc.Server, Backend, str]: The server, the in-memory backend
+        and the ``host:port`` it is listening on.
+    """
+    if backend is None:
+        backend = Backend()
+
+    executor = futures.ThreadPoolExecutor(
+        max_workers=MAX_WORKERS,
+        thread_name_prefix='{}-Worker'.format(THREAD_PREFIX),
+    )
+    server = grpc.server(
+        executor, handlers=generic_handlers(Servicer(backend)))
+    port = server.add_insecure_port(address)
+    host = '{}:{:d}'.format(address.rsplit(':', 1)[0], port)
+    with _untracked_spawns():
+        server.start()
+
+    return server, backend, host
+
+
+def make_channel():
+    """Create a channel to the in-process server (started if needed)."""
+    with SERVER_LOCK:
+        if 'server' not in SERVER_STATE:
+            server, backend, host = serve()
+            SERVER_STATE.update(server=server, backend=backend, host=host)
+        host = SERVER_STATE['host']
+
+    return grpc.insecure_channel(host)
+
+
+def stop():
+    """Stop the in-process server, if it was started."""
+    with SERVER_LOCK:
+        server = SERVER_STATE.pop('server', None)
+        SERVER_STATE.clear()
+        if server is not None:
+            with _untracked_spawns():
+                server.stop(None)
+
+
+def get_args():
+    parser = argparse.ArgumentParser(
+        description='Run a fake Pub / Sub server (for PUBSUB_EMULATOR_HOST).')
+    parser.add_argument('--port', type=int, default=8085)
+    return parser.parse_args()
+
+
+def main():
+    args = get_args()
+    server, _, host = serve(address='localhost:{:d}'.format(args.port))
+    print('Listening on {}'.format(host))
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.stop(None)
+
+
+if __name__ == '__main__':
+    main()
@@ -22,6 +22,7 @@ import six
 
 import thread_names
 import utils
+import zombies
 
 
 CURR_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -92,11 +93,15 @@ def main():
 
     # Do clean-up.
     subscription.close()
+    detector = zombies.ZombieDetector()
     publisher.delete_topic(topic_path)
     subscriber.delete_subscription(subscription_path)
     thread_names.save_tree(CURR_DIR, logger)
+    utils.stop_gil_probe(logger)
+    utils.stop_profiler(logger)
     thread_names.restore()
     utils.restore()
+    detector.check(logger)
 
 
 if __name__ == '__main__':
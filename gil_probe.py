@@ -0,0 +1,184 @@
+# Copyright 2017 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Estimate GIL contention from late wake-ups.
+
+A probe thread repeatedly sleeps for a short interval. Since ``sleep()``
+releases the GIL, a wake-up is late by roughly the time spent waiting to
+get the GIL back. Late wake-ups ("stalls") are blamed on the threads
+that the sampling profiler (see ``profiler.py``) most recently observed
+running Python code, so the probe itself never walks thread stacks.
+
+Threads holding the GIL inside a C extension (without running any
+Python code) can't be seen this way.
+"""
+
+import threading
+import time
+
+
+DEFAULT_INTERVAL = 0.005  # seconds
+DEFAULT_STALL_THRESHOLD = 0.002  # seconds
+THREAD_NAME = 'Thread-GilProbe'
+UNKNOWN = '<unknown>'
+TOP_BLAMED = 3
+SUMMARY_TEMPLATE = (
+    'GIL blocked {:.1f}% of the time ({:d} stalls, max {:.3f}ms), '
+    'mostly by {}')
+FINAL_TEMPLATE = """\
+GIL probe totals:
+  {}
+wake-up lag (us):
+{}"""
+
+
+class _Window(object):
+    """Counters for the wake-ups since ``start``."""
+
+    def __init__(self, start):
+        self.start = start
+        self.num_wakeups = 0
+        self.num_stalls = 0
+        self.total_lag = 0.0
+        self.max_lag = 0.0
+        # blame: Dict[str, float] (thread kind -> stall seconds)
+        self.blame = {}
+
+    def summary(self, now):
+        elapsed = max(now - self.start, 1e-9)
+        total_blame = sum(self.blame.values())
+        if total_blame:
+            blamed = sorted(
+                self.blame.items(), key=lambda item: (-item[1], item[0]))
+            culprits = ', '.join(
+                '{} ({:.0f}%)'.format(kind, 100.0 * seconds / total_blame)
+                for kind, seconds in blamed[:TOP_BLAMED])
+        else:
+            culprits = '<nobody>'
+        return SUMMARY_TEMPLATE.format(
+            100.0 * self.total_lag / elapsed, self.num_stalls,
+            1000.0 * self.max_lag, culprits)
+
+
+class GilProbe(object):
+    """Measures wake-up lag on a background thread.
+
+    Args:
+        interval (float): How long the probe sleeps between wake-ups.
+        stall_threshold (float): The lag at which a wake-up counts as a
+            stall (and is blamed on other threads).
+        observer (Optional[profiler.SamplingProfiler]): Provides the
+            threads observed running (via ``running_threads()``). Without
+            it, stalls are blamed on ``<unknown>``.
+    """
+
+    def __init__(
+            self, interval=DEFAULT_INTERVAL,
+            stall_threshold=DEFAULT_STALL_THRESHOLD, observer=None):
+        self.interval = interval
+        self.stall_threshold = stall_threshold
+        self.observer = observer
+        self._lock = threading.Lock()
+        now = time.time()
+        self.totals = _Window(now)
+        self.window = _Window(now)
+        # lags[k]: The number of wake-ups with lag ``t`` (in microseconds)
+        #          such that ``2**(k-1) <= t < 2**k``.
+        self.lags = [0] * 64
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def _blamed(self, own_ident):
+        """Get the kinds of the threads a stall is blamed on.
+
+        Returns:
+            List[str]: The kinds (one per thread, so may repeat).
+        """
+        if self.observer is None:
+            return [UNKNOWN]
+        return [
+            kind for ident, kind in self.observer.running_threads()
+            if ident != own_ident
+        ]
+
+    def _record(self, lag, own_ident):
+        micros = max(int(1e6 * lag), 0)
+        blamed = ()
+        if lag >= self.stall_threshold:
+            blamed = self._blamed(own_ident)
+
+        with self._lock:
+            self.lags[micros.bit_length()] += 1
+            for window in (self.totals, self.window):
+                window.num_wakeups += 1
+                window.total_lag += lag
+                window.max_lag = max(window.max_lag, lag)
+                if lag < self.stall_threshold:
+                    continue
+                window.num_stalls += 1
+                # NOTE: Split the stall evenly between the threads that
+                #       ran during it.
+                for kind in blamed:
+                    window.blame[kind] = (
+                        window.blame.get(kind, 0.0) + lag / len(blamed))
+
+    def _run(self):
+        own_ident = threading.current_thread().ident
+        while not self._stopped.is_set():
+            expected = time.time() + self.interval
+            time.sleep(self.interval)
+            lag = max(time.time() - expected, 0.0)
+            self._record(lag, own_ident)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name=THREAD_NAME)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def take_summary(self):
+        """Summarize the wake-ups since the last call and start over.
+
+        Returns:
+            str: e.g. ``GIL blocked 40.0% of the time (...), mostly by
+            gRPC-StopChannelSpin (63%), ...``.
+        """
+        now = time.time()
+        with self._lock:
+            window = self.window
+            self.window = _Window(now)
+        return window.summary(now)
+
+    def _format_lags(self):
+        lines = []
+        for bucket, count in enumerate(self.lags):
+            if count == 0:
+                continue
+            if bucket == 0:
+                label = '[0, 1)'
+            else:
+                label = '[{:d}, {:d})'.format(2 ** (bucket - 1), 2 ** bucket)
+            lines.append('  {:>20} {:d}'.format(label, count))
+        return '\n'.join(lines) or '  <none>'
+
+    def final_summary(self):
+        # Returns: str (totals for the whole run, with the lag histogram)
+        with self._lock:
+            summary = self.totals.summary(time.time())
+            return FINAL_TEMPLATE.format(summary, self._format_lags())
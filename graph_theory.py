@@ -12,7 +12,36 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+from __future__ import print_function
+
+import argparse
+import collections
+import itertools
+import os
+import re
+import subprocess
+
+from concurrent import futures
 import pydot
+import six
+
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SAME = 'same'
+ADDED = 'added'
+REMOVED = 'removed'
+REWEIGHTED = 'reweighted'
+DIFF_COLORS = {
+    SAME: 'black',
+    ADDED: 'darkgreen',
+    REMOVED: 'red',
+    REWEIGHTED: 'orange',
+}
+DOT_EDGE = re.compile(
+    r'^\s*("[^"]*"|[^\s"]+)\s*->\s*("[^"]*"|[^\s";]+)'
+    r'(?:\s*\[label="?(\d+)"?\])?\s*;')
+DOT_PROGRAM = 'dot'
+ORDINAL_SUFFIX = re.compile(r'\+[+0-9]*$')
 
 
 class Tree(object):
@@ -22,31 +51,52 @@ class Tree(object):
         # parent: Optional[Tree]
         self.name = name
         self.parent = parent
-        # children: Tuple[Tree]
-        self.children = ()
+        # children: List[Tree]
+        self.children = []
         # weight: int
-        self.weight = 1
+        self.weight = weight
+        # NOTE: The index is shared by every node in a tree and is
+        #       maintained by ``add_child()``.
+        # index: Dict[str, List[Tree]]
+        if parent is None:
+            self.index = {name: [self]}
+        else:
+            self.index = parent.index
+        # _size: int (cached size of the subtree rooted here)
+        self._size = 1
+        # _structure_id: Optional[int] (set by ``structure_id()``)
+        self._structure_id = None
+
+    @property
+    def root(self):
+        # Returns: Tree
+        node = self
+        while node.parent is not None:
+            node = node.parent
+        return node
 
     @property
     def size(self):
         # Returns: int
-        result = 1  # Count self.
-        for child in self.children:
-            result += child.size
-        return result
+        return self._size
+
+    def is_ancestor_of(self, node):
+        # node: Tree
+        # Returns: bool
+        while node is not None:
+            if node is self:
+                return True
+            node = node.parent
+        return False
 
     def get(self, name):
         # name: str
         # Returns: Optional[Tree]
         # Raises: RuntimeError
-        if name == self.name:
-            return self
-
-        matches = []
-        for child in self.children:
-            match = child.get(name)
-            if match is not None:
-                matches.append(match)
+        matches = self.index.get(name, ())
+        if self.parent is not None:
+            matches = [match for match in matches
+                       if self.is_ancestor_of(match)]
 
         if len(matches) == 0:
             return None
@@ -57,8 +107,33 @@ class Tree(object):
 
     def add_child(self, name):
         # name: str
+        # Returns: Tree
         new_node = Tree(name, self)
-        self.children += (new_node,)
+        self.children.append(new_node)
+        self.index.setdefault(name, []).append(new_node)
+
+        node = self
+        while node is not None:
+            node._size += 1
+            node = node.parent
+
+        return new_node
+
+    def _reindex(self):
+        # NOTE: Must be called on the root, e.g. after ``collapse()``
+        #       has removed nodes.
+        self.index.clear()
+        self._update_index(self.index)
+
+    def _update_index(self, index):
+        # index: Dict[str, List[Tree]]
+        # Returns: int (the size of this subtree)
+        self.index = index
+        index.setdefault(self.name, []).append(self)
+        self._size = 1
+        for child in self.children:
+            self._size += child._update_index(index)
+        return self._size
 
     def is_same(self, node):
         # node: Tree
@@ -76,24 +151,35 @@ class Tree(object):
 
         return True
 
+    def structure_id(self, table):
+        # table: Dict[Tuple[str, Tuple[int, ...]], int] (shared by all
+        #        nodes being compared)
+        # Returns: int (equal for two subtrees exactly when ``is_same()``)
+        child_ids = tuple(child.structure_id(table) for child in self.children)
+        key = clean_name(self.name), child_ids
+        self._structure_id = table.setdefault(key, len(table))
+        return self._structure_id
+
     def collapse(self):
-        uniques = []
+        # NOTE: IDs are computed before anything is collapsed, so
+        #       siblings are compared on their uncollapsed subtrees.
+        self.structure_id({})
+        self._collapse()
+        self.root._reindex()
+
+    def _collapse(self):
+        # uniques: Dict[int, Tree] (insertion ordered)
+        uniques = collections.OrderedDict()
         for child in self.children:
-            matched = []
-            for existing in uniques:
-                if child.is_same(existing):
-                    matched.append(existing)
-
-            if len(matched) == 0:
-                uniques.append(child)
-            elif len(matched) == 1:
-                matched[0].weight += 1
+            existing = uniques.get(child._structure_id)
+            if existing is None:
+                uniques[child._structure_id] = child
             else:
-                raise RuntimeError('Too many matches', matches)
+                existing.weight += 1
 
-        self.children = tuple(uniques)
+        self.children = list(uniques.values())
         for child in self.children:
-            child.collapse()
+            child._collapse()
 
     def pydot(self, names=None):
         if names is None:
@@ -134,24 +220,530 @@ class Tree(object):
 
         return graph
 
-    def save_graphviz(self, filename_base):
+    def write_dot(self, writer):
+        # writer: DotWriter
+        # NOTE: This is the same graph as ``pydot()``, without building it.
+        relabeled = []
+        to_visit = [self]
+        while to_visit:
+            node = to_visit.pop()
+            if clean_name(node.name) != node.name:
+                relabeled.append(node.name)
+            for child in node.children:
+                if child.weight == 1:
+                    writer.edge(node.name, child.name)
+                else:
+                    writer.edge(node.name, child.name, label=child.weight)
+            to_visit.extend(reversed(node.children))
+
+        for name in relabeled:
+            writer.node(name, label=clean_name(name))
+
+    def save_graphviz(self, filename_base, svg=True):
         self.collapse()
+        save_graph(self, filename_base, svg=svg)
 
-        graph = self.pydot()
 
-        filename_dot = '{}.dot'.format(filename_base)
-        with open(filename_dot, 'w') as file_obj:
-            file_obj.write(graph.to_string())
-        print('Created {}'.format(filename_dot))
+class MergedTree(object):
+    """A thread tree folded together from many runs."""
 
-        filename_svg = '{}.svg'.format(filename_base)
-        with open(filename_svg, 'wb') as file_obj:
-            file_obj.write(graph.create_svg())
-        print('Created {}'.format(filename_svg))
+    def __init__(self, name, parent):
+        # name: str (a cleaned name)
+        # parent: Optional[MergedTree]
+        self.name = name
+        self.parent = parent
+        # children: Dict[str, MergedTree] (insertion ordered)
+        self.children = collections.OrderedDict()
+        # count: int (number of runs the node appeared in)
+        self.count = 0
+        self.weight_min = None
+        self.weight_max = None
+        self.weight_total = 0
+        # num_runs: int (only updated on the root)
+        self.num_runs = 0
+
+    @property
+    def weight_mean(self):
+        # Returns: float
+        if self.count == 0:
+            return 0.0
+        return float(self.weight_total) / self.count
+
+    def child(self, name):
+        # name: str (a cleaned name)
+        # Returns: MergedTree
+        result = self.children.get(name)
+        if result is None:
+            result = MergedTree(name, self)
+            self.children[name] = result
+        return result
+
+    def record(self, weight):
+        # weight: int
+        self.count += 1
+        self.weight_total += weight
+        if self.weight_min is None or weight < self.weight_min:
+            self.weight_min = weight
+        if self.weight_max is None or weight > self.weight_max:
+            self.weight_max = weight
+
+    def walk(self):
+        # Returns: Iterator[MergedTree] (breadth-first)
+        to_visit = collections.deque([self])
+        while to_visit:
+            node = to_visit.popleft()
+            yield node
+            to_visit.extend(node.children.values())
+
+    def add_run(self, tree):
+        # tree: Tree (possibly collapsed)
+        # Raises: ValueError
+        # NOTE: Nodes are matched by the path of cleaned names from the
+        #       root, and weighted by the total number of threads at that
+        #       path (so collapsed and uncollapsed trees merge the same).
+        if clean_name(tree.name) != self.name:
+            raise ValueError('Root mismatch', tree.name, self.name)
+
+        # totals: Dict[MergedTree, int] (insertion ordered)
+        totals = collections.OrderedDict()
+        to_visit = collections.deque([(tree, self, 1)])
+        while to_visit:
+            node, merged_node, multiplicity = to_visit.popleft()
+            for child in node.children:
+                merged_child = merged_node.child(clean_name(child.name))
+                child_total = multiplicity * child.weight
+                totals[merged_child] = (
+                    totals.get(merged_child, 0) + child_total)
+                to_visit.append((child, merged_child, child_total))
+
+        self.num_runs += 1
+        self.record(1)
+        for merged_node, total in six.iteritems(totals):
+            merged_node.record(total)
+
+    def write_dot(self, writer):
+        # writer: DotWriter
+        node_ids = {}
+        for node in self.walk():
+            node_id = 'n{:d}'.format(len(node_ids))
+            node_ids[node] = node_id
+            writer.node(node_id, label='{}\\n{:d}/{:d} runs'.format(
+                node.name, node.count, self.num_runs))
+
+            if node.parent is None:
+                continue
+
+            attributes = {
+                'label': '{:d} / {:.1f} / {:d}'.format(
+                    node.weight_min, node.weight_mean, node.weight_max),
+            }
+            # Spawn patterns that don't occur in every run are flaky.
+            if node.count != self.num_runs:
+                attributes['style'] = 'dashed'
+            writer.edge(node_ids[node.parent], node_id, **attributes)
+
+
+class DiffTree(object):
+    """The difference between two (collapsed) thread trees."""
+
+    def __init__(self, name, parent, status, old_weight, new_weight):
+        # name: str (a cleaned name)
+        # parent: Optional[DiffTree]
+        # status: str (``SAME``, ``ADDED``, ``REMOVED`` or ``REWEIGHTED``)
+        # old_weight: Optional[int]
+        # new_weight: Optional[int]
+        self.name = name
+        self.parent = parent
+        self.status = status
+        self.old_weight = old_weight
+        self.new_weight = new_weight
+        # children: List[DiffTree]
+        self.children = []
+
+    @property
+    def path(self):
+        # Returns: Tuple[str, ...]
+        parts = []
+        node = self
+        while node is not None:
+            parts.append(node.name)
+            node = node.parent
+        return tuple(reversed(parts))
+
+    def walk(self):
+        # Returns: Iterator[DiffTree] (depth-first)
+        to_visit = [self]
+        while to_visit:
+            node = to_visit.pop()
+            yield node
+            to_visit.extend(reversed(node.children))
+
+    def changes(self):
+        # Returns: Iterator[DiffTree] (depth-first, skipping everything
+        #          below an added / removed node)
+        to_visit = [self]
+        while to_visit:
+            node = to_visit.pop()
+            if node.status != SAME:
+                yield node
+                if node.status != REWEIGHTED:
+                    continue
+            to_visit.extend(reversed(node.children))
+
+    def report(self):
+        # Returns: str
+        lines = []
+        for node in self.changes():
+            path = ' -> '.join(node.path)
+            if node.status == ADDED:
+                lines.append('+ {} (weight={})'.format(path, node.new_weight))
+            elif node.status == REMOVED:
+                lines.append('- {} (weight={})'.format(path, node.old_weight))
+            else:
+                lines.append('~ {} (weight={} -> {})'.format(
+                    path, node.old_weight, node.new_weight))
+        return '\n'.join(lines)
+
+    def write_dot(self, writer):
+        # writer: DotWriter
+        node_ids = {}
+        for node in self.walk():
+            node_id = 'n{:d}'.format(len(node_ids))
+            node_ids[node] = node_id
+            color = DIFF_COLORS[node.status]
+            writer.node(node_id, label=node.name, color=color)
+
+            if node.parent is None:
+                continue
+
+            attributes = {'color': color}
+            if node.status == REWEIGHTED:
+                attributes['label'] = '{} -> {}'.format(
+                    node.old_weight, node.new_weight)
+            else:
+                if node.status == REMOVED:
+                    weight = node.old_weight
+                else:
+                    weight = node.new_weight
+                if weight != 1:
+                    attributes['label'] = weight
+            writer.edge(node_ids[node.parent], node_id, **attributes)
+
+
+class DotWriter(object):
+    """Context manager that writes a DOT digraph, one statement per line."""
+
+    def __init__(self, file_obj, rankdir='LR'):
+        self.file_obj = file_obj
+        self.rankdir = rankdir
+
+    def __enter__(self):
+        self.file_obj.write('digraph G {\n')
+        if self.rankdir is not None:
+            self.file_obj.write('rankdir={};\n'.format(self.rankdir))
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.file_obj.write('}\n')
+
+    @staticmethod
+    def _attributes(attributes):
+        if not attributes:
+            return ''
+        parts = ['{}={}'.format(key, dot_quote(value))
+                 for key, value in sorted(six.iteritems(attributes))]
+        return '  [{}]'.format(', '.join(parts))
+
+    def node(self, node_id, **attributes):
+        self.file_obj.write('{}{};\n'.format(
+            dot_quote(node_id), self._attributes(attributes)))
+
+    def edge(self, source, target, **attributes):
+        self.file_obj.write('{} -> {}{};\n'.format(
+            dot_quote(source), dot_quote(target),
+            self._attributes(attributes)))
+
+
+def dot_quote(value):
+    # NOTE: Backslashes are left alone so that escapes such as ``\n``
+    #       in labels are interpreted by Graphviz.
+    return '"{}"'.format(str(value).replace('"', '\\"'))
 
 
 def clean_name(name):
-    result = name.rstrip('+')
+    # NOTE: Duplicate names have a ``+N`` ordinal (older artifacts used
+    #       one or more trailing ``+``-s instead).
+    result = ORDINAL_SUFFIX.sub('', name)
     if result[:7] == 'Thread-':
         result = result[7:]
     return result
+
+
+def save_graph(tree, filename_base, svg=True):
+    # tree: Union[Tree, MergedTree, DiffTree]
+    # filename_base: str (without an extension)
+    filename_dot = '{}.dot'.format(filename_base)
+    with open(filename_dot, 'w') as file_obj:
+        with DotWriter(file_obj) as writer:
+            tree.write_dot(writer)
+    print('Created {}'.format(filename_dot))
+
+    if svg:
+        filename_svg = render_svg(filename_dot)
+        print('Created {}'.format(filename_svg))
+
+
+def render_svg(filename_dot):
+    # Returns: str (the ``.svg`` filename)
+    filename_svg = '{}.svg'.format(filename_dot[:-4])
+    subprocess.check_call(
+        (DOT_PROGRAM, '-Tsvg', '-o', filename_svg, filename_dot))
+    return filename_svg
+
+
+def render_all(filenames, max_workers=None):
+    # filenames: Iterable[str] (``.dot`` files)
+    # Returns: List[str] (the ``.svg`` filenames)
+    with futures.ProcessPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(render_svg, filenames))
+
+
+def _unquote(value):
+    if value.startswith('"') and value.endswith('"'):
+        return value[1:-1]
+    return value
+
+
+def load_dot(filename, root_name='MainThread'):
+    # Returns: Tree (collapsed, as saved by ``save_graphviz()``)
+    # NOTE: Only the edges (and their weight labels) are needed, so this
+    #       parses lines rather than using ``pydot``.
+    # edges: Dict[str, List[Tuple[str, int]]]
+    edges = collections.defaultdict(list)
+    with open(filename, 'r') as file_obj:
+        for line in file_obj:
+            match = DOT_EDGE.match(line)
+            if match is None:
+                continue
+            parent, child, weight = match.groups()
+            weight = 1 if weight is None else int(weight)
+            edges[_unquote(parent)].append((_unquote(child), weight))
+
+    root = Tree(root_name, None)
+    to_visit = collections.deque([root])
+    while to_visit:
+        node = to_visit.popleft()
+        for name, weight in edges.get(node.name, ()):
+            child = node.add_child(name)
+            child.weight = weight
+            to_visit.append(child)
+
+    return root
+
+
+def merge_trees(trees):
+    # trees: Iterable[Tree] (one per run)
+    # Returns: Optional[MergedTree]
+    merged = None
+    for tree in trees:
+        if merged is None:
+            merged = MergedTree(clean_name(tree.name), None)
+        merged.add_run(tree)
+    return merged
+
+
+def _one_sided(node, parent, status):
+    # node: Tree
+    # Returns: DiffTree
+    if status == ADDED:
+        result = DiffTree(clean_name(node.name), parent, status,
+                          None, node.weight)
+    else:
+        result = DiffTree(clean_name(node.name), parent, status,
+                          node.weight, None)
+    for child in node.children:
+        result.children.append(_one_sided(child, result, status))
+    return result
+
+
+def _pair_children(old_node, new_node):
+    # Returns: List[Tuple[Optional[Tree], Optional[Tree]]] (new children,
+    #          then removed ones)
+    # NOTE: Within a cleaned name, children with the same structure are
+    #       paired first and any that remain are paired in order.
+    # old_by_name: Dict[str, List[Tree]] (insertion ordered)
+    old_by_name = collections.OrderedDict()
+    for child in old_node.children:
+        old_by_name.setdefault(clean_name(child.name), []).append(child)
+
+    # matches: Dict[Tree, Optional[Tree]] (new child -> old child)
+    matches = {}
+    unmatched_new = collections.OrderedDict()
+    for child in new_node.children:
+        name = clean_name(child.name)
+        candidates = old_by_name.get(name, ())
+        for index, candidate in enumerate(candidates):
+            if candidate._structure_id == child._structure_id:
+                matches[child] = candidates.pop(index)
+                break
+        else:
+            unmatched_new.setdefault(name, []).append(child)
+
+    for name, children in six.iteritems(unmatched_new):
+        candidates = old_by_name.get(name, [])
+        for child in children:
+            if candidates:
+                matches[child] = candidates.pop(0)
+            else:
+                matches[child] = None
+
+    pairs = [(matches[child], child) for child in new_node.children]
+    for candidates in six.itervalues(old_by_name):
+        for child in candidates:
+            pairs.append((child, None))
+
+    return pairs
+
+
+def _diff_nodes(old_node, new_node, parent):
+    # Returns: DiffTree
+    if old_node.weight == new_node.weight:
+        status = SAME
+    else:
+        status = REWEIGHTED
+    result = DiffTree(clean_name(new_node.name), parent, status,
+                      old_node.weight, new_node.weight)
+
+    for old_child, new_child in _pair_children(old_node, new_node):
+        if old_child is None:
+            child = _one_sided(new_child, result, ADDED)
+        elif new_child is None:
+            child = _one_sided(old_child, result, REMOVED)
+        else:
+            child = _diff_nodes(old_child, new_child, result)
+        result.children.append(child)
+
+    return result
+
+
+def diff_trees(old, new):
+    # old: Tree (e.g. from an older version)
+    # new: Tree
+    # Returns: DiffTree
+    # NOTE: Both trees must share a table so structure IDs are comparable.
+    table = {}
+    old.structure_id(table)
+    new.structure_id(table)
+    return _diff_nodes(old, new, None)
+
+
+def _dot_files(directory):
+    return sorted(
+        os.path.join(directory, filename)
+        for filename in os.listdir(directory)
+        if filename.endswith('.dot') and not filename.startswith('diff-'))
+
+
+def diff_all(directories):
+    # Returns: Iterator[Tuple[str, str, DiffTree]] (every pair of trees
+    #          within each directory)
+    for directory in directories:
+        trees = [(filename, load_dot(filename))
+                 for filename in _dot_files(directory)]
+        for (old_name, old), (new_name, new) in itertools.combinations(
+                trees, 2):
+            yield old_name, new_name, diff_trees(old, new)
+
+
+def get_args():
+    parser = argparse.ArgumentParser(
+        description='Post-process thread trees saved as .dot files.')
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+
+    merge_parser = subparsers.add_parser(
+        'merge', help='Merge the trees from many runs.')
+    merge_parser.add_argument('--output', required=True,
+                              help='Filename base for .dot / .svg output.')
+    merge_parser.add_argument('filenames', nargs='+')
+
+    diff_parser = subparsers.add_parser(
+        'diff', help='Diff the trees from two runs.')
+    diff_parser.add_argument('--output',
+                             help='Filename base for .dot / .svg output.')
+    diff_parser.add_argument('old')
+    diff_parser.add_argument('new')
+
+    diff_all_parser = subparsers.add_parser(
+        'diff-all', help='Diff every pair of trees in scenario directories.')
+    diff_all_parser.add_argument(
+        'directories', nargs='*',
+        help='Defaults to every directory with .dot files.')
+    diff_all_parser.add_argument(
+        '--render', action='store_true',
+        help='Save each diff as diff-<old>-<new>.dot / .svg.')
+
+    render_parser = subparsers.add_parser(
+        'render', help='Render .dot files as .svg in a process pool.')
+    render_parser.add_argument(
+        'filenames', nargs='*',
+        help='Defaults to the .dot files in every scenario directory.')
+    render_parser.add_argument('--jobs', type=int, default=None)
+
+    return parser.parse_args()
+
+
+def _scenario_directories():
+    return sorted(
+        path for path in (
+            os.path.join(HERE, name) for name in os.listdir(HERE))
+        if os.path.isdir(path) and _dot_files(path))
+
+
+def _print_diff(old_name, new_name, diff):
+    print('{} -> {}'.format(old_name, new_name))
+    report = diff.report()
+    if report:
+        print(report)
+    else:
+        print('(no changes)')
+
+
+def main():
+    args = get_args()
+    if args.command == 'merge':
+        trees = (load_dot(filename) for filename in args.filenames)
+        merged = merge_trees(trees)
+        save_graph(merged, args.output)
+    elif args.command == 'diff':
+        diff = diff_trees(load_dot(args.old), load_dot(args.new))
+        _print_diff(args.old, args.new, diff)
+        if args.output is not None:
+            save_graph(diff, args.output)
+    elif args.command == 'diff-all':
+        directories = args.directories or _scenario_directories()
+        to_render = []
+        for old_name, new_name, diff in diff_all(directories):
+            _print_diff(old_name, new_name, diff)
+            print('')
+            if args.render:
+                filename_base = os.path.join(
+                    os.path.dirname(old_name), 'diff-{}-{}'.format(
+                        os.path.basename(old_name)[:-4],
+                        os.path.basename(new_name)[:-4]))
+                save_graph(diff, filename_base, svg=False)
+                to_render.append('{}.dot'.format(filename_base))
+        for filename_svg in render_all(to_render):
+            print('Created {}'.format(filename_svg))
+    elif args.command == 'render':
+        filenames = args.filenames
+        if not filenames:
+            filenames = [
+                filename for directory in _scenario_directories()
+                for filename in _dot_files(directory)]
+        for filename_svg in render_all(filenames, max_workers=args.jobs):
+            print('Created {}'.format(filename_svg))
+
+
+if __name__ == '__main__':
+    main()
@@ -12,7 +12,10 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import collections
 import logging
+import os
+import threading
 import time
 
 import grpc
@@ -21,8 +24,38 @@ import grpc._common
 from grpc._cython import cygrpc
 import pkg_resources
 
+import latency
+import trace_events
+
 
 LOGGER = logging.getLogger('grpc._channel')
+REQUEST_LOG_ENV = 'PUBSUB_REQUEST_LOG'
+REQUEST_SAMPLE_ENV = 'PUBSUB_REQUEST_SAMPLE'
+DEFAULT_REQUEST_SAMPLE = 100
+REQUEST_SUMMARY = (
+    'consume_request_iterator() sent request #%d: kind=%s, ack_ids=%d, '
+    'modify_deadline_ack_ids=%d, bytes=%d')
+REQUEST_TOTALS = """\
+consume_request_iterator() totals:
+      requests=%d (%s)
+       ack_ids=%d
+    modack_ids=%d
+         bytes=%d"""
+POLL_REPORT_INTERVAL = 5.0  # seconds
+BUSY_SPIN_THRESHOLD = 0.001  # seconds
+BUSY_SPIN_WINDOW = 2.0  # seconds
+BUSY_SPIN = (
+    'channel_spin() appears to be busy spinning: %d polls in the last '
+    '%.3fs all returned in under %gms (iteration=%d)')
+POLL_SUMMARY = """\
+channel_spin() poll stats (%s):
+         polls=%d (%.1f/s)
+  in event.tag=%.3fs (max %.3fms)
+   event types=%s
+   busy spins=%d
+inter-poll interval (us):
+%s"""
+POLL_EVENT = 'channel_spin():\niteration=%d\nevent=%s\ncompleted_call=%r'
 DONT_EXIT = 'channel_spin() has managed_calls remaining (iteration=%d)\n%r'
 DO_EXIT = 'channel_spin() exiting (iteration=%d, duration=%g)'
 EVENT_REPR_TEMPLATE = """\
@@ -45,6 +78,7 @@ def _consume_request_iterator(
     This is borrowed from ``grpcio==1.8.2``.
     """
     event_handler = grpc._channel._event_handler(state, call, None)
+    request_logger = get_request_logger()
 
     def consume_request_iterator():
         while True:
@@ -78,6 +112,7 @@ def _consume_request_iterator(
                                 grpc._channel._EMPTY_FLAGS,
                             ),
                         )
+                        send_start = time.time()
                         call.start_client_batch(
                             make_ops(operations),
                             event_handler,
@@ -87,9 +122,21 @@ def _consume_request_iterator(
                             state.condition.wait()
                             if state.code is None:
                                 if cygrpc.OperationType.send_message not in state.due:
-                                    LOGGER.debug(
-                                        'consume_request_iterator() sent:\n%r',
-                                        request)
+                                    if request_logger is None:
+                                        LOGGER.debug(
+                                            'consume_request_iterator() '
+                                            'sent:\n%r', request)
+                                    else:
+                                        request_logger.sent(
+                                            request, serialized_request)
+                                    if latency.TRACKER.enabled:
+                                        latency.TRACKER.acks_sent(
+                                            request.ack_ids)
+                                    if trace_events.TRACER.enabled:
+                                        trace_events.TRACER.complete(
+                                            'StreamingPull send', 'grpc',
+                                            send_start, time.time(),
+                                            args=_trace_args(request))
                                     break
                             else:
                                 LOGGER.debug(
@@ -126,11 +173,129 @@ def _consume_request_iterator(
                     state, grpc.StatusCode.CANCELLED, 'Cancelled!')
                 state.condition.notify_all()
 
+    def consume_and_log_totals():
+        try:
+            consume_request_iterator()
+        finally:
+            request_logger.log_totals()
+
+    target = consume_request_iterator
+    if request_logger is not None:
+        target = consume_and_log_totals
     consumption_thread = grpc._common.CleanupThread(
-        stop_consumption_thread, target=consume_request_iterator)
+        stop_consumption_thread, target=target)
     consumption_thread.start()
 
 
+def request_counts(request):
+    """Summarize a ``StreamingPullRequest``.
+
+    The kind is ``initial`` for the request that opens the stream,
+    otherwise it describes the IDs carried (``ack``, ``modack``,
+    ``ack+modack`` or ``empty``).
+
+    Returns:
+        Tuple[str, int, int]: The kind and the number of ack IDs and
+        modify deadline ack IDs.
+    """
+    num_ack_ids = len(getattr(request, 'ack_ids', ()))
+    num_modack_ids = len(getattr(request, 'modify_deadline_ack_ids', ()))
+    if getattr(request, 'subscription', ''):
+        kind = 'initial'
+    elif num_ack_ids and num_modack_ids:
+        kind = 'ack+modack'
+    elif num_ack_ids:
+        kind = 'ack'
+    elif num_modack_ids:
+        kind = 'modack'
+    else:
+        kind = 'empty'
+    return kind, num_ack_ids, num_modack_ids
+
+
+def _trace_args(request):
+    # Returns: dict (a summary of a ``StreamingPullRequest`` for tracing)
+    kind, num_ack_ids, num_modack_ids = request_counts(request)
+    return {
+        'kind': kind,
+        'ack_ids': num_ack_ids,
+        'modify_deadline_ack_ids': num_modack_ids,
+    }
+
+
+class RequestLogger(object):
+    """Logs summaries of the requests sent on a stream.
+
+    Every request is counted and logged as a one line summary, but the
+    full body is only formatted for every ``sample_every``-th request
+    (starting with the first).
+
+    Args:
+        sample_every (int): The full body sampling interval.
+    """
+
+    def __init__(self, sample_every=DEFAULT_REQUEST_SAMPLE):
+        self.sample_every = sample_every
+        self._lock = threading.Lock()
+        self.num_requests = 0
+        self.kinds = collections.Counter()
+        self.num_ack_ids = 0
+        self.num_modack_ids = 0
+        self.num_bytes = 0
+
+    def sent(self, request, serialized_request):
+        kind, num_ack_ids, num_modack_ids = request_counts(request)
+        num_bytes = len(serialized_request)
+        with self._lock:
+            self.num_requests += 1
+            number = self.num_requests
+            self.kinds[kind] += 1
+            self.num_ack_ids += num_ack_ids
+            self.num_modack_ids += num_modack_ids
+            self.num_bytes += num_bytes
+
+        if (number - 1) % self.sample_every == 0:
+            LOGGER.debug(
+                REQUEST_SUMMARY + ' (sampled):\n%r', number, kind,
+                num_ack_ids, num_modack_ids, num_bytes, request)
+        else:
+            LOGGER.debug(
+                REQUEST_SUMMARY, number, kind, num_ack_ids, num_modack_ids,
+                num_bytes)
+
+    def log_totals(self):
+        with self._lock:
+            kinds = ', '.join(
+                '{}={:d}'.format(kind, count)
+                for kind, count in sorted(self.kinds.items()))
+            LOGGER.debug(
+                REQUEST_TOTALS, self.num_requests, kinds, self.num_ack_ids,
+                self.num_modack_ids, self.num_bytes)
+
+
+def get_request_logger():
+    """Get a request logger for a new stream, if summaries are enabled.
+
+    Summaries are enabled by setting ``PUBSUB_REQUEST_LOG=summary``;
+    ``PUBSUB_REQUEST_SAMPLE`` sets how often a full body is logged.
+
+    Returns:
+        Optional[RequestLogger]: The logger, or :data:`None` if every
+        request should be logged in full.
+    """
+    if os.environ.get(REQUEST_LOG_ENV, '') != 'summary':
+        return None
+    value = os.environ.get(REQUEST_SAMPLE_ENV, '')
+    if value == '':
+        sample_every = DEFAULT_REQUEST_SAMPLE
+    else:
+        sample_every = int(value)
+        if sample_every < 1:
+            raise ValueError(
+                '{} must be positive'.format(REQUEST_SAMPLE_ENV), value)
+    return RequestLogger(sample_every=sample_every)
+
+
 def event_repr(event):
     # event: grpc._cython.cygrpc.Event
     try:
@@ -139,6 +304,106 @@ def event_repr(event):
         return repr(event)
 
 
+class PollStats(object):
+    """Aggregate counters for the polls done in ``channel_spin()``.
+
+    A summary is logged every ``report_interval`` seconds (for the polls
+    since the last summary) and when the channel stops spinning. If
+    every poll returns in under ``BUSY_SPIN_THRESHOLD`` for at least
+    ``BUSY_SPIN_WINDOW``, a busy spin is flagged (once per streak).
+    """
+
+    def __init__(self, report_interval=POLL_REPORT_INTERVAL):
+        self.report_interval = report_interval
+        self.busy_spins = 0
+        self._fast_since = None
+        self._fast_polls = 0
+        self._flagged = False
+        self._reset(time.time())
+
+    def _reset(self, now):
+        self.window_start = now
+        self.num_polls = 0
+        self.tag_time = 0.0
+        self.tag_max = 0.0
+        self.event_types = collections.Counter()
+        # intervals[k]: The number of inter-poll intervals ``t`` (in
+        #               microseconds) with ``2**(k-1) <= t < 2**k``.
+        self.intervals = [0] * 64
+        self._last_return = None
+
+    def record(self, count, poll_start, poll_end, tag_end, event_type):
+        """Record a single poll.
+
+        Args:
+            count (int): The iteration in ``channel_spin()``.
+            poll_start (float): When ``poll()`` was called.
+            poll_end (float): When ``poll()`` returned.
+            tag_end (float): When ``event.tag(event)`` returned.
+            event_type: The type of the polled event.
+        """
+        self.num_polls += 1
+        self.event_types[event_type] += 1
+        tag_time = tag_end - poll_end
+        self.tag_time += tag_time
+        self.tag_max = max(self.tag_max, tag_time)
+        if self._last_return is not None:
+            micros = int(1e6 * (poll_end - self._last_return))
+            self.intervals[micros.bit_length()] += 1
+        self._last_return = poll_end
+
+        self._check_busy_spin(count, poll_end - poll_start, poll_end)
+        if poll_end - self.window_start >= self.report_interval:
+            self.report()
+            self._reset(poll_end)
+
+    def _check_busy_spin(self, count, poll_duration, now):
+        if poll_duration >= BUSY_SPIN_THRESHOLD:
+            self._fast_since = None
+            self._fast_polls = 0
+            self._flagged = False
+            return
+
+        if self._fast_since is None:
+            self._fast_since = now
+        self._fast_polls += 1
+        streak = now - self._fast_since
+        if streak >= BUSY_SPIN_WINDOW and not self._flagged:
+            self._flagged = True
+            self.busy_spins += 1
+            LOGGER.warning(
+                BUSY_SPIN, self._fast_polls, streak,
+                1000.0 * BUSY_SPIN_THRESHOLD, count)
+            trace_events.TRACER.instant(
+                'busy spin', 'grpc', when=now,
+                args={'polls': self._fast_polls})
+
+    def _format_intervals(self):
+        lines = []
+        for bucket, num_intervals in enumerate(self.intervals):
+            if num_intervals == 0:
+                continue
+            if bucket == 0:
+                label = '[0, 1)'
+            else:
+                label = '[{:d}, {:d})'.format(2 ** (bucket - 1), 2 ** bucket)
+            lines.append('  {:>20} {:d}'.format(label, num_intervals))
+        return '\n'.join(lines) or '  <none>'
+
+    def report(self, label=None):
+        elapsed = max(time.time() - self.window_start, 1e-9)
+        if label is None:
+            label = 'last {:g}s'.format(elapsed)
+        event_types = ', '.join(
+            '{}={:d}'.format(event_type, num_events)
+            for event_type, num_events in sorted(
+                self.event_types.items(), key=lambda item: str(item[0])))
+        LOGGER.debug(
+            POLL_SUMMARY, label, self.num_polls, self.num_polls / elapsed,
+            self.tag_time, 1000.0 * self.tag_max, event_types or '<none>',
+            self.busy_spins, self._format_intervals())
+
+
 def _run_channel_spin_thread(state):
     """Spin a channel until all managed calls are resolved.
 
@@ -151,20 +416,28 @@ def _run_channel_spin_thread(state):
     def channel_spin():
         count = 0
         start = time.time()
+        poll_stats = PollStats()
         while True:
             count += 1
-            LOGGER.debug('Polling in channel_spin() (iteration=%d)', count)
+            poll_start = time.time()
             event = state.completion_queue.poll()
+            poll_end = time.time()
             completed_call = event.tag(event)
-            LOGGER.debug(
-                'channel_spin():\niteration=%d\nevent=%s\ncompleted_call=%r',
-                count, event_repr(event), completed_call)
+            poll_stats.record(
+                count, poll_start, poll_end, time.time(), event.type)
+            # NOTE: Fast polls are only counted in ``poll_stats``; logging
+            #       each one would perturb the spin being measured.
+            if (poll_end - poll_start >= BUSY_SPIN_THRESHOLD or
+                    completed_call is not None):
+                LOGGER.debug(POLL_EVENT, count, event_repr(event),
+                             completed_call)
             if completed_call is not None:
                 with state.lock:
                     state.managed_calls.remove(completed_call)
                     if not state.managed_calls:
                         state.managed_calls = None
                         duration = time.time() - start
+                        poll_stats.report()
                         LOGGER.debug(DO_EXIT, count, duration)
                         return
                     else:
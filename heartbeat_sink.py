@@ -0,0 +1,120 @@
+# Copyright 2017 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Machine-readable heartbeats, written as one JSON object per line."""
+
+import json
+import re
+import threading
+
+
+DEFAULT_BUFFER_SIZE = 16
+# NOTE: Matches the labels in heartbeat templates such as
+#       ``Publish Futures Done=%d, Failed=%d``.
+TEMPLATE_FIELD = re.compile(r'([^\n=,]+)=\s*%')
+NON_ALPHANUMERIC = re.compile(r'[^0-9a-z]+')
+
+
+def _snake_case(label):
+    return NON_ALPHANUMERIC.sub('_', label.strip().lower()).strip('_')
+
+
+def field_names(template, num_values):
+    """Get the names of the values in a heartbeat helper's template.
+
+    Args:
+        template (str): The template, e.g. ``HeartbeatHelper.template``.
+        num_values (int): The number of values (from ``extra_args``).
+
+    Returns:
+        Tuple[str, ...]: Snake case names for each label in the template,
+        or ``extra_0``, ``extra_1``, ... if the labels don't line up with
+        the values.
+    """
+    names = tuple(
+        _snake_case(label) for label in TEMPLATE_FIELD.findall(template))
+    if len(names) == num_values and len(set(names)) == num_values:
+        return names
+    return tuple('extra_{:d}'.format(index) for index in range(num_values))
+
+
+class JsonlSink(object):
+    """Buffered writer of JSON lines.
+
+    Records are serialized when written, but only hit the file once
+    ``buffer_size`` of them have accumulated (or on ``flush()`` /
+    ``close()``).
+    """
+
+    def __init__(self, filename, mode='w', buffer_size=DEFAULT_BUFFER_SIZE):
+        self.filename = filename
+        self.buffer_size = buffer_size
+        self._file_obj = open(filename, mode)
+        self._lock = threading.Lock()
+        self._lines = []
+        self.num_written = 0
+
+    def write(self, record):
+        # record: dict
+        line = json.dumps(record, sort_keys=True, default=repr)
+        with self._lock:
+            self._lines.append(line)
+            self.num_written += 1
+            if len(self._lines) >= self.buffer_size:
+                self._flush()
+
+    def _flush(self):
+        # NOTE: Assumes the lock is held.
+        if self._lines:
+            self._file_obj.write('\n'.join(self._lines) + '\n')
+            self._lines = []
+        self._file_obj.flush()
+
+    def flush(self):
+        with self._lock:
+            self._flush()
+
+    def close(self):
+        with self._lock:
+            self._flush()
+            self._file_obj.close()
+
+
+def heartbeat_record(
+        relative_created, is_running, is_done, thread_names, exception,
+        done_count, template, extra_args):
+    """Build the JSON object for a single heartbeat.
+
+    Carries the same data as the text heartbeat, with the values from
+    a helper's ``extra_args`` keyed by the labels in its ``template``.
+
+    Returns:
+        dict: The record.
+    """
+    names = field_names(template, len(extra_args))
+    if exception is None:
+        exception_repr = None
+    else:
+        exception_repr = repr(exception)
+
+    return {
+        'relativeCreated': relative_created,
+        'running': is_running,
+        'done': is_done,
+        'done_count': done_count,
+        'thread_count': len(thread_names),
+        'threads': thread_names,
+        'exception': exception_repr,
+        'extra': dict(zip(names, extra_args)),
+    }
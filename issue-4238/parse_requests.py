@@ -16,11 +16,29 @@ from __future__ import print_function
 
 import argparse
 import os
+import re
+import sys
 
 
 CURR_DIR = os.path.dirname(os.path.abspath(__file__))
+# NOTE: Make the shared modules importable without setting PYTHONPATH.
+sys.path.insert(0, os.path.dirname(CURR_DIR))
+
+import log_records  # noqa: E402
+
+
 SEPARATOR = '-' * 40 + '\n'
 OUR_SEPARATOR = '=' * 40
+FULL_PREFIX = 'consume_request_iterator() sent:'
+# NOTE: With ``PUBSUB_REQUEST_LOG=summary``, requests are logged as one
+#       line (see ``grpc_patches.REQUEST_SUMMARY``) and the stream's totals
+#       are logged when it ends.
+SUMMARY_PATTERN = re.compile(
+    r'^consume_request_iterator\(\) sent request #\d+: '
+    r'kind=(?P<kind>[a-z+]+),')
+TOTALS_PREFIX = 'consume_request_iterator() totals:'
+ACK_KINDS = ('ack', 'ack+modack')
+MODACK_KINDS = ('modack',)
 
 
 def get_args():
@@ -30,55 +48,81 @@ def get_args():
     return parser.parse_args()
 
 
-def get_content(log_message):
-    time_level, logger, thread_name, content = log_message.split('\n', 3)
-    assert time_level.startswith('timeLevel=')
-    assert logger == 'logger=grpc._channel'
-    assert thread_name == 'threadName=Thread-gRPC-ConsumeRequestIterator'
-    first, content = content.split('\n', 1)
-    assert first == 'consume_request_iterator() sent:'
-    return content
+def get_full_kind(content):
+    """Get the kind of a request from its full body.
+
+    Requests that start with ``ack_ids`` are counted as acks even if they
+    also modify deadlines (like ``ack+modack`` in the summary format).
+    """
+    if 'ack_ids: ' not in content:
+        return 'other'
+    if content.startswith('ack_ids: '):
+        return 'ack'
+
+    # NOTE: We intentionally don't add the very long lease management
+    #       requests to ``other_reqs``.
+    count1 = content.count('modify_deadline_seconds: ')
+    count2 = content.count('modify_deadline_ack_ids: ')
+    assert count1 == count2
+    assert count1 > 0
+    return 'modack'
+
+
+def get_kind(record):
+    """Get the kind of request logged in a record.
+
+    Handles both full bodies and the one line summaries (where the full
+    body is only sometimes appended).
+
+    Returns:
+        Optional[str]: The kind (e.g. ``ack``), ``other`` for records
+        that aren't a sent request (e.g. ``encountered StopIteration``) or
+        :data:`None` for the stream totals (which are skipped).
+    """
+    assert record.logger == 'grpc._channel'
+    assert record.thread_name == 'Thread-gRPC-ConsumeRequestIterator'
+    first, _, content = record.message.partition('\n')
+    if first == FULL_PREFIX:
+        return get_full_kind(content + '\n')
+    if first == TOTALS_PREFIX:
+        return None
+    match = SUMMARY_PATTERN.match(first)
+    if match is None:
+        return 'other'
+    return match.group('kind')
 
 
 def main():
     args = get_args()
     log_file = os.path.join(CURR_DIR, args.filename)
-    with open(log_file, 'r') as file_obj:
-        content = file_obj.read()
-
-    assert content.endswith(SEPARATOR)
-    log_messages = content[:-len(SEPARATOR)].split(SEPARATOR)
-    grpc_bidi = [message for message in log_messages
-                 if 'consume_request_iterator' in message]
+    grpc_bidi = log_records.iter_records(
+        log_file, contains='consume_request_iterator')
 
     if args.show_all:
-        to_print = SEPARATOR.join([''] + grpc_bidi + [''])
-        print(to_print, end='')
+        print(SEPARATOR, end='')
+        for record in grpc_bidi:
+            print(record.text + SEPARATOR, end='')
     else:
-        ack_reqs = []
+        total = 0
+        acks_sent = 0
         other_reqs = []
-        for message in grpc_bidi:
-            if 'ack_ids: ' in message:
-                msg_content = get_content(message)
-                if msg_content.startswith('ack_ids: '):
-                    ack_reqs.append(msg_content)
-                else:
-                    # NOTE: We intentionally don't add the very long lease
-                    #       management requests to ``other_reqs``.
-                    count1 = msg_content.count('modify_deadline_seconds: ')
-                    count2 = msg_content.count('modify_deadline_ack_ids: ')
-                    assert count1 == count2
-                    assert count1 > 0
-            else:
-                other_reqs.append(message)
+        for record in grpc_bidi:
+            kind = get_kind(record)
+            if kind is None:
+                continue
+            total += 1
+            if kind in ACK_KINDS:
+                acks_sent += 1
+            elif kind not in MODACK_KINDS:
+                other_reqs.append(record.text)
 
         print('Non-ack messages:')
         print(OUR_SEPARATOR)
         print(SEPARATOR.join(other_reqs), end='')
         print(OUR_SEPARATOR)
         template = 'Total consume_request_iterator() messages: {}'
-        print(template.format(len(grpc_bidi)))
-        print('Acks sent: {}'.format(len(ack_reqs)))
+        print(template.format(total))
+        print('Acks sent: {}'.format(acks_sent))
 
 
 if __name__ == '__main__':
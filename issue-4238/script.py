@@ -19,8 +19,11 @@ import time
 from google.cloud.pubsub_v1 import types
 import six
 
+import delivery_tracker
+import latency
 import thread_names
 import utils
+import zombies
 
 
 CURR_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -41,6 +44,12 @@ Consumer Request Queue Size=%d
   Policy Request Queue Size=%d
   Policy Num. Ack On Resume=%d
 Policy Num. Managed Ack IDs=%d"""
+DELIVERY_SUMMARY_TEMPLATE = """\
+ Total deliveries=%d
+  Unique messages=%d
+Redelivered msgs.=%d
+ Missing messages=%d
+%s"""
 
 
 def publish_sync(publisher, topic_path, logger):
@@ -53,6 +62,7 @@ def publish_sync(publisher, topic_path, logger):
                 topic_path,
                 ONLY_DATA,
                 index=index_str,
+                **latency.TRACKER.publish_attributes()
             )
             futures.append(future)
             index += 1
@@ -70,28 +80,31 @@ class TrackingCallback(object):
         self.logger = logger
         self.lock = threading.Lock()
         self.start_time = None
-        self.seen = []
+        self.deliveries = delivery_tracker.DeliveryTracker(
+            NUM_PUBLISH_BATCHES * BATCH_SIZE)
 
     @property
     def messages_processed(self):
-        return len(self.seen)
+        return self.deliveries.total
 
     @property
     def uniques(self):
-        return len(set(self.seen))
+        return self.deliveries.uniques
 
     def __call__(self, message):
+        latency.TRACKER.callback_started(message._ack_id)
         with self.lock:
             if self.start_time is None:
                 self.start_time = time.time()
 
         time.sleep(self.sleep_time)
+        latency.TRACKER.ack_called(message._ack_id)
         message.ack()
         with self.lock:
             assert message.data == ONLY_DATA
             index = int(message.attributes['index'])
             self.logger.info('Received: %d', index)
-            self.seen.append(index)
+            self.deliveries.add(index)
 
     @property
     def info(self):
@@ -128,6 +141,12 @@ class HeartbeatHelper(utils.HeartbeatHelper):
         rate, messages_processed, uniques = self.callback.info
         return active_future, rate, messages_processed, uniques
 
+    @property
+    def sample_args(self):
+        # NOTE: Read the counters without ``callback.lock`` (a stale value
+        #       is fine for a sample).
+        return self.callback.messages_processed, self.callback.uniques
+
     @property
     def done(self):
         uniques = self.callback.uniques
@@ -154,6 +173,14 @@ def teardown_summary(policy, logger):
         len(policy._managed_ack_ids))
 
 
+def delivery_summary(callback, logger):
+    deliveries = callback.deliveries
+    num_missing = deliveries.num_missing(NUM_PUBLISH_BATCHES * BATCH_SIZE)
+    logger.info(
+        DELIVERY_SUMMARY_TEMPLATE, deliveries.total, deliveries.uniques,
+        deliveries.redelivered, num_missing, deliveries.format_histogram())
+
+
 def main():
     # Do set-up.
     logger = utils.setup_logging(CURR_DIR)
@@ -200,12 +227,18 @@ def main():
     # Do clean-up.
     subscription.close()
     subscription._executor.shutdown()  # Idempotent, but needed for 0.29.2.
+    detector = zombies.ZombieDetector()
     publisher.delete_topic(topic_path)
     subscriber.delete_subscription(subscription_path)
     teardown_summary(subscription, logger)
+    delivery_summary(callback, logger)
+    latency.TRACKER.report(logger)
     thread_names.save_tree(CURR_DIR, logger)
+    utils.stop_gil_probe(logger)
+    utils.stop_profiler(logger)
     thread_names.restore()
     utils.restore()
+    detector.check(logger)
 
 
 if __name__ == '__main__':
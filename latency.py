@@ -0,0 +1,199 @@
+# Copyright 2017 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""End-to-end message latency, broken down by stage.
+
+When enabled, the publish time is stamped into each message's attributes
+and every delivery (keyed by ack ID) is timestamped when it is
+
+* received by the consumer (``Policy.on_response()``)
+* passed to the callback in the executor
+* acked via ``message.ack()``
+* sent as an ack by ``_consume_request_iterator``
+
+Once the ack is on the wire, the time spent in each stage is recorded
+and the stages are summarized (as percentiles and a histogram) at
+teardown.
+"""
+
+import array
+import math
+import os
+import threading
+import time
+
+
+LATENCY_ENV = 'PUBSUB_LATENCY'
+PUBLISH_TIME_ATTR = 'publish_time'
+STAGES = (
+    'publish -> received',
+    'received -> callback',
+    'callback -> ack()',
+    'ack() -> sent',
+    'publish -> sent',
+)
+PERCENTILES = (50.0, 90.0, 99.0, 99.9)
+STAGE_TEMPLATE = """\
+%s (n=%d)
+  %s
+  max=%.3fms
+%s"""
+# Stamp indices within a pending delivery.
+_PUBLISHED = 0
+_RECEIVED = 1
+_CALLBACK = 2
+_ACKED = 3
+
+
+def percentile(sorted_values, percent):
+    """Nearest-rank percentile.
+
+    Args:
+        sorted_values (Sequence[float]): Non-empty and sorted.
+        percent (float): In ``[0, 100]``.
+
+    Returns:
+        float: The percentile.
+    """
+    rank = int(math.ceil(percent / 100.0 * len(sorted_values)))
+    return sorted_values[max(rank, 1) - 1]
+
+
+def log2_histogram(values, width=40):
+    """Format a histogram with power of two (millisecond) buckets.
+
+    Returns:
+        str: One line per bucket, from the first to the last non-empty
+        bucket.
+    """
+    counts = {}
+    for value in values:
+        if value < 1.0:
+            bucket = 0
+        else:
+            bucket = int(math.log(value, 2)) + 1
+        counts[bucket] = counts.get(bucket, 0) + 1
+
+    largest = max(counts.values())
+    lines = []
+    for bucket in range(min(counts), max(counts) + 1):
+        count = counts.get(bucket, 0)
+        if bucket == 0:
+            label = '[0, 1)'
+        else:
+            label = '[{:d}, {:d})'.format(2 ** (bucket - 1), 2 ** bucket)
+        bar = '#' * int(math.ceil(float(width) * count / largest))
+        lines.append('  {:>14}ms {:8d} {}'.format(label, count, bar))
+    return '\n'.join(lines)
+
+
+class LatencyTracker(object):
+    """Timestamps deliveries and collects per-stage latencies.
+
+    All hooks are no-ops unless ``enabled`` is set.
+    """
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        # pending: Dict[str, List[float]] (ack ID -> stamps)
+        self._pending = {}
+        # stages: Dict[str, array.array] (milliseconds)
+        self.stages = {stage: array.array('d') for stage in STAGES}
+        self.unstamped = 0
+
+    def publish_attributes(self):
+        """Attributes to add to a message as it is published.
+
+        Returns:
+            Dict[str, str]: The publish time, if enabled.
+        """
+        if not self.enabled:
+            return {}
+        return {PUBLISH_TIME_ATTR: '{:.6f}'.format(time.time())}
+
+    def received(self, ack_id, attributes):
+        if not self.enabled:
+            return
+        now = time.time()
+        published = attributes.get(PUBLISH_TIME_ATTR)
+        with self._lock:
+            if published is None:
+                self.unstamped += 1
+                return
+            self._pending[ack_id] = [float(published), now, None, None]
+
+    def _stamp(self, ack_id, index):
+        if not self.enabled:
+            return
+        now = time.time()
+        with self._lock:
+            stamps = self._pending.get(ack_id)
+            if stamps is not None:
+                stamps[index] = now
+
+    def callback_started(self, ack_id):
+        self._stamp(ack_id, _CALLBACK)
+
+    def ack_called(self, ack_id):
+        self._stamp(ack_id, _ACKED)
+
+    def acks_sent(self, ack_ids):
+        """Record the deliveries whose ack was just sent.
+
+        Ack IDs without a full set of stamps (e.g. acks sent on resume
+        for messages received before this was enabled) are ignored.
+        """
+        if not self.enabled:
+            return
+        now = time.time()
+        with self._lock:
+            for ack_id in ack_ids:
+                stamps = self._pending.pop(ack_id, None)
+                if stamps is None or None in stamps:
+                    continue
+                published, received, callback, acked = stamps
+                for stage, start, end in (
+                        (STAGES[0], published, received),
+                        (STAGES[1], received, callback),
+                        (STAGES[2], callback, acked),
+                        (STAGES[3], acked, now),
+                        (STAGES[4], published, now)):
+                    self.stages[stage].append(1000.0 * (end - start))
+
+    def report(self, logger):
+        if not self.enabled:
+            return
+        with self._lock:
+            num_pending = len(self._pending)
+            stages = [(stage, sorted(self.stages[stage])) for stage in STAGES]
+
+        for stage, values in stages:
+            if not values:
+                logger.info('%s (n=0)', stage)
+                continue
+            summary = ' '.join(
+                'p{:g}={:.3f}ms'.format(percent, percentile(values, percent))
+                for percent in PERCENTILES)
+            logger.info(
+                STAGE_TEMPLATE, stage, len(values), summary, values[-1],
+                log2_histogram(values))
+
+        logger.info(
+            'Latency: %d deliveries never had an ack sent, %d messages '
+            'had no publish time', num_pending, self.unstamped)
+
+
+TRACKER = LatencyTracker(
+    enabled=os.environ.get(LATENCY_ENV, '') not in ('', '0'))
@@ -0,0 +1,198 @@
+# Copyright 2017 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Streaming parser for log files written with ``utils.LOG_FORMAT``.
+
+The file is memory-mapped and records are yielded one at a time, so
+memory use does not grow with the size of the log. Only the header
+fields are decoded eagerly; message bodies are read from the mapping
+when they are accessed.
+"""
+
+import mmap
+
+
+ENCODING = 'utf-8'
+DASHES = b'-' * 40
+SEPARATOR = DASHES + b'\n'
+# NOTE: A record ends with a newline, followed by the separator line.
+RECORD_END = b'\n' + SEPARATOR
+# NOTE: ``RECORD_TEMPLATE`` and ``TEXT_SEPARATOR`` re-create the text of a
+#       record (i.e. ``utils.LOG_FORMAT``) from its decoded fields.
+TEXT_SEPARATOR = DASHES.decode(ENCODING)
+RECORD_TEMPLATE = """\
+timeLevel={:08d}:{}
+logger={}
+threadName={}
+{}
+{}"""
+TIME_LEVEL_PREFIX = b'timeLevel='
+LOGGER_PREFIX = b'logger='
+THREAD_NAME_PREFIX = b'threadName='
+
+
+class LogRecord(object):
+    """A single record, backed by the memory-mapped log file.
+
+    The ``message`` and ``text`` are read from the underlying buffer, so
+    they must be accessed before the iterator that produced the record
+    is exhausted (or closed).
+    """
+
+    __slots__ = (
+        'relative_created',
+        'level',
+        'logger',
+        'thread_name',
+        '_buffer',
+        '_start',
+        '_message_start',
+        '_end',
+    )
+
+    def __init__(
+            self, relative_created, level, logger, thread_name,
+            buffer_, start, message_start, end):
+        # relative_created: int (milliseconds)
+        self.relative_created = relative_created
+        # level: str
+        self.level = level
+        # logger: str
+        self.logger = logger
+        # thread_name: str
+        self.thread_name = thread_name
+        self._buffer = buffer_
+        self._start = start
+        self._message_start = message_start
+        # NOTE: ``_end`` is the position of the newline that ends
+        #       the message.
+        self._end = end
+
+    @property
+    def message(self):
+        # Returns: str
+        raw = self._buffer[self._message_start:self._end]
+        return raw.decode(ENCODING)
+
+    @property
+    def text(self):
+        """The full record (headers and message), without the separator."""
+        raw = self._buffer[self._start:self._end + 1]
+        return raw.decode(ENCODING)
+
+    def contains(self, value):
+        """Check if the message contains ``value`` without decoding it."""
+        if not isinstance(value, bytes):
+            value = value.encode(ENCODING)
+        found = self._buffer.find(value, self._message_start, self._end)
+        return found != -1
+
+    def __repr__(self):
+        return '<LogRecord {:08d}:{} logger={} threadName={}>'.format(
+            self.relative_created, self.level, self.logger,
+            self.thread_name)
+
+
+def _header_line(buffer_, position, prefix):
+    # Returns: Tuple[bytes, int]
+    end = buffer_.find(b'\n', position)
+    if end == -1 or buffer_[position:position + len(prefix)] != prefix:
+        raise ValueError('Malformed record header', position, prefix)
+    return buffer_[position + len(prefix):end], end + 1
+
+
+def _as_bytes_set(values):
+    if values is None:
+        return None
+    if isinstance(values, (str, bytes)):
+        values = (values,)
+    return frozenset(
+        value if isinstance(value, bytes) else value.encode(ENCODING)
+        for value in values)
+
+
+def iter_buffer(buffer_, logger=None, thread_name=None, contains=None):
+    """Lazily iterate over the records in a buffer.
+
+    Args:
+        buffer_ (Union[bytes, mmap.mmap]): The contents of a log file.
+        logger (Optional[Union[str, Iterable[str]]]): Logger name(s) to
+            keep. If not provided, all loggers are kept.
+        thread_name (Optional[Union[str, Iterable[str]]]): Thread name(s)
+            to keep. If not provided, all threads are kept.
+        contains (Optional[str]): A substring that the message must contain.
+
+    Yields:
+        LogRecord: Each record matching the filters, in file order.
+    """
+    loggers = _as_bytes_set(logger)
+    threads = _as_bytes_set(thread_name)
+    if contains is not None and not isinstance(contains, bytes):
+        contains = contains.encode(ENCODING)
+
+    position = 0
+    size = len(buffer_)
+    while position < size:
+        end = buffer_.find(RECORD_END, position)
+        if end == -1:
+            raise ValueError('Log does not end with a separator', position)
+        next_position = end + len(RECORD_END)
+
+        time_level, current = _header_line(
+            buffer_, position, TIME_LEVEL_PREFIX)
+        logger_name, current = _header_line(buffer_, current, LOGGER_PREFIX)
+        name, message_start = _header_line(
+            buffer_, current, THREAD_NAME_PREFIX)
+
+        if loggers is not None and logger_name not in loggers:
+            position = next_position
+            continue
+        if threads is not None and name not in threads:
+            position = next_position
+            continue
+        if contains is not None and buffer_.find(
+                contains, message_start, end) == -1:
+            position = next_position
+            continue
+
+        relative_created, level = time_level.split(b':', 1)
+        yield LogRecord(
+            int(relative_created), level.decode(ENCODING),
+            logger_name.decode(ENCODING), name.decode(ENCODING),
+            buffer_, position, message_start, end)
+        position = next_position
+
+
+def iter_records(filename, logger=None, thread_name=None, contains=None):
+    """Lazily iterate over the records in a log file.
+
+    Uses a read-only memory map of the file, so the file is never read
+    into memory in full. Accepts the same filters as :func:`iter_buffer`.
+
+    Yields:
+        LogRecord: Each record matching the filters, in file order.
+    """
+    with open(filename, 'rb') as file_obj:
+        # NOTE: Empty files can't be memory-mapped.
+        if file_obj.seek(0, 2) == 0:
+            return
+        buffer_ = mmap.mmap(file_obj.fileno(), 0, access=mmap.ACCESS_READ)
+
+    try:
+        for record in iter_buffer(
+                buffer_, logger=logger, thread_name=thread_name,
+                contains=contains):
+            yield record
+    finally:
+        buffer_.close()
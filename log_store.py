@@ -0,0 +1,296 @@
+# Copyright 2017 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Load ``utils.LOG_FORMAT`` logs into SQLite and query them.
+
+For example:
+
+.. code-block:: console
+
+   $ python log_store.py ingest no-messages-too/*.txt
+   $ python log_store.py query --thread 'Thread-gRPC-StopChannelSpin*' \\
+   >     --match 'channel_spin' --since 3850000 --until 3860000
+   $ python log_store.py query --match 'Done' --count
+
+Time, level, logger and thread name are indexed columns and message
+bodies are searchable with SQLite full-text search (``--match`` takes
+an FTS query).
+"""
+
+from __future__ import print_function
+
+import argparse
+import os
+import sqlite3
+import sys
+
+import log_records
+
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_DB = os.path.join(HERE, 'logs.sqlite')
+BATCH_SIZE = 5000
+MATCH_ERROR_TEMPLATE = (
+    'log_store.py query: error: invalid --match query {!r} ({}); put '
+    'terms with punctuation in double quotes, e.g. \'"channel_spin()"\'')
+SCHEMA = (
+    """\
+CREATE TABLE IF NOT EXISTS sources (
+  id INTEGER PRIMARY KEY,
+  path TEXT UNIQUE NOT NULL
+)""",
+    """\
+CREATE TABLE IF NOT EXISTS records (
+  id INTEGER PRIMARY KEY,
+  source_id INTEGER NOT NULL REFERENCES sources(id),
+  relative_created INTEGER NOT NULL,
+  level TEXT NOT NULL,
+  logger TEXT NOT NULL,
+  thread_name TEXT NOT NULL,
+  message TEXT NOT NULL
+)""",
+    """\
+CREATE INDEX IF NOT EXISTS records_time
+  ON records(source_id, relative_created)""",
+    """\
+CREATE INDEX IF NOT EXISTS records_level
+  ON records(level, relative_created)""",
+    """\
+CREATE INDEX IF NOT EXISTS records_logger
+  ON records(logger, relative_created)""",
+    """\
+CREATE INDEX IF NOT EXISTS records_thread
+  ON records(thread_name, relative_created)""",
+)
+FTS_TABLE = 'messages'
+FTS_MODULES = ('fts5', 'fts4')
+
+
+def connect(filename):
+    """Open (and if needed, initialize) a log store.
+
+    Args:
+        filename (str): The path to the SQLite database.
+
+    Returns:
+        sqlite3.Connection: The connection to the store.
+    """
+    connection = sqlite3.connect(filename)
+    for statement in SCHEMA:
+        connection.execute(statement)
+    _create_fts(connection)
+    connection.commit()
+    return connection
+
+
+def _create_fts(connection):
+    # NOTE: Not every SQLite build has FTS5, so we fall back to FTS4.
+    for module in FTS_MODULES:
+        try:
+            connection.execute(
+                'CREATE VIRTUAL TABLE IF NOT EXISTS {} USING {}(message)'
+                .format(FTS_TABLE, module))
+            return
+        except sqlite3.OperationalError:
+            continue
+
+    raise RuntimeError('SQLite has no full-text search support')
+
+
+def _source_id(connection, path):
+    connection.execute(
+        'INSERT OR IGNORE INTO sources (path) VALUES (?)', (path,))
+    row = connection.execute(
+        'SELECT id FROM sources WHERE path = ?', (path,)).fetchone()
+    return row[0]
+
+
+def _clear_source(connection, source_id):
+    connection.execute(
+        'DELETE FROM {} WHERE rowid IN '
+        '(SELECT id FROM records WHERE source_id = ?)'.format(FTS_TABLE),
+        (source_id,))
+    connection.execute('DELETE FROM records WHERE source_id = ?', (source_id,))
+
+
+def ingest(connection, filename):
+    """Load (or re-load) all records in a log file into the store.
+
+    Records are streamed from the file and inserted in batches, so the
+    file is never held in memory.
+
+    Returns:
+        int: The number of records loaded.
+    """
+    path = os.path.relpath(os.path.abspath(filename), HERE)
+    count = 0
+    with connection:
+        source_id = _source_id(connection, path)
+        _clear_source(connection, source_id)
+
+        batch = []
+        for record in log_records.iter_records(filename):
+            batch.append((
+                source_id, record.relative_created, record.level,
+                record.logger, record.thread_name, record.message))
+            if len(batch) == BATCH_SIZE:
+                count += _insert(connection, batch)
+                batch = []
+        count += _insert(connection, batch)
+
+        connection.execute(
+            'INSERT INTO {} (rowid, message) '
+            'SELECT id, message FROM records WHERE source_id = ?'.format(
+                FTS_TABLE), (source_id,))
+
+    return count
+
+
+def _insert(connection, batch):
+    connection.executemany(
+        'INSERT INTO records (source_id, relative_created, level, logger, '
+        'thread_name, message) VALUES (?, ?, ?, ?, ?, ?)', batch)
+    return len(batch)
+
+
+def build_query(
+        source=None, level=None, logger=None, thread=None, since=None,
+        until=None, match=None, count=False, limit=None):
+    """Build a ``SELECT`` over the records.
+
+    ``source``, ``logger`` and ``thread`` are ``GLOB`` patterns (so
+    a literal prefix such as ``Thread-gRPC-*`` can use the index).
+
+    Returns:
+        Tuple[str, List]: The SQL and the parameters to bind.
+    """
+    if count:
+        columns = 'COUNT(*)'
+    else:
+        columns = (
+            'sources.path, records.relative_created, records.level, '
+            'records.logger, records.thread_name, records.message')
+
+    clauses = []
+    params = []
+    if source is not None:
+        clauses.append('sources.path GLOB ?')
+        params.append(source)
+    if level is not None:
+        clauses.append('records.level = ?')
+        params.append(level.upper())
+    if logger is not None:
+        clauses.append('records.logger GLOB ?')
+        params.append(logger)
+    if thread is not None:
+        clauses.append('records.thread_name GLOB ?')
+        params.append(thread)
+    if since is not None:
+        clauses.append('records.relative_created >= ?')
+        params.append(since)
+    if until is not None:
+        clauses.append('records.relative_created <= ?')
+        params.append(until)
+    if match is not None:
+        clauses.append(
+            'records.id IN (SELECT rowid FROM {} WHERE {} MATCH ?)'.format(
+                FTS_TABLE, FTS_TABLE))
+        params.append(match)
+
+    sql = (
+        'SELECT {} FROM records '
+        'JOIN sources ON sources.id = records.source_id'.format(columns))
+    if clauses:
+        sql += ' WHERE ' + ' AND '.join(clauses)
+    if not count:
+        sql += ' ORDER BY records.source_id, records.relative_created, ' \
+            'records.id'
+        if limit is not None:
+            sql += ' LIMIT ?'
+            params.append(limit)
+
+    return sql, params
+
+
+def format_row(row):
+    _, relative_created, level, logger, thread_name, message = row
+    return log_records.RECORD_TEMPLATE.format(
+        relative_created, level, logger, thread_name, message,
+        log_records.TEXT_SEPARATOR)
+
+
+def get_args():
+    parser = argparse.ArgumentParser(
+        description='Load logs into SQLite and query them.')
+    parser.add_argument('--db', default=DEFAULT_DB)
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+
+    ingest_parser = subparsers.add_parser('ingest', help='Load log files.')
+    ingest_parser.add_argument('filenames', nargs='+')
+
+    query_parser = subparsers.add_parser('query', help='Query records.')
+    query_parser.add_argument('--source', help='GLOB for the log file path.')
+    query_parser.add_argument('--level')
+    query_parser.add_argument('--logger', help='GLOB for the logger name.')
+    query_parser.add_argument('--thread', help='GLOB for the thread name.')
+    query_parser.add_argument('--since', type=int, help='relativeCreated (ms)')
+    query_parser.add_argument('--until', type=int, help='relativeCreated (ms)')
+    query_parser.add_argument('--match', help='Full-text search query.')
+    query_parser.add_argument('--count', action='store_true')
+    query_parser.add_argument('--limit', type=int)
+    query_parser.add_argument(
+        '--with-source', dest='with_source', action='store_true',
+        help='Print the log file before each record.')
+
+    return parser.parse_args()
+
+
+def main():
+    args = get_args()
+    connection = connect(args.db)
+
+    if args.command == 'ingest':
+        for filename in args.filenames:
+            count = ingest(connection, filename)
+            print('Loaded {} records from {}'.format(count, filename))
+        return
+
+    sql, params = build_query(
+        source=args.source, level=args.level, logger=args.logger,
+        thread=args.thread, since=args.since, until=args.until,
+        match=args.match, count=args.count, limit=args.limit)
+    try:
+        print_results(connection, sql, params, args)
+    except sqlite3.OperationalError as exc:
+        # NOTE: Only the full-text query comes from the user unchecked.
+        if args.match is None:
+            raise
+        sys.exit(MATCH_ERROR_TEMPLATE.format(args.match, exc))
+
+
+def print_results(connection, sql, params, args):
+    cursor = connection.execute(sql, params)
+    if args.count:
+        print(cursor.fetchone()[0])
+        return
+
+    for row in cursor:
+        if args.with_source:
+            print('source={}'.format(row[0]))
+        print(format_row(row))
+
+
+if __name__ == '__main__':
+    main()
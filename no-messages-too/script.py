@@ -21,17 +21,20 @@ import google.auth.transport.grpc as auth_grpc
 import grpc
 import psutil
 
+import task_stats
 import thread_names
 import utils
+import zombies
 
 
 ORIGINAL_PLUGIN = auth_grpc.AuthMetadataPlugin
 ORIGINAL_UPDATE_THREAD_KWARGS = thread_names.update_thread_kwargs
 CURR_DIR = os.path.dirname(os.path.abspath(__file__))
-UNKNOWN = '<name-unknown>'
 HEARTBEAT_ADDENDUM = """
 psutil info=
 %s"""
+# NOTE: Stacks are only formatted (and logged) at the end of a run.
+PLUGIN_STACK_IDS = set()
 
 
 class AuthMetadataPlugin(ORIGINAL_PLUGIN):
@@ -44,7 +47,7 @@ class AuthMetadataPlugin(ORIGINAL_PLUGIN):
         '  skewed_expiry=%s\n'
         '  expiry       =%s\n'
         '  expired      =%s\n'
-        '  stack        =\n\n%s')
+        '  stack_id     =%d')
 
     def __init__(self, credentials, request):
         # NOTE: We have to hack around the original constructor since
@@ -54,7 +57,8 @@ class AuthMetadataPlugin(ORIGINAL_PLUGIN):
         self._request = request
 
     def _get_authorization_headers(self, context):
-        stack_info = utils.get_stack(15)
+        stack_id = utils.get_stack_id(15)
+        PLUGIN_STACK_IDS.add(stack_id)
 
         expiry = self._credentials.expiry
         if expiry is None:
@@ -67,7 +71,7 @@ class AuthMetadataPlugin(ORIGINAL_PLUGIN):
             expired = now >= skewed_expiry
 
         self.LOGGER.debug(
-            self.TEMPLATE, now, skewed_expiry, expiry, expired, stack_info)
+            self.TEMPLATE, now, skewed_expiry, expiry, expired, stack_id)
 
         return ORIGINAL_PLUGIN._get_authorization_headers(self, context)
 
@@ -77,6 +81,7 @@ class HeartbeatHelper(utils.HeartbeatHelper):
     def __init__(self):
         self.num_heartbeats = 0
         self.process = psutil.Process()
+        self.collector = task_stats.TaskCollector(thread_names.tid_name)
         self.template = HEARTBEAT_ADDENDUM
 
     def increment_done(self, future, done_count):
@@ -89,7 +94,7 @@ class HeartbeatHelper(utils.HeartbeatHelper):
         pid = self.process.pid
         cpu_usage = self.process.cpu_percent()
         children = self.process.children()
-        threads = self.process.threads()
+        samples = self.collector.collect()
 
         parts = [
             '  Heartbeats={}'.format(self.num_heartbeats),
@@ -101,12 +106,9 @@ class HeartbeatHelper(utils.HeartbeatHelper):
         for child in children:
             parts.append('    pid={}'.format(child.pid))
 
-        parts.append('  owned pthreads ({})'.format(len(threads)))
-        with thread_names.TID_LOCK:
-            for pthread in threads:
-                tid = pthread.id
-                name = thread_names.TID_MAP.get(tid, UNKNOWN)
-                parts.append('    tid={} ({})'.format(tid, name))
+        parts.append('  owned pthreads ({})'.format(len(samples)))
+        if samples:
+            parts.append(task_stats.format_samples(samples))
 
         return '\n'.join(parts)
 
@@ -114,6 +116,12 @@ class HeartbeatHelper(utils.HeartbeatHelper):
     def extra_args(self):
         return self.psutil_info,
 
+    @property
+    def sample_args(self):
+        # NOTE: ``psutil_info`` computes deltas since the previous call, so
+        #       it is only used for the (5 second) heartbeats.
+        return self.num_heartbeats,
+
 
 class UpdateThreadKwargs(object):
 
@@ -124,14 +132,26 @@ class UpdateThreadKwargs(object):
         result = ORIGINAL_UPDATE_THREAD_KWARGS(args, kwargs)
 
         if kwargs['name'] == thread_names.PLUGIN_THREAD_NAME:
-            stack_info = utils.get_stack(15)
+            stack_id = utils.get_stack_id(15)
+            PLUGIN_STACK_IDS.add(stack_id)
             self.logger.debug(
-                'When spawning %s, stack:\n\n%s',
-                thread_names.PLUGIN_THREAD_NAME, stack_info)
+                'When spawning %s, stack_id=%d',
+                thread_names.PLUGIN_THREAD_NAME, stack_id)
 
         return result
 
 
+def log_plugin_stacks(logger):
+    """Log the stacks captured by the plugin and ``UpdateThreadKwargs``.
+
+    The stacks where threads were created (also in ``utils.STACKS``) are
+    left out since there are far more of them.
+    """
+    stack_ids = sorted(PLUGIN_STACK_IDS)
+    logger.info('Captured %d distinct plugin stack(s)', len(stack_ids))
+    utils.log_stacks(logger, stack_ids)
+
+
 def patch_stage1():
     # We can patch this since the **name** is used at **runtime** by
     # ``auth_grpc.secure_authorized_channel``, which is used by:
@@ -155,7 +175,10 @@ def main():
     thread_names.monkey_patch()
 
     # Get clients and resource paths.
-    credentials, _ = google.auth.default(scopes=utils.SCOPES)
+    if utils.use_fake_server():
+        credentials = None
+    else:
+        credentials, _ = google.auth.default(scopes=utils.SCOPES)
     topic_name = 't-repro-{}'.format(int(1000 * time.time()))
     subscription_name = 's-repro-{}'.format(int(1000 * time.time()))
     client_info = utils.get_client_info(
@@ -179,9 +202,13 @@ def main():
 
     # Do clean-up.
     subscription.close()
+    detector = zombies.ZombieDetector()
     publisher.delete_topic(topic_path)
     subscriber.delete_subscription(subscription_path)
     thread_names.save_tree(CURR_DIR, logger)
+    utils.stop_gil_probe(logger)
+    utils.stop_profiler(logger)
+    log_plugin_stacks(logger)
     thread_names.restore()
     utils.restore()
 
@@ -190,6 +217,9 @@ def main():
         utils.heartbeat(logger, sub_future, 0, helper)
         time.sleep(5)
 
+    # Fail if any thread alive at close is still around.
+    detector.check(logger)
+
 
 if __name__ == '__main__':
     main()
@@ -17,6 +17,7 @@ import time
 
 import thread_names
 import utils
+import zombies
 
 
 CURR_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -48,11 +49,18 @@ def main():
     utils.heartbeats_block(logger, sub_future)
 
     # Do clean-up.
+    # NOTE: The heartbeats stop once the future is done, i.e. once the
+    #       policy has closed itself, so this is the equivalent of
+    #       ``subscription.close()`` in the other scenarios.
+    detector = zombies.ZombieDetector()
     publisher.delete_topic(topic_path)
     subscriber.delete_subscription(subscription_path)
     thread_names.save_tree(CURR_DIR, logger)
+    utils.stop_gil_probe(logger)
+    utils.stop_profiler(logger)
     thread_names.restore()
     utils.restore()
+    detector.check(logger)
 
 
 if __name__ == '__main__':
@@ -28,6 +28,7 @@ PINNED_DEPS = (
 )
 LOCAL = 'local'
 CUSTOM = 'custom'
+FAKE_SERVER_ENV = 'PUBSUB_FAKE_SERVER'
 
 
 def _run(directory, session, version, *extra_deps):
@@ -72,6 +73,9 @@ def _run(directory, session, version, *extra_deps):
     # Add current directory to PYTHONPATH so that ``thread_names.py`` and
     # ``utils.py`` can be imported.
     env = {'PYTHONPATH': '.'}
+    # Forward the opt-in for the in-process fake Pub / Sub server.
+    if FAKE_SERVER_ENV in os.environ:
+        env[FAKE_SERVER_ENV] = os.environ[FAKE_SERVER_ENV]
     script_name = os.path.join(directory, 'script.py')
     session.run('python', script_name, env=env)
 
@@ -109,7 +113,7 @@ def no_messages(session, version):
 @nox.session
 @nox.parametrize('version', ('0.29.4', CUSTOM, '0.30.1'))
 def no_messages_too(session, version):
-    extra_deps = ('psutil', 'boltons')
+    extra_deps = ('psutil',)
     if version == '0.29.4':
         extra_deps += (GRPC_OLD,)
     if version == '0.30.1':
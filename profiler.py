@@ -0,0 +1,189 @@
+# Copyright 2017 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""In-process sampling profiler.
+
+A background thread periodically samples the stack of every thread via
+``sys._current_frames()`` and counts identical stacks per thread
+"kind" (the thread name without its ordinal). At the end of a run the
+counts are written in the "folded" format used by ``flamegraph.pl`` and
+speedscope, with the kind as the root frame:
+
+.. code-block:: text
+
+   gRPC-ChannelSpin;_bootstrap;...;channel_spin;poll 1234
+
+This is a wall clock profile: threads blocked (e.g. in ``poll()`` or
+``wait()``) are sampled just like running ones. To tell them apart, each
+sample also notes which threads ran Python code since the previous one
+(their innermost frame moved), see ``running_threads()``.
+"""
+
+import os
+import sys
+import threading
+import time
+
+
+DEFAULT_RATE = 50.0  # Hz
+MAX_DEPTH = 64
+THREAD_NAME = 'Thread-Profiler'
+UNKNOWN = '<unknown>'
+
+
+def _frame_label(code):
+    return '{} ({}:{:d})'.format(
+        code.co_name, os.path.basename(code.co_filename),
+        code.co_firstlineno)
+
+
+class SamplingProfiler(object):
+    """Samples all thread stacks on a background thread.
+
+    Args:
+        rate (float): Samples per second.
+        kind (Optional[Callable[[str], str]]): Maps a thread name to the
+            kind it is aggregated under. Defaults to the name itself.
+    """
+
+    def __init__(self, rate=DEFAULT_RATE, kind=None):
+        self.interval = 1.0 / rate
+        self.kind = kind
+        # counts: Dict[Tuple[str, Tuple[code, ...]], int]
+        self.counts = {}
+        self.num_samples = 0
+        self.sample_time = 0.0
+        self._kinds = {}
+        # positions: Dict[int, Tuple[code, int]] (innermost frame of each
+        #            thread at the last sample)
+        self._positions = {}
+        # running: List[Tuple[int, str]] (ident and kind of the threads
+        #          that ran between the last two samples)
+        self._running = []
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def _kind(self, ident, threads):
+        thread = threads.get(ident)
+        if thread is None:
+            return UNKNOWN
+        name = thread.name
+        kind = self._kinds.get(name)
+        if kind is None:
+            kind = name if self.kind is None else self.kind(name)
+            self._kinds[name] = kind
+        return kind
+
+    def sample(self):
+        """Sample the stacks of all threads (other than this one)."""
+        start = time.time()
+        own_ident = threading.current_thread().ident
+        # NOTE: ``threading._active`` maps idents to threads, so names
+        #       are the ones assigned by ``thread_names``.
+        threads = dict(threading._active)
+        counts = self.counts
+        previous = self._positions
+        positions = {}
+        running = []
+        for ident, frame in sys._current_frames().items():
+            if ident == own_ident:
+                continue
+            kind = self._kind(ident, threads)
+            position = (frame.f_code, frame.f_lasti)
+            positions[ident] = position
+            # NOTE: A thread seen for the first time may not have run.
+            if ident in previous and previous[ident] != position:
+                running.append((ident, kind))
+            codes = []
+            while frame is not None and len(codes) < MAX_DEPTH:
+                codes.append(frame.f_code)
+                frame = frame.f_back
+            key = (kind, tuple(codes))
+            counts[key] = counts.get(key, 0) + 1
+
+        self._positions = positions
+        # NOTE: Replaced (not mutated) so readers on other threads always
+        #       see a complete list.
+        self._running = running
+        self.num_samples += 1
+        self.sample_time += time.time() - start
+
+    def running_threads(self):
+        """Get the threads that ran Python code between the last samples.
+
+        Returns:
+            List[Tuple[int, str]]: The ident and kind of each thread.
+        """
+        return self._running
+
+    def _run(self):
+        next_sample = time.time()
+        while not self._stopped.is_set():
+            self.sample()
+            # NOTE: Schedule from the previous deadline to avoid drift,
+            #       but don't try to "catch up" after a long stall.
+            now = time.time()
+            next_sample = max(next_sample + self.interval, now)
+            self._stopped.wait(next_sample - now)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name=THREAD_NAME)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def folded(self):
+        """Aggregate the samples as folded stacks.
+
+        Returns:
+            Dict[str, int]: Counts for each ``kind;outer;...;inner`` stack.
+        """
+        labels = {}
+        result = {}
+        for (kind, codes), count in self.counts.items():
+            parts = [kind]
+            for code in reversed(codes):
+                label = labels.get(code)
+                if label is None:
+                    label = _frame_label(code)
+                    labels[code] = label
+                # NOTE: ``;`` separates frames in the folded format.
+                parts.append(label.replace(';', ':'))
+            stack = ';'.join(parts)
+            result[stack] = result.get(stack, 0) + count
+        return result
+
+    def kind_totals(self):
+        # Returns: List[Tuple[str, int]] (most sampled first)
+        totals = {}
+        for (kind, _), count in self.counts.items():
+            totals[kind] = totals.get(kind, 0) + count
+        return sorted(totals.items(), key=lambda item: (-item[1], item[0]))
+
+    def write(self, filename):
+        """Write the folded stacks (one ``stack count`` per line).
+
+        Returns:
+            int: The number of distinct stacks.
+        """
+        folded = self.folded()
+        with open(filename, 'w') as file_obj:
+            for stack in sorted(folded):
+                file_obj.write('{} {:d}\n'.format(stack, folded[stack]))
+        return len(folded)
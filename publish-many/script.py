@@ -19,8 +19,11 @@ import six
 
 from google.cloud.pubsub_v1.publisher.batch import thread
 
+import publish_tracker
 import thread_names
+import trace_events
 import utils
+import zombies
 
 
 CURR_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -47,7 +50,9 @@ class CustomBatch(thread.Batch):
         self.LOGGER.debug(
             BATCH_COMMIT, self, caller, self._topic, self._status,
             len(self._messages), len(self._futures))
-        return super(CustomBatch, self)._commit()
+        trace_args = {'caller': caller, 'messages': len(self._messages)}
+        with trace_events.TRACER.span('Batch._commit', 'publish', trace_args):
+            return super(CustomBatch, self)._commit()
 
     def monitor(self):
         # NOTE: This is **mostly** copied from the `0.30.0` source,
@@ -60,7 +65,7 @@ class CustomBatch(thread.Batch):
 
 
 def publish_sync(publisher, topic_path, num_publish, logger):
-    futures = []
+    tracker = publish_tracker.PublishTracker(num_publish)
     for index in six.moves.xrange(num_publish):
         index_str = '{:d}'.format(index)
         future = publisher.publish(
@@ -68,32 +73,24 @@ def publish_sync(publisher, topic_path, num_publish, logger):
             ONLY_DATA,
             index=index_str,
         )
-        futures.append(future)
+        tracker.track(future)
 
     logger.info('Finished creating %d publish futures', num_publish)
 
-    return futures
+    return tracker
 
 
 class HeartbeatHelper(utils.HeartbeatHelper):
 
-    def __init__(self, futures):
-        # List[.publisher.futures.Future]: futures
-        self.futures = futures
+    def __init__(self, tracker):
+        # publish_tracker.PublishTracker: tracker
+        self.tracker = tracker
         self.num_heartbeats = 0
         self.template = HEARTBEAT_ADDENDUM
 
     @property
     def done_info(self):
-        done_count = 0
-        fail_count = 0
-        for future in self.futures:
-            if future._exception is not future._SENTINEL:
-                fail_count += 1
-            elif future._result is not future._SENTINEL:
-                done_count += 1
-
-        return done_count, fail_count, len(self.futures)
+        return self.tracker.info
 
     def increment_done(self, future, done_count):
         self.num_heartbeats += 1
@@ -103,6 +100,15 @@ class HeartbeatHelper(utils.HeartbeatHelper):
     def extra_args(self):
         return (self.num_heartbeats,) + self.done_info
 
+    @property
+    def sample_args(self):
+        # NOTE: Read the counters without ``tracker``'s lock (a stale value
+        #       is fine for a sample).
+        tracker = self.tracker
+        return (
+            self.num_heartbeats, tracker.done_count, tracker.fail_count,
+            tracker.num_futures)
+
 
 class NotFuture(object):
 
@@ -129,30 +135,38 @@ def main():
     publisher.create_topic(topic_path)
 
     # Set off sync job to publish some messages (won't fail).
-    futures_succeed = publish_sync(
+    tracker_succeed = publish_sync(
         publisher, topic_path, NUM_PUBLISH_SUCCEED, logger)
 
     # The publisher is non-blocking, so we watch it from the main thread.
-    helper_succeed = HeartbeatHelper(futures_succeed)
+    helper_succeed = HeartbeatHelper(tracker_succeed)
     sub_future = NotFuture()
     utils.heartbeats_block(
         logger, sub_future, max_time=10, helper=helper_succeed)
+    tracker_succeed.summary(logger)
 
     # Set off sync job to publish some messages (will fail, at least
     # in `0.29.4`).
-    futures_fail = publish_sync(
+    tracker_fail = publish_sync(
         publisher, topic_path, NUM_PUBLISH_FAIL, logger)
 
     # The publisher is non-blocking, so we watch it from the main thread.
-    helper_fail = HeartbeatHelper(futures_fail)
+    helper_fail = HeartbeatHelper(tracker_fail)
     utils.heartbeats_block(
         logger, sub_future, max_time=20, helper=helper_fail)
+    tracker_fail.summary(logger)
 
     # Do clean-up.
+    # NOTE: There is no subscription, so check that no publisher thread
+    #       outlives the (completed) publish futures.
+    detector = zombies.ZombieDetector()
     publisher.delete_topic(topic_path)
     thread_names.save_tree(CURR_DIR, logger)
+    utils.stop_gil_probe(logger)
+    utils.stop_profiler(logger)
     thread_names.restore()
     utils.restore()
+    detector.check(logger)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,112 @@
+# Copyright 2017 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Incremental completion counts for publish futures.
+
+Rather than walking every future on each heartbeat, a ``PublishTracker``
+registers a done callback on each future as it is created and keeps
+running counts, so reading them is O(1).
+"""
+
+import array
+import functools
+import threading
+import time
+
+import latency
+
+
+NOT_DONE = float('nan')
+PUBLISH_SUMMARY_TEMPLATE = """\
+Publish futures: %d done, %d failed, %d pending
+  latency: %s
+  max=%.3fms"""
+
+
+class PublishTracker(object):
+    """Counts completed and failed publish futures.
+
+    Args:
+        size_hint (int): The expected number of futures (used to
+            pre-allocate the latency array).
+    """
+
+    def __init__(self, size_hint=0):
+        self._lock = threading.Lock()
+        self.num_futures = 0
+        self.done_count = 0
+        self.fail_count = 0
+        # latencies[i]: Seconds from publish to completion of the i-th
+        #               future, or ``NOT_DONE``.
+        self.latencies = array.array('d', [NOT_DONE]) * size_hint
+
+    def track(self, future):
+        """Start tracking a (newly created) publish future.
+
+        Returns:
+            int: The index of ``future`` in ``latencies``.
+        """
+        start = time.time()
+        with self._lock:
+            index = self.num_futures
+            self.num_futures += 1
+            if index == len(self.latencies):
+                self.latencies.append(NOT_DONE)
+
+        # NOTE: If ``future`` is already done, the callback is invoked
+        #       immediately (so ``_lock`` must not be held).
+        future.add_done_callback(
+            functools.partial(self._on_done, index, start))
+        return index
+
+    def _on_done(self, index, start, future):
+        elapsed = time.time() - start
+        failed = future.exception() is not None
+        with self._lock:
+            self.latencies[index] = elapsed
+            if failed:
+                self.fail_count += 1
+            else:
+                self.done_count += 1
+
+    @property
+    def info(self):
+        # Returns: Tuple[int, int, int] (done, failed, total)
+        with self._lock:
+            return self.done_count, self.fail_count, self.num_futures
+
+    def summary(self, logger):
+        with self._lock:
+            done_count = self.done_count
+            fail_count = self.fail_count
+            num_futures = self.num_futures
+            # NOTE: ``NaN != NaN``, so this drops pending futures.
+            values = sorted(
+                1000.0 * value for value in self.latencies[:num_futures]
+                if value == value)
+
+        pending = num_futures - done_count - fail_count
+        if not values:
+            logger.info(
+                'Publish futures: %d done, %d failed, %d pending',
+                done_count, fail_count, pending)
+            return
+
+        percentiles = ' '.join(
+            'p{:g}={:.3f}ms'.format(
+                percent, latency.percentile(values, percent))
+            for percent in latency.PERCENTILES)
+        logger.info(
+            PUBLISH_SUMMARY_TEMPLATE, done_count, fail_count, pending,
+            percentiles, values[-1])
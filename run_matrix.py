@@ -0,0 +1,499 @@
+# Copyright 2017 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Run the ``nox.py`` session matrix in parallel, with cached environments.
+
+The sessions in ``nox.py`` are replayed against a recording session to
+get the interpreter, the install steps and the scenario command for each
+``(scenario, version)``. Then
+
+* every distinct set of install steps is built **once** into a virtual
+  environment under ``.matrix/envs/<hash>`` and reused by later runs
+  (until ``--rebuild``)
+* each session runs as a subprocess in its own copy of the code (so
+  concurrent runs of the same scenario don't clobber each other's logs)
+* the files each run writes are collected into
+  ``<results>/<scenario>/<version>/``, next to the run's output in
+  ``session.log``.
+
+Usage:
+
+.. code-block:: bash
+
+   $ python run_matrix.py --list
+   $ python run_matrix.py --jobs 8
+   $ python run_matrix.py -s 'issue_4238*' -s 'publish_many*'
+
+This script needs Python 3 (it uses ``concurrent.futures`` and subprocess
+timeouts); the sessions themselves run under whatever interpreter
+``nox.py`` asks for.
+"""
+
+from __future__ import print_function
+
+import argparse
+from concurrent import futures
+import fnmatch
+import glob
+import hashlib
+import json
+import os
+import runpy
+import shutil
+import subprocess
+import sys
+import time
+import types
+
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+NOXFILE = os.path.join(HERE, 'nox.py')
+MATRIX_DIR = os.path.join(HERE, '.matrix')
+ENVS_DIR = os.path.join(MATRIX_DIR, 'envs')
+RUNS_DIR = os.path.join(MATRIX_DIR, 'runs')
+DEFAULT_RESULTS = os.path.join(HERE, 'results')
+COMPLETE_MARKER = '.complete'
+SESSION_LOG = 'session.log'
+BUILD_LOG = 'build.log'
+IGNORE = shutil.ignore_patterns('__pycache__', '*.pyc')
+# NOTE: Build by-products written into a local checkout by ``pip install``
+#       shouldn't change its fingerprint.
+FINGERPRINT_SKIP = ('.git', '__pycache__', 'build', 'dist', '*.egg-info')
+
+
+class RecordingSession(object):
+    """Stands in for a ``nox`` session and records what it is asked to do.
+
+    Attributes:
+        interpreter (Optional[str]): The Python interpreter to use.
+        steps (List[Tuple[str, Tuple[str, ...], dict]]): The ``install``
+            and ``run`` calls, as ``(kind, args, env)``.
+    """
+
+    def __init__(self):
+        self.interpreter = None
+        self.steps = []
+
+    def install(self, *args):
+        self.steps.append(('install', args, {}))
+
+    def run(self, *args, **kwargs):
+        self.steps.append(('run', args, kwargs.get('env') or {}))
+
+
+class Session(object):
+    """A single ``(scenario, version)`` from the matrix.
+
+    Args:
+        name (str): The session name, as ``nox`` would show it.
+        version (str): The ``version`` parameter.
+        recorded (RecordingSession): The replayed session.
+    """
+
+    def __init__(self, name, version, recorded):
+        self.name = name
+        self.version = version
+        self.interpreter = recorded.interpreter or 'python3'
+        # NOTE: The last step runs the scenario, everything before it
+        #       builds the environment.
+        self.build_steps = recorded.steps[:-1]
+        _, self.command, self.env = recorded.steps[-1]
+        self.script = self.command[-1]
+        self.scenario = self.script.split(os.sep, 1)[0]
+
+    @property
+    def local_sources(self):
+        # Returns: Dict[str, str] (install path -> fingerprint)
+        sources = {}
+        for kind, args, _ in self.build_steps:
+            if kind != 'install':
+                continue
+            for arg in args:
+                path = os.path.join(HERE, arg)
+                if os.path.isdir(path):
+                    sources[arg] = fingerprint(path)
+        return sources
+
+    @property
+    def env_key(self):
+        # Returns: str (a hash of everything used to build the env)
+        # NOTE: Installs from a local checkout (e.g. ``nox.LOCAL``) would
+        #       otherwise reuse a stale env after the checkout changes.
+        description = json.dumps(
+            [self.interpreter, self.build_steps, self.local_sources],
+            sort_keys=True)
+        return hashlib.sha256(description.encode('utf-8')).hexdigest()[:16]
+
+    @property
+    def label(self):
+        # Returns: str (safe to use in a path)
+        return '{}-{}'.format(self.scenario, self.version)
+
+
+def fingerprint(directory):
+    """Fingerprint the files in a local checkout.
+
+    Args:
+        directory (str): The directory that is installed.
+
+    Returns:
+        str: A hash of the relative path, size and modification time of
+        every file in ``directory``.
+    """
+    hash_obj = hashlib.sha256()
+    for dirpath, dirnames, filenames in os.walk(directory):
+        dirnames[:] = sorted(
+            name for name in dirnames if not _skip_source(name))
+        for name in sorted(filenames):
+            if _skip_source(name) or name.endswith('.pyc'):
+                continue
+            path = os.path.join(dirpath, name)
+            stat = os.stat(path)
+            line = '{} {} {}\n'.format(
+                os.path.relpath(path, directory), stat.st_size,
+                stat.st_mtime)
+            hash_obj.update(line.encode('utf-8'))
+    return hash_obj.hexdigest()
+
+
+def _skip_source(name):
+    return any(
+        fnmatch.fnmatch(name, pattern) for pattern in FINGERPRINT_SKIP)
+
+
+def load_sessions(noxfile=NOXFILE):
+    """Replay every session (and parameter) in ``nox.py``.
+
+    Returns:
+        List[Session]: The sessions, in definition order.
+    """
+    session_funcs = []
+    fake_nox = types.ModuleType('nox')
+
+    def session(func):
+        session_funcs.append(func)
+        return func
+
+    def parametrize(arg_name, values):
+        def decorator(func):
+            func.matrix_values = (arg_name, values)
+            return func
+        return decorator
+
+    fake_nox.session = session
+    fake_nox.parametrize = parametrize
+
+    original_nox = sys.modules.get('nox')
+    sys.modules['nox'] = fake_nox
+    try:
+        runpy.run_path(noxfile)
+    finally:
+        if original_nox is None:
+            del sys.modules['nox']
+        else:
+            sys.modules['nox'] = original_nox
+
+    sessions = []
+    for func in session_funcs:
+        arg_name, values = func.matrix_values
+        for value in values:
+            recorded = RecordingSession()
+            func(recorded, **{arg_name: value})
+            name = '{}({}={!r})'.format(func.__name__, arg_name, value)
+            sessions.append(Session(name, value, recorded))
+    return sessions
+
+
+def _bin(env_dir, executable):
+    return os.path.join(env_dir, 'bin', executable)
+
+
+def build_log_filename(session):
+    # Returns: str (where the output of building the env is written)
+    return os.path.join(ENVS_DIR, session.env_key + '.log')
+
+
+def build_env(session, rebuild=False):
+    """Build the environment for a session (unless already built).
+
+    Returns:
+        Tuple[str, float]: The environment directory and the seconds
+        spent building it (zero if it was reused).
+
+    Raises:
+        subprocess.CalledProcessError: If a build step fails.
+    """
+    env_dir = os.path.join(ENVS_DIR, session.env_key)
+    marker = os.path.join(env_dir, COMPLETE_MARKER)
+    if os.path.exists(marker) and not rebuild:
+        return env_dir, 0.0
+
+    start = time.time()
+    if os.path.exists(env_dir):
+        shutil.rmtree(env_dir)
+    if not os.path.exists(ENVS_DIR):
+        os.makedirs(ENVS_DIR)
+    with open(build_log_filename(session), 'w') as log_file:
+        def check_call(args):
+            log_file.write('$ {}\n'.format(' '.join(args)))
+            log_file.flush()
+            subprocess.check_call(
+                args, cwd=HERE, stdout=log_file, stderr=subprocess.STDOUT)
+
+        check_call((session.interpreter, '-m', 'venv', env_dir))
+        for kind, args, _ in session.build_steps:
+            if kind == 'install':
+                check_call((_bin(env_dir, 'pip'), 'install') + tuple(args))
+            else:
+                check_call((_bin(env_dir, args[0]),) + tuple(args[1:]))
+
+    # NOTE: The marker is only written once every step succeeded, so a
+    #       partially built environment is never reused.
+    with open(marker, 'w') as file_obj:
+        file_obj.write(json.dumps(
+            [session.interpreter, session.build_steps,
+             session.local_sources], indent=2, sort_keys=True))
+    return env_dir, time.time() - start
+
+
+def _prepare_run_dir(session):
+    """Copy the shared modules and the scenario into a fresh directory."""
+    run_dir = os.path.join(RUNS_DIR, session.label)
+    if os.path.exists(run_dir):
+        shutil.rmtree(run_dir)
+    os.makedirs(run_dir)
+    for filename in glob.glob(os.path.join(HERE, '*.py')):
+        shutil.copy2(filename, run_dir)
+    shutil.copytree(
+        os.path.join(HERE, session.scenario),
+        os.path.join(run_dir, session.scenario), ignore=IGNORE)
+    return run_dir
+
+
+def _collect(run_dir, session, start, results_dir):
+    """Copy the files written during the run into the results tree.
+
+    Returns:
+        List[str]: The collected files (relative to ``results_dir``).
+    """
+    source_dir = os.path.join(run_dir, session.scenario)
+    target_dir = os.path.join(results_dir, session.scenario, session.version)
+    if not os.path.exists(target_dir):
+        os.makedirs(target_dir)
+
+    collected = []
+    for dirpath, dirnames, filenames in os.walk(source_dir):
+        dirnames[:] = [name for name in dirnames if name != '__pycache__']
+        for filename in filenames:
+            path = os.path.join(dirpath, filename)
+            if os.path.getmtime(path) < start:
+                continue
+            relative = os.path.relpath(path, source_dir)
+            destination = os.path.join(target_dir, relative)
+            if not os.path.exists(os.path.dirname(destination)):
+                os.makedirs(os.path.dirname(destination))
+            shutil.copy2(path, destination)
+            collected.append(os.path.relpath(destination, results_dir))
+    return sorted(collected)
+
+
+def run_session(session, env_dir, results_dir, timeout=None):
+    """Run a session's scenario in an isolated copy of the code.
+
+    Returns:
+        dict: A summary of the run.
+    """
+    run_dir = _prepare_run_dir(session)
+    target_dir = os.path.join(results_dir, session.scenario, session.version)
+    if not os.path.exists(target_dir):
+        os.makedirs(target_dir)
+
+    env = dict(os.environ)
+    env.update(session.env)
+    env['PATH'] = os.path.dirname(_bin(env_dir, 'python')) + os.pathsep + (
+        env.get('PATH', ''))
+    command = (_bin(env_dir, session.command[0]),) + tuple(
+        session.command[1:])
+
+    start = time.time()
+    # NOTE: Some file systems only keep mtimes to the second.
+    mtime_cutoff = int(start)
+    with open(os.path.join(target_dir, SESSION_LOG), 'w') as log_file:
+        process = subprocess.Popen(
+            command, cwd=run_dir, env=env, stdout=log_file,
+            stderr=subprocess.STDOUT)
+        try:
+            returncode = process.wait(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+            returncode = None
+
+    return {
+        'session': session.name,
+        'env': session.env_key,
+        'returncode': returncode,
+        'duration': time.time() - start,
+        'artifacts': _collect(run_dir, session, mtime_cutoff, results_dir),
+    }
+
+
+def build_failed(session, error, results_dir):
+    """Record a session that can't run since its env failed to build.
+
+    The build log is copied into the results tree in place of the run's
+    output.
+
+    Returns:
+        dict: A summary of the (skipped) run.
+    """
+    target_dir = os.path.join(results_dir, session.scenario, session.version)
+    if not os.path.exists(target_dir):
+        os.makedirs(target_dir)
+    artifacts = []
+    log_filename = build_log_filename(session)
+    if os.path.exists(log_filename):
+        destination = os.path.join(target_dir, BUILD_LOG)
+        shutil.copy2(log_filename, destination)
+        artifacts.append(os.path.relpath(destination, results_dir))
+
+    return {
+        'session': session.name,
+        'env': session.env_key,
+        'returncode': None,
+        'duration': 0.0,
+        'artifacts': artifacts,
+        'error': 'Failed to build env: {}'.format(error),
+    }
+
+
+def _status(result):
+    if 'error' in result:
+        return 'BUILD FAILED'
+    if result['returncode'] is None:
+        return 'TIMEOUT'
+    if result['returncode'] == 0:
+        return 'OK'
+    return 'FAILED ({:d})'.format(result['returncode'])
+
+
+def run_matrix(sessions, results_dir, jobs, rebuild=False, timeout=None):
+    """Build the environments, then run every session concurrently.
+
+    Returns:
+        List[dict]: The run summaries, in the order of ``sessions``.
+    """
+    # Build each distinct environment once (concurrently).
+    by_key = {}
+    for session in sessions:
+        by_key.setdefault(session.env_key, session)
+
+    env_dirs = {}
+    build_errors = {}
+    with futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+        pending = {
+            executor.submit(build_env, session, rebuild=rebuild): key
+            for key, session in by_key.items()
+        }
+        for future in futures.as_completed(pending):
+            key = pending[future]
+            try:
+                env_dir, duration = future.result()
+            except (OSError, subprocess.CalledProcessError) as exc:
+                # NOTE: Only the sessions using this env are affected.
+                build_errors[key] = exc
+                print('Failed to build env {}: {} (see {})'.format(
+                    key, exc, build_log_filename(by_key[key])))
+                continue
+            env_dirs[key] = env_dir
+            if duration:
+                print('Built env {} in {:.1f}s'.format(key, duration))
+            else:
+                print('Reusing env {}'.format(key))
+
+    # Run the sessions (concurrently).
+    with futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+        pending = []
+        for session in sessions:
+            error = build_errors.get(session.env_key)
+            if error is None:
+                future = executor.submit(
+                    run_session, session, env_dirs[session.env_key],
+                    results_dir, timeout=timeout)
+            else:
+                future = executor.submit(
+                    build_failed, session, error, results_dir)
+            pending.append(future)
+        for future in futures.as_completed(pending):
+            result = future.result()
+            print('{:<45} {:<12} {:8.1f}s'.format(
+                result['session'], _status(result), result['duration']))
+        results = [future.result() for future in pending]
+
+    with open(os.path.join(results_dir, 'summary.json'), 'w') as file_obj:
+        json.dump(results, file_obj, indent=2, sort_keys=True)
+    return results
+
+
+def select(sessions, patterns):
+    # Returns: List[Session] (matching any of the ``fnmatch`` patterns)
+    if not patterns:
+        return sessions
+    return [
+        session for session in sessions
+        if any(fnmatch.fnmatch(session.name, pattern)
+               for pattern in patterns)
+    ]
+
+
+def get_args():
+    parser = argparse.ArgumentParser(
+        description='Run the nox.py sessions in parallel.')
+    parser.add_argument(
+        '-s', '--session', dest='sessions', action='append',
+        help='Pattern for the sessions to run (default: all).')
+    parser.add_argument(
+        '--jobs', type=int, default=os.cpu_count(),
+        help='The number of concurrent builds / runs.')
+    parser.add_argument('--results', default=DEFAULT_RESULTS)
+    parser.add_argument(
+        '--timeout', type=float, help='Seconds before a run is killed.')
+    parser.add_argument(
+        '--rebuild', action='store_true',
+        help='Rebuild environments even if they are cached.')
+    parser.add_argument(
+        '--list', action='store_true',
+        help='List the sessions and their environments.')
+    return parser.parse_args()
+
+
+def main():
+    args = get_args()
+    sessions = select(load_sessions(), args.sessions)
+    if args.list:
+        for session in sessions:
+            print('{:<45} env={}'.format(session.name, session.env_key))
+        return
+
+    if not os.path.exists(args.results):
+        os.makedirs(args.results)
+    results = run_matrix(
+        sessions, args.results, args.jobs, rebuild=args.rebuild,
+        timeout=args.timeout)
+    if any(result['returncode'] != 0 for result in results):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,211 @@
+# Copyright 2017 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""High-frequency heartbeat sampling.
+
+A ``HeartbeatSampler`` records the same data as ``utils.heartbeat()``
+(without the thread names) on a background thread, at a much higher
+rate than the 5 second heartbeats. Samples are kept in a fixed-size
+ring buffer backed by an ``array.array`` and are periodically flushed
+to a CSV file rather than to the text log.
+"""
+
+import array
+import logging
+import threading
+import time
+
+
+DEFAULT_RATE = 100.0  # Hz
+DEFAULT_CAPACITY = 4096
+DEFAULT_FLUSH_INTERVAL = 1.0  # seconds
+THREAD_NAME = 'Thread-HeartbeatSampler'
+BASE_FIELDS = ('relativeCreated', 'running', 'done', 'threads', 'exception')
+
+
+class SampleRing(object):
+    """Fixed-size ring buffer of fixed-width numeric records.
+
+    All records are stored in a single flat ``array.array('d')``. When the
+    buffer is full, the oldest record is overwritten and counted in
+    ``dropped``.
+    """
+
+    def __init__(self, capacity, width):
+        # capacity: int (number of records)
+        # width: int (number of fields per record)
+        self.capacity = capacity
+        self.width = width
+        self.values = array.array('d', [0.0]) * (capacity * width)
+        self.start = 0
+        self.count = 0
+        self.dropped = 0
+
+    def __len__(self):
+        return self.count
+
+    def append(self, record):
+        """Add a record, overwriting the oldest one if full.
+
+        Args:
+            record (Sequence[float]): The values, exactly ``width`` of them.
+
+        Raises:
+            ValueError: If ``record`` has the wrong width (assigning it to
+                the flat array would resize it and shift every later
+                record).
+        """
+        if len(record) != self.width:
+            raise ValueError(
+                'Expected a record of width {:d}'.format(self.width), record)
+
+        if self.count == self.capacity:
+            # Overwrite the oldest record.
+            index = self.start
+            self.start = (self.start + 1) % self.capacity
+            self.dropped += 1
+        else:
+            index = (self.start + self.count) % self.capacity
+            self.count += 1
+
+        offset = index * self.width
+        self.values[offset:offset + self.width] = array.array('d', record)
+
+    def drain(self):
+        """Remove all records, oldest first.
+
+        Returns:
+            List[array.array]: The records.
+        """
+        records = []
+        for position in range(self.count):
+            offset = ((self.start + position) % self.capacity) * self.width
+            records.append(self.values[offset:offset + self.width])
+        self.start = 0
+        self.count = 0
+        return records
+
+
+class HeartbeatSampler(object):
+    """Samples heartbeat data on a background thread.
+
+    The values in ``helper.sample_args`` are recorded after the base
+    fields. (``helper.extra_args`` is not used since it may have side
+    effects, e.g. CPU usage since the last heartbeat.)
+
+    Args:
+        future: The future watched by the heartbeats.
+        helper (utils.HeartbeatHelper): Provides the extra values.
+        filename (str): The CSV file where samples are flushed.
+        rate (float): Samples per second.
+        capacity (int): The size of the ring buffer (in samples).
+        flush_interval (float): Seconds between flushes to ``filename``.
+        count_threads (Callable[[], int]): Counts the threads to record.
+        thread_class (type): Used to create the sampler thread, e.g. to
+            keep it out of the ``thread_names`` registry.
+    """
+
+    def __init__(
+            self, future, helper, filename, rate=DEFAULT_RATE,
+            capacity=DEFAULT_CAPACITY,
+            flush_interval=DEFAULT_FLUSH_INTERVAL,
+            count_threads=threading.active_count,
+            thread_class=threading.Thread):
+        self.future = future
+        self.helper = helper
+        self.count_threads = count_threads
+        self.thread_class = thread_class
+        self.filename = filename
+        self.interval = 1.0 / rate
+        self.capacity = capacity
+        self.flush_interval = flush_interval
+        self.ring = None
+        self.num_samples = 0
+        self._stopped = threading.Event()
+        self._thread = None
+        self._file_obj = None
+
+    def sample(self):
+        # Returns: Tuple[float, ...]
+        # NOTE: Use the same clock as ``relativeCreated`` in the logs.
+        relative_created = 1000.0 * (time.time() - logging._startTime)
+        is_done = self.future.done()
+        has_exception = bool(is_done and self.future.exception() is not None)
+        record = (
+            relative_created,
+            float(bool(self.future.running())),
+            float(bool(is_done)),
+            float(self.count_threads()),
+            float(has_exception),
+        )
+        return record + tuple(self.helper.sample_args)
+
+    def _write_header(self, width):
+        extra_names = tuple(
+            'extra_{:d}'.format(index)
+            for index in range(width - len(BASE_FIELDS)))
+        self._file_obj.write(','.join(BASE_FIELDS + extra_names) + '\n')
+
+    def flush(self):
+        if self.ring is None:
+            return
+        dropped = self.ring.dropped
+        if dropped:
+            self._file_obj.write('# dropped={:d}\n'.format(dropped))
+            self.ring.dropped = 0
+        lines = [
+            ','.join('{:g}'.format(value) for value in record)
+            for record in self.ring.drain()
+        ]
+        if lines:
+            self._file_obj.write('\n'.join(lines) + '\n')
+        self._file_obj.flush()
+
+    def _run(self):
+        next_sample = time.time()
+        next_flush = next_sample + self.flush_interval
+        while not self._stopped.is_set():
+            record = self.sample()
+            if self.ring is None:
+                self.ring = SampleRing(self.capacity, len(record))
+                self._write_header(len(record))
+            self.ring.append(record)
+            self.num_samples += 1
+
+            now = time.time()
+            if now >= next_flush:
+                self.flush()
+                next_flush = now + self.flush_interval
+
+            # NOTE: Schedule from the previous deadline to avoid drift,
+            #       but don't try to "catch up" after a long stall.
+            next_sample = max(next_sample + self.interval, now)
+            self._stopped.wait(next_sample - now)
+
+        self.flush()
+
+    def start(self):
+        self._file_obj = open(self.filename, 'w')
+        self._thread = self.thread_class(target=self._run, name=THREAD_NAME)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self._file_obj is not None:
+            self._file_obj.close()
+            self._file_obj = None
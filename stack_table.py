@@ -0,0 +1,94 @@
+# Copyright 2017 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Cheap stack capture, with formatting deferred until report time.
+
+Capturing a stack walks ``sys._getframe()`` and records only
+``(code object, line number)`` pairs. Identical stacks are interned, so
+a capture is a few attribute reads and a dictionary lookup, and returns
+a small integer ID. Source lines are only read when a stack is
+formatted.
+"""
+
+import linecache
+import sys
+import threading
+
+
+DEFAULT_LIMIT = 15
+FRAME_TEMPLATE = '  File "{}", line {:d}, in {}\n'
+
+
+class StackTable(object):
+    """Interns captured stacks and counts how often each is seen."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # ids: Dict[Tuple[Tuple[code, int], ...], int]
+        self._ids = {}
+        # stacks[stack_id]: The interned stack, innermost frame first.
+        self._stacks = []
+        # counts[stack_id]: The number of times it was captured.
+        self._counts = []
+
+    def __len__(self):
+        return len(self._stacks)
+
+    def capture(self, skip=0, limit=DEFAULT_LIMIT):
+        """Capture the current stack.
+
+        Args:
+            skip (int): The number of (innermost) frames to leave out, in
+                addition to this method.
+            limit (int): The maximum number of frames to keep.
+
+        Returns:
+            int: The ID of the stack.
+        """
+        frame = sys._getframe(skip + 1)
+        frames = []
+        while frame is not None and len(frames) < limit:
+            frames.append((frame.f_code, frame.f_lineno))
+            frame = frame.f_back
+        key = tuple(frames)
+
+        with self._lock:
+            stack_id = self._ids.get(key)
+            if stack_id is None:
+                stack_id = len(self._stacks)
+                self._ids[key] = stack_id
+                self._stacks.append(key)
+                self._counts.append(0)
+            self._counts[stack_id] += 1
+        return stack_id
+
+    def count(self, stack_id):
+        # Returns: int
+        return self._counts[stack_id]
+
+    def format(self, stack_id):
+        """Format a stack like a traceback (outermost frame first).
+
+        Returns:
+            str: The formatted stack.
+        """
+        lines = []
+        for code, line_number in reversed(self._stacks[stack_id]):
+            filename = code.co_filename
+            lines.append(
+                FRAME_TEMPLATE.format(filename, line_number, code.co_name))
+            source = linecache.getline(filename, line_number).strip()
+            if source:
+                lines.append('    {}\n'.format(source))
+        return ''.join(lines)
@@ -0,0 +1,156 @@
+# Copyright 2017 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Per-thread CPU and context switch accounting (Linux only).
+
+Reads ``/proc/self/task/<tid>/stat`` and ``/proc/self/task/<tid>/status``
+for every ``pthread`` in the process and computes rates between
+successive calls to ``TaskCollector.collect()``.
+"""
+
+import collections
+import os
+import time
+
+
+TASK_DIR = '/proc/self/task'
+CLOCK_TICKS = os.sysconf('SC_CLK_TCK')
+# NOTE: In ``stat``, fields after the (parenthesized) command name start
+#       at field 3 (``state``), so ``utime`` (field 14) and ``stime``
+#       (field 15) are at offsets 11 and 12.
+UTIME_OFFSET = 11
+STIME_OFFSET = 12
+VOLUNTARY = 'voluntary_ctxt_switches:'
+NONVOLUNTARY = 'nonvoluntary_ctxt_switches:'
+SPIKE_PERCENT = 50.0
+UNKNOWN = '<name-unknown>'
+
+TaskCounters = collections.namedtuple(
+    'TaskCounters', ['cpu_ticks', 'voluntary', 'nonvoluntary'])
+TaskSample = collections.namedtuple(
+    'TaskSample',
+    ['tid', 'name', 'cpu_percent', 'voluntary_rate', 'nonvoluntary_rate'])
+
+
+def read_counters(tid):
+    """Read the counters for a single task.
+
+    Returns:
+        Optional[TaskCounters]: The counters, or :data:`None` if the
+        task exited while being read.
+    """
+    task_dir = os.path.join(TASK_DIR, str(tid))
+    try:
+        with open(os.path.join(task_dir, 'stat'), 'r') as file_obj:
+            stat = file_obj.read()
+        with open(os.path.join(task_dir, 'status'), 'r') as file_obj:
+            status_lines = file_obj.readlines()
+    except (IOError, OSError):
+        return None
+
+    fields = stat.rsplit(')', 1)[1].split()
+    cpu_ticks = int(fields[UTIME_OFFSET]) + int(fields[STIME_OFFSET])
+
+    voluntary = 0
+    nonvoluntary = 0
+    for line in status_lines:
+        if line.startswith(VOLUNTARY):
+            voluntary = int(line[len(VOLUNTARY):])
+        elif line.startswith(NONVOLUNTARY):
+            nonvoluntary = int(line[len(NONVOLUNTARY):])
+
+    return TaskCounters(cpu_ticks, voluntary, nonvoluntary)
+
+
+def list_tids():
+    # Returns: List[int]
+    return sorted(int(tid) for tid in os.listdir(TASK_DIR))
+
+
+class TaskCollector(object):
+    """Computes per-thread rates between calls to ``collect()``.
+
+    Args:
+        name_lookup (Callable[[int], Optional[str]]): Maps a TID to a
+            thread name (e.g. ``thread_names.tid_name``).
+    """
+
+    def __init__(self, name_lookup):
+        self.name_lookup = name_lookup
+        self._last_time = time.time()
+        self._last = self._snapshot()
+
+    @staticmethod
+    def _snapshot():
+        # Returns: Dict[int, TaskCounters]
+        snapshot = {}
+        for tid in list_tids():
+            counters = read_counters(tid)
+            if counters is not None:
+                snapshot[tid] = counters
+        return snapshot
+
+    def collect(self):
+        """Sample every task and compute rates since the last sample.
+
+        Tasks that started since the last sample are treated as
+        having started at zero.
+
+        Returns:
+            List[TaskSample]: The samples, busiest first.
+        """
+        now = time.time()
+        current = self._snapshot()
+        elapsed = max(now - self._last_time, 1e-9)
+        empty = TaskCounters(0, 0, 0)
+
+        samples = []
+        for tid, counters in current.items():
+            previous = self._last.get(tid, empty)
+            cpu_seconds = float(
+                counters.cpu_ticks - previous.cpu_ticks) / CLOCK_TICKS
+            name = self.name_lookup(tid) or UNKNOWN
+            samples.append(TaskSample(
+                tid,
+                name,
+                100.0 * cpu_seconds / elapsed,
+                (counters.voluntary - previous.voluntary) / elapsed,
+                (counters.nonvoluntary - previous.nonvoluntary) / elapsed,
+            ))
+
+        self._last_time = now
+        self._last = current
+        samples.sort(key=lambda sample: (-sample.cpu_percent, sample.tid))
+        return samples
+
+
+def format_samples(samples, indent='    '):
+    """Format samples for a heartbeat.
+
+    Threads using at least ``SPIKE_PERCENT`` of a CPU are flagged.
+
+    Returns:
+        str: One line per thread (busiest first).
+    """
+    lines = []
+    for sample in samples:
+        line = (
+            '{}tid={} ({}) cpu={:.1f}% voluntary_cs/s={:.1f} '
+            'nonvoluntary_cs/s={:.1f}').format(
+                indent, sample.tid, sample.name, sample.cpu_percent,
+                sample.voluntary_rate, sample.nonvoluntary_rate)
+        if sample.cpu_percent >= SPIKE_PERCENT:
+            line += ' <-- SPIKE'
+        lines.append(line)
+    return '\n'.join(lines)
@@ -0,0 +1,139 @@
+# Copyright 2017 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import io
+import logging
+import os
+
+import pytest
+
+import binary_log
+import log_records
+
+
+TID = 4242
+
+
+def setup_function(function):
+    # NOTE: Getting the real TID imports ``thread_names`` (and so ``grpc``),
+    #       so fill in the per-thread cache instead.
+    binary_log._TID_CACHE.tid = TID
+
+
+def get_logger(name, handler):
+    logger = logging.getLogger('test-binary-log-' + name)
+    logger.propagate = False
+    logger.setLevel(logging.DEBUG)
+    logger.handlers = [handler]
+    return logger
+
+
+def test_round_trip(tmpdir):
+    handler = binary_log.BinaryHandler(str(tmpdir.join('run')))
+    logger = get_logger('round-trip', handler)
+    logger.info('Hello %s', 'world')
+    logger.debug('multi\nline')
+    try:
+        raise ValueError('boom')
+    except ValueError:
+        logger.exception('Failed')
+    handler.close()
+
+    assert handler.segments == [str(tmpdir.join('run-00000.binlog'))]
+    records = list(binary_log.iter_segment(handler.segments[0]))
+    assert [record.message for record in records] == [
+        'Hello world', 'multi\nline', 'Failed']
+    assert [record.levelno for record in records] == [
+        logging.INFO, logging.DEBUG, logging.ERROR]
+    assert {record.logger for record in records} == {logger.name}
+    assert {record.thread_name for record in records} == {'MainThread'}
+    assert {record.tid for record in records} == {TID}
+    assert records[0].trailer == records[1].trailer == ''
+    assert records[2].trailer.startswith('Traceback (most recent call last)')
+    assert records[2].trailer.endswith('ValueError: boom')
+
+    times = [record.relative_created for record in records]
+    assert times == sorted(times)
+
+
+def test_text_matches_log_format(tmpdir):
+    handler = binary_log.BinaryHandler(str(tmpdir.join('run')))
+    logger = get_logger('text', handler)
+    logger.warning('Careful')
+    handler.close()
+
+    record, = binary_log.iter_segment(handler.segments[0])
+    lines = record.text.splitlines()
+    assert lines[0].startswith('timeLevel=')
+    assert lines[0].endswith(':WARNING')
+    assert lines[1:] == [
+        'logger=' + logger.name, 'threadName=MainThread', 'Careful',
+        log_records.TEXT_SEPARATOR]
+
+
+def test_rotation(tmpdir):
+    # NOTE: Tiny blocks and segments, so every record starts a segment.
+    handler = binary_log.BinaryHandler(
+        str(tmpdir.join('run')), block_size=1, segment_size=1,
+        max_segments=3)
+    logger = get_logger('rotation', handler)
+    for index in range(5):
+        logger.info('Record %d', index)
+    handler.close()
+
+    # Only the newest segments are kept (the last one is empty).
+    assert [os.path.basename(name) for name in handler.segments] == [
+        'run-00003.binlog', 'run-00004.binlog', 'run-00005.binlog']
+    assert sorted(os.listdir(str(tmpdir))) == [
+        'run-00003.binlog', 'run-00004.binlog', 'run-00005.binlog']
+
+    # Each segment has its own string table, so decodes on its own.
+    messages = [
+        [record.message for record in binary_log.iter_segment(filename)]
+        for filename in handler.segments
+    ]
+    assert messages == [['Record 3'], ['Record 4'], []]
+
+    output = io.StringIO()
+    assert binary_log.decode(handler.segments, output) == 2
+    assert output.getvalue().count(log_records.TEXT_SEPARATOR) == 2
+
+
+def test_truncated_block_is_ignored(tmpdir):
+    handler = binary_log.BinaryHandler(
+        str(tmpdir.join('run')), block_size=1)
+    logger = get_logger('truncated', handler)
+    logger.info('First')
+    logger.info('Second')
+    handler.close()
+
+    filename = handler.segments[0]
+    with open(filename, 'rb') as file_obj:
+        data = file_obj.read()
+    with open(filename, 'wb') as file_obj:
+        file_obj.write(data[:-3])
+
+    messages = [
+        record.message for record in binary_log.iter_segment(filename)]
+    assert messages == ['First']
+
+
+def test_rejects_other_files(tmpdir):
+    filename = str(tmpdir.join('run.txt'))
+    with open(filename, 'wb') as file_obj:
+        file_obj.write(b'timeLevel=00000000:INFO\n')
+
+    with pytest.raises(ValueError):
+        list(binary_log.iter_segment(filename))
@@ -0,0 +1,83 @@
+# Copyright 2017 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import delivery_tracker
+
+
+def test_add_counts_deliveries():
+    tracker = delivery_tracker.DeliveryTracker(4)
+    assert tracker.add(1) == 1
+    assert tracker.add(1) == 2
+    assert tracker.add(3) == 1
+
+    assert tracker.total == 3
+    assert tracker.uniques == 2
+    assert tracker.redelivered == 1
+    assert tracker.count(1) == 2
+    assert tracker.count(0) == 0
+    assert tracker.histogram[1] == 1
+    assert tracker.histogram[2] == 1
+
+
+def test_grows_past_size_hint():
+    tracker = delivery_tracker.DeliveryTracker()
+    tracker.add(10)
+    tracker.add(3)
+
+    assert len(tracker.counts) >= 11
+    assert tracker.count(10) == 1
+    assert tracker.count(100) == 0
+    assert tracker.uniques == 2
+
+
+def test_counts_saturate():
+    tracker = delivery_tracker.DeliveryTracker(1)
+    max_count = delivery_tracker.MAX_COUNT
+    for _ in range(max_count + 10):
+        result = tracker.add(0)
+
+    assert result == max_count
+    assert tracker.count(0) == max_count
+    assert tracker.total == max_count + 10
+    assert tracker.uniques == 1
+    assert tracker.histogram[max_count] == 1
+    assert sum(tracker.histogram) == 1
+
+
+def test_num_missing():
+    tracker = delivery_tracker.DeliveryTracker(4)
+    tracker.add(0)
+    tracker.add(2)
+
+    assert tracker.num_missing(4) == 2
+    # Indices past the end of ``counts`` are missing too.
+    assert tracker.num_missing(10) == 8
+    assert tracker.num_missing(1) == 0
+
+
+def test_format_histogram():
+    tracker = delivery_tracker.DeliveryTracker()
+    assert tracker.format_histogram() == ''
+
+    for index in (0, 1, 1):
+        tracker.add(index)
+    for _ in range(delivery_tracker.MAX_COUNT):
+        tracker.add(2)
+
+    assert tracker.format_histogram().splitlines() == [
+        '  delivered    1 time(s): 1',
+        '  delivered    2 time(s): 1',
+        '  delivered 255+ time(s): 1',
+    ]
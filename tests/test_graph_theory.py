@@ -0,0 +1,255 @@
+# Copyright 2017 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import io
+
+import pytest
+
+# NOTE: ``graph_theory`` renders with ``pydot`` (and uses ``six``).
+pytest.importorskip('pydot')
+pytest.importorskip('six')
+
+import graph_theory  # noqa: E402
+
+
+def make_tree(edges, root_name='MainThread'):
+    # edges: List[Tuple[str, str]] (parent -> child, parents added first)
+    root = graph_theory.Tree(root_name, None)
+    for parent, child in edges:
+        root.get(parent).add_child(child)
+    return root
+
+
+def test_get_uses_index():
+    root = make_tree([
+        ('MainThread', 'Thread-A'),
+        ('MainThread', 'Thread-B'),
+        ('Thread-A', 'Thread-C'),
+    ])
+    node_a = root.get('Thread-A')
+    node_c = root.get('Thread-C')
+
+    assert node_c.parent is node_a
+    assert node_a.get('Thread-C') is node_c
+    # Only the subtree rooted at ``Thread-B`` is searched.
+    assert root.get('Thread-B').get('Thread-C') is None
+    assert root.get('Thread-D') is None
+    assert node_c.root is root
+
+
+def test_get_too_many_matches():
+    root = make_tree([
+        ('MainThread', 'Thread-A'),
+        ('MainThread', 'Thread-B'),
+        ('Thread-A', 'Thread-C'),
+        ('Thread-B', 'Thread-C'),
+    ])
+    with pytest.raises(RuntimeError):
+        root.get('Thread-C')
+    assert root.get('Thread-B').get('Thread-C').parent.name == 'Thread-B'
+
+
+def test_size_is_cached():
+    root = make_tree([
+        ('MainThread', 'Thread-A'),
+        ('MainThread', 'Thread-B'),
+        ('Thread-A', 'Thread-C'),
+    ])
+    assert root.size == 4
+    assert root.get('Thread-A').size == 2
+    root.get('Thread-C').add_child('Thread-D')
+    assert root.size == 5
+    assert root.get('Thread-A').size == 3
+    assert root.get('Thread-B').size == 1
+
+
+def test_collapse_weights():
+    root = make_tree([
+        ('MainThread', 'Thread-A'),
+        ('MainThread', 'Thread-A+1'),
+        ('MainThread', 'Thread-A+2'),
+        ('MainThread', 'Thread-B'),
+        ('Thread-A', 'Thread-C'),
+        ('Thread-A+1', 'Thread-C+1'),
+        ('Thread-A+2', 'Thread-D'),
+    ])
+    root.collapse()
+
+    # ``Thread-A+2`` has a different subtree, so it isn't merged.
+    assert [(child.name, child.weight) for child in root.children] == [
+        ('Thread-A', 2),
+        ('Thread-A+2', 1),
+        ('Thread-B', 1),
+    ]
+    assert [(child.name, child.weight)
+            for child in root.get('Thread-A').children] == [('Thread-C', 1)]
+    # The index and sizes are rebuilt without the removed nodes.
+    assert root.size == 6
+    assert root.get('Thread-C+1') is None
+    assert root.get('Thread-A').size == 2
+
+
+def test_collapse_nested_weights():
+    edges = []
+    for index in range(3):
+        parent = 'Thread-A+{:d}'.format(index)
+        edges.append(('MainThread', parent))
+        for child_index in range(2):
+            edges.append(
+                (parent, 'Thread-B+{:d}{:d}'.format(index, child_index)))
+    root = make_tree(edges)
+    root.collapse()
+
+    node_a, = root.children
+    node_b, = node_a.children
+    assert (node_a.weight, node_b.weight) == (3, 2)
+    assert root.size == 3
+
+
+def test_merge_trees():
+    first = make_tree([
+        ('MainThread', 'Thread-A'),
+        ('MainThread', 'Thread-A+1'),
+        ('Thread-A', 'Thread-B'),
+        ('Thread-A+1', 'Thread-B+1'),
+    ])
+    second = make_tree([
+        ('MainThread', 'Thread-A'),
+        ('Thread-A', 'Thread-C'),
+    ])
+    # NOTE: Collapsing doesn't change the weights in the merged tree.
+    first.collapse()
+    assert first.size == 3
+    merged = graph_theory.merge_trees([first, second])
+
+    stats = {
+        node.name: (node.count, node.weight_min, node.weight_mean,
+                    node.weight_max)
+        for node in merged.walk()
+    }
+    assert merged.num_runs == 2
+    assert stats == {
+        'MainThread': (2, 1, 1.0, 1),
+        'A': (2, 1, 1.5, 2),
+        'B': (1, 2, 2.0, 2),
+        'C': (1, 1, 1.0, 1),
+    }
+
+
+def test_merge_trees_root_mismatch():
+    assert graph_theory.merge_trees([]) is None
+    with pytest.raises(ValueError):
+        graph_theory.merge_trees([
+            graph_theory.Tree('MainThread', None),
+            graph_theory.Tree('Other', None),
+        ])
+
+
+def test_diff_trees():
+    old = make_tree([
+        ('MainThread', 'Thread-A'),
+        ('MainThread', 'Thread-B'),
+        ('Thread-B', 'Thread-C'),
+    ])
+    old.get('Thread-A').weight = 2
+    new = make_tree([
+        ('MainThread', 'Thread-A+3'),
+        ('MainThread', 'Thread-D'),
+        ('Thread-D', 'Thread-E'),
+    ])
+    new.get('Thread-A+3').weight = 3
+
+    diff = graph_theory.diff_trees(old, new)
+    statuses = [(node.path, node.status) for node in diff.walk()]
+    assert statuses == [
+        (('MainThread',), graph_theory.SAME),
+        (('MainThread', 'A'), graph_theory.REWEIGHTED),
+        (('MainThread', 'D'), graph_theory.ADDED),
+        (('MainThread', 'D', 'E'), graph_theory.ADDED),
+        (('MainThread', 'B'), graph_theory.REMOVED),
+        (('MainThread', 'B', 'C'), graph_theory.REMOVED),
+    ]
+    assert diff.report().splitlines() == [
+        '~ MainThread -> A (weight=2 -> 3)',
+        '+ MainThread -> D (weight=1)',
+        '- MainThread -> B (weight=1)',
+    ]
+
+
+def test_diff_trees_pairs_by_structure():
+    old = make_tree([
+        ('MainThread', 'Thread-A'),
+        ('MainThread', 'Thread-A+1'),
+        ('Thread-A+1', 'Thread-B'),
+    ])
+    # The same children, in the other order.
+    new = make_tree([
+        ('MainThread', 'Thread-A'),
+        ('MainThread', 'Thread-A+1'),
+        ('Thread-A', 'Thread-B'),
+    ])
+
+    diff = graph_theory.diff_trees(old, new)
+    assert list(diff.changes()) == []
+    assert diff.report() == ''
+
+
+def weights(tree):
+    # Returns: List[Tuple[str, str, int]] (the edges of each parent in turn)
+    result = []
+    to_visit = [tree]
+    while to_visit:
+        node = to_visit.pop()
+        for child in node.children:
+            result.append((node.name, child.name, child.weight))
+        to_visit.extend(reversed(node.children))
+    return result
+
+
+def test_write_dot_load_dot_round_trip(tmpdir):
+    root = make_tree([
+        ('MainThread', 'Thread-A'),
+        ('MainThread', 'Thread-A+1'),
+        ('MainThread', 'Thread-B'),
+        ('Thread-A', 'Thread-C'),
+        ('Thread-A+1', 'Thread-C+1'),
+        ('Thread-B', 'ThreadPoolExecutor-0_0'),
+    ])
+    root.collapse()
+
+    filename = tmpdir.join('tree.dot')
+    with io.open(str(filename), 'w') as file_obj:
+        with graph_theory.DotWriter(file_obj) as writer:
+            root.write_dot(writer)
+    lines = filename.read().splitlines()
+    assert lines[:2] == ['digraph G {', 'rankdir=LR;']
+    assert '"MainThread" -> "Thread-A"  [label="2"];' in lines
+    assert '"Thread-A" -> "Thread-C";' in lines
+    assert lines[-1] == '}'
+
+    loaded = graph_theory.load_dot(str(filename))
+    assert loaded.is_same(root)
+    assert weights(loaded) == weights(root) == [
+        ('MainThread', 'Thread-A', 2),
+        ('MainThread', 'Thread-B', 1),
+        ('Thread-A', 'Thread-C', 1),
+        ('Thread-B', 'ThreadPoolExecutor-0_0', 1),
+    ]
+
+
+def test_dot_quote():
+    assert graph_theory.dot_quote('Thread-A') == '"Thread-A"'
+    assert graph_theory.dot_quote('say "hi"') == '"say \\"hi\\""'
+    # NOTE: Escapes such as ``\n`` are left for Graphviz.
+    assert graph_theory.dot_quote('A\\n2 runs') == '"A\\n2 runs"'
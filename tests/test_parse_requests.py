@@ -0,0 +1,89 @@
+# Copyright 2017 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import subprocess
+import sys
+
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SCRIPT = os.path.join(
+    os.path.dirname(HERE), 'issue-4238', 'parse_requests.py')
+SUMMARY_LOG = """\
+timeLevel=00000100:DEBUG
+logger=grpc._channel
+threadName=Thread-gRPC-ConsumeRequestIterator
+consume_request_iterator() sent request #1: kind=initial, ack_ids=0, \
+modify_deadline_ack_ids=0, bytes=60 (sampled):
+subscription: "projects/p/subscriptions/s"
+----------------------------------------
+timeLevel=00000200:DEBUG
+logger=grpc._channel
+threadName=Thread-gRPC-ConsumeRequestIterator
+consume_request_iterator() sent request #2: kind=ack, ack_ids=3, \
+modify_deadline_ack_ids=0, bytes=60
+----------------------------------------
+timeLevel=00000250:DEBUG
+logger=grpc._channel
+threadName=Thread-gRPC-ConsumeRequestIterator
+consume_request_iterator() sent request #3: kind=modack, ack_ids=0, \
+modify_deadline_ack_ids=3, bytes=60
+----------------------------------------
+timeLevel=00000300:DEBUG
+logger=grpc._channel
+threadName=Thread-gRPC-ConsumeRequestIterator
+consume_request_iterator() encountered StopIteration
+----------------------------------------
+timeLevel=00000400:DEBUG
+logger=grpc._channel
+threadName=Thread-gRPC-ConsumeRequestIterator
+consume_request_iterator() totals:
+      requests=3 (ack=1, initial=1, modack=1)
+       ack_ids=3
+    modack_ids=3
+         bytes=180
+----------------------------------------
+"""
+
+
+def parse(filename):
+    output = subprocess.check_output(
+        (sys.executable, SCRIPT, '--filename', filename))
+    return output.decode('utf-8').splitlines()
+
+
+def test_checked_in_log():
+    lines = parse('0.29.2.txt')
+    assert lines[-2:] == [
+        'Total consume_request_iterator() messages: 2',
+        'Acks sent: 0',
+    ]
+    # The initial request and ``encountered StopIteration``.
+    assert lines.count(
+        'threadName=Thread-gRPC-ConsumeRequestIterator') == 2
+    assert 'consume_request_iterator() encountered StopIteration' in lines
+
+
+def test_summary_log(tmpdir):
+    filename = tmpdir.join('summary.txt')
+    filename.write(SUMMARY_LOG)
+
+    lines = parse(str(filename))
+    assert lines[-2:] == [
+        'Total consume_request_iterator() messages: 4',
+        'Acks sent: 1',
+    ]
+    assert 'subscription: "projects/p/subscriptions/s"' in lines
+    assert 'consume_request_iterator() encountered StopIteration' in lines
+    assert not any('totals' in line for line in lines)
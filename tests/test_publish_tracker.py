@@ -0,0 +1,71 @@
+# Copyright 2017 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+from concurrent import futures
+import logging
+import math
+
+import publish_tracker
+
+
+def test_tracks_completion():
+    tracker = publish_tracker.PublishTracker(2)
+    succeed = futures.Future()
+    fail = futures.Future()
+    pending = futures.Future()
+    assert [tracker.track(future) for future in (succeed, fail, pending)] == [
+        0, 1, 2]
+    assert tracker.info == (0, 0, 3)
+
+    succeed.set_result('message-id')
+    fail.set_exception(ValueError('publish failed'))
+
+    assert tracker.info == (1, 1, 3)
+    assert tracker.latencies[0] >= 0.0
+    assert tracker.latencies[1] >= 0.0
+    assert math.isnan(tracker.latencies[2])
+
+
+def test_already_done_future():
+    tracker = publish_tracker.PublishTracker()
+    future = futures.Future()
+    future.set_result('message-id')
+
+    # NOTE: The callback runs right away, in ``track()``.
+    assert tracker.track(future) == 0
+    assert tracker.info == (1, 0, 1)
+    assert len(tracker.latencies) == 1
+
+
+def test_summary(caplog):
+    tracker = publish_tracker.PublishTracker(3)
+    logger = logging.getLogger('test-publish-tracker')
+    caplog.set_level(logging.INFO)
+
+    tracker.summary(logger)
+    assert caplog.messages[-1] == (
+        'Publish futures: 0 done, 0 failed, 0 pending')
+
+    done = [futures.Future() for _ in range(3)]
+    for future in done:
+        tracker.track(future)
+    done[0].set_result('message-id')
+    done[1].set_exception(ValueError('publish failed'))
+
+    tracker.summary(logger)
+    lines = caplog.messages[-1].splitlines()
+    assert lines[0] == 'Publish futures: 1 done, 1 failed, 1 pending'
+    assert lines[1].startswith('  latency: p50=')
+    assert lines[2].startswith('  max=')
@@ -0,0 +1,124 @@
+# Copyright 2017 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import threading
+import time
+
+import pytest
+
+import sampler
+
+
+class DoneFuture(object):
+
+    def running(self):
+        return False
+
+    def done(self):
+        return True
+
+    def exception(self):
+        return None
+
+
+class Helper(object):
+
+    def __init__(self, *values):
+        self.values = values
+        self.num_reads = 0
+
+    @property
+    def extra_args(self):
+        raise AssertionError('extra_args may have side effects')
+
+    @property
+    def sample_args(self):
+        self.num_reads += 1
+        return self.values
+
+
+def test_ring_drain_in_order():
+    ring = sampler.SampleRing(4, 2)
+    for value in (1.0, 2.0, 3.0):
+        ring.append((value, -value))
+
+    assert len(ring) == 3
+    records = [tuple(record) for record in ring.drain()]
+    assert records == [(1.0, -1.0), (2.0, -2.0), (3.0, -3.0)]
+    assert len(ring) == 0
+    assert ring.drain() == []
+
+
+def test_ring_overwrites_oldest():
+    ring = sampler.SampleRing(3, 1)
+    for value in range(5):
+        ring.append((value,))
+
+    assert ring.dropped == 2
+    assert [tuple(record) for record in ring.drain()] == [
+        (2.0,), (3.0,), (4.0,)]
+
+
+@pytest.mark.parametrize('record', [(1.0,), (1.0, 2.0, 3.0)])
+def test_ring_rejects_wrong_width(record):
+    ring = sampler.SampleRing(3, 2)
+    ring.append((1.0, 2.0))
+    with pytest.raises(ValueError):
+        ring.append(record)
+
+    # The flat array (and so every later record) is unchanged.
+    assert len(ring.values) == 6
+    ring.append((3.0, 4.0))
+    assert [tuple(record) for record in ring.drain()] == [
+        (1.0, 2.0), (3.0, 4.0)]
+
+
+def test_sample_uses_sample_args():
+    helper = Helper(7, 8.5)
+    heartbeat_sampler = sampler.HeartbeatSampler(
+        DoneFuture(), helper, None, count_threads=lambda: 3)
+
+    record = heartbeat_sampler.sample()
+    assert len(record) == len(sampler.BASE_FIELDS) + 2
+    assert record[1:] == (0.0, 1.0, 3.0, 0.0, 7, 8.5)
+    assert helper.num_reads == 1
+
+
+def test_run_writes_csv(tmpdir):
+    created = []
+
+    def thread_class(**kwargs):
+        thread = threading.Thread(**kwargs)
+        created.append(thread)
+        return thread
+
+    filename = str(tmpdir.join('samples.csv'))
+    heartbeat_sampler = sampler.HeartbeatSampler(
+        DoneFuture(), Helper(1.5), filename, rate=1000.0,
+        flush_interval=0.01, thread_class=thread_class)
+    heartbeat_sampler.start()
+    while heartbeat_sampler.num_samples < 5:
+        time.sleep(0.001)
+    heartbeat_sampler.stop()
+
+    assert [thread.name for thread in created] == [sampler.THREAD_NAME]
+    with open(filename) as file_obj:
+        lines = file_obj.read().splitlines()
+    assert lines[0] == ','.join(sampler.BASE_FIELDS + ('extra_0',))
+    rows = [line for line in lines[1:] if not line.startswith('#')]
+    assert len(rows) == heartbeat_sampler.num_samples
+    for row in rows:
+        values = row.split(',')
+        assert len(values) == len(sampler.BASE_FIELDS) + 1
+        assert values[-1] == '1.5'
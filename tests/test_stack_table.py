@@ -0,0 +1,70 @@
+# Copyright 2017 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import stack_table
+
+
+def capture_here(table, **kwargs):
+    return table.capture(**kwargs)
+
+
+def capture_nested(table, **kwargs):
+    return capture_here(table, **kwargs)
+
+
+def test_same_stack_is_interned():
+    table = stack_table.StackTable()
+    stack_ids = [capture_here(table) for _ in range(3)]
+
+    assert stack_ids == [0, 0, 0]
+    assert len(table) == 1
+    assert table.count(0) == 3
+
+
+def test_different_stacks():
+    table = stack_table.StackTable()
+    first = capture_here(table)
+    second = capture_nested(table)
+    # Same function, but called from a different line.
+    third = capture_here(table)
+
+    assert len({first, second, third}) == 3
+    assert len(table) == 3
+    assert [table.count(stack_id) for stack_id in range(3)] == [1, 1, 1]
+
+
+def test_format_outermost_first():
+    table = stack_table.StackTable()
+    stack_id = capture_nested(table)
+    text = table.format(stack_id)
+
+    lines = text.splitlines()
+    assert lines[-2].endswith(', in capture_here')
+    assert lines[-1] == '    return table.capture(**kwargs)'
+    assert lines[-4].endswith(', in capture_nested')
+    assert lines[-3] == '    return capture_here(table, **kwargs)'
+    assert ', in test_format_outermost_first' in lines[-6]
+    assert text.startswith('  File "')
+
+
+def test_skip_and_limit():
+    table = stack_table.StackTable()
+    skipped = capture_nested(table, skip=1, limit=2)
+    lines = table.format(skipped).splitlines()
+
+    # ``capture_here`` is skipped and only two frames are kept.
+    assert len(lines) == 4
+    assert lines[0].endswith(', in test_skip_and_limit')
+    assert lines[2].endswith(', in capture_nested')
@@ -0,0 +1,106 @@
+# Copyright 2017 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+import pytest
+
+# NOTE: ``thread_names`` patches ``grpc`` and ``google-cloud-pubsub``.
+pytest.importorskip('grpc')
+pytest.importorskip('google.cloud.pubsub_v1')
+
+import thread_names  # noqa: E402
+
+
+def test_register_adds_ordinals():
+    registry = thread_names.ThreadRegistry()
+    names = [
+        registry.register('Thread-gRPC-StopChannelSpin', 'MainThread').name
+        for _ in range(3)
+    ]
+    assert names == [
+        'Thread-gRPC-StopChannelSpin',
+        'Thread-gRPC-StopChannelSpin+1',
+        'Thread-gRPC-StopChannelSpin+2',
+    ]
+    other = registry.register('Thread-ConsumeBidirectionalStream', 'Main')
+    assert other.name == 'Thread-ConsumeBidirectionalStream'
+
+
+def test_register_avoids_requested_ordinals():
+    registry = thread_names.ThreadRegistry()
+    registry.register('Thread-A+1', 'MainThread')
+    assert registry.register('Thread-A', 'MainThread').name == 'Thread-A'
+    # NOTE: ``Thread-A+1`` was requested directly, so it is skipped.
+    assert registry.register('Thread-A', 'MainThread').name == 'Thread-A+2'
+
+
+def test_register_records_lifecycle():
+    registry = thread_names.ThreadRegistry()
+    record = registry.register('Thread-A', 'MainThread')
+    assert record.parent == 'MainThread'
+    assert record.created is not None
+    assert record.started is None
+    assert record.exited is None
+    assert record.tid is None
+    assert registry.by_name == {'Thread-A': record}
+
+
+def test_snapshot_and_clear():
+    registry = thread_names.ThreadRegistry()
+    first = registry.register('Thread-A', 'MainThread')
+    snapshot = registry.snapshot()
+    second = registry.register('Thread-B', 'Thread-A')
+
+    assert snapshot == [first]
+    assert registry.snapshot() == [first, second]
+
+    registry.clear()
+    assert registry.snapshot() == []
+    # Ordinals start over after clearing.
+    assert registry.register('Thread-A', 'MainThread').name == 'Thread-A'
+
+
+def test_log_creation_target_sets_times():
+    registry = thread_names.ThreadRegistry()
+    record = registry.register('Thread-A', 'MainThread')
+    target = thread_names.LogCreationTarget(lambda value: value + 1)
+    target.record = record
+
+    assert target(1) == 2
+    assert record.tid is not None
+    assert record.created <= record.started <= record.exited
+
+
+@pytest.mark.parametrize('name,expected', [
+    ('ThreadPoolExecutor-SubscriberPolicy_2',
+     'ThreadPoolExecutor-SubscriberPolicy'),
+    ('ThreadPoolExecutor-SubscriberPolicy_x',
+     'ThreadPoolExecutor-SubscriberPolicy_x'),
+    ('Thread-gRPC-SpawnDelivery', 'Thread-gRPC-SpawnDelivery'),
+])
+def test_executor_name_rewrite(name, expected):
+    assert thread_names.executor_name_rewrite(name) == expected
+
+
+def test_untracked_cleanup_thread(monkeypatch):
+    registry = thread_names.ThreadRegistry()
+    monkeypatch.setattr(thread_names, 'REGISTRY', registry)
+    cleanup_thread = thread_names.grpc._common.CleanupThread
+    thread = cleanup_thread.__new__(cleanup_thread)
+    target = thread_names.LogCreationTarget(lambda: None)
+
+    thread_names.named_cleanup_thread_constructor(
+        thread, None, name='FakePubSub-Serve', target=target)
+    assert thread.name == 'FakePubSub-Serve'
+    assert registry.snapshot() == []
@@ -16,6 +16,7 @@ import ctypes
 import logging
 import os
 import threading
+import time
 
 from google.cloud import pubsub_v1
 from google.cloud.pubsub_v1.subscriber import policy
@@ -23,7 +24,9 @@ import grpc._channel
 import grpc._common
 import grpc._plugin_wrapping
 
+import fake_pubsub
 import graph_theory
+import trace_events
 import utils
 
 
@@ -38,10 +41,12 @@ CHANNEL_SPIN_REPR = (
 CONSUME_REQUEST_REPR = (
     '<function _consume_request_iterator.<locals>.'
     'consume_request_iterator at 0x')
-THREAD_PARENTS = []
-THREAD_NAMES = []
 TID_LOCK = threading.Lock()
 TID_MAP = {}
+STACK_LIMIT = 15
+# NOTE: When set, only the ``.dot`` file is written at the end of a run and
+#       the ``.svg`` is left for ``python graph_theory.py render``.
+DEFER_SVG_ENV = 'PUBSUB_DEFER_SVG'
 
 
 def get_thread_id():
@@ -54,29 +59,140 @@ def get_thread_id():
     return LIBC.syscall(186)
 
 
+def tid_name(tid):
+    """Get the name of the thread with a given ``pthread`` ID.
+
+    Only threads started after ``LogCreationTarget.ADD_LOGGING`` was set
+    (or that called ``LogCreationTarget._log_current()``) are known.
+
+    Returns:
+        Optional[str]: The name, if known.
+    """
+    with TID_LOCK:
+        return TID_MAP.get(tid)
+
+
 def executor_name_rewrite(name):
     """Rewrites names generated by a thread pool executor.
 
     For example, ``ThreadPoolExecutor-SubscriberPolicy_2`` gets rewritten
-    as ``ThreadPoolExecutor-SubscriberPolicy++``.
+    as ``ThreadPoolExecutor-SubscriberPolicy`` (the registry then adds an
+    ordinal to make it unique).
     """
     parts = name.rsplit('_', 1)
     if len(parts) != 2:
         return name
     pre, post = parts
     try:
-        index = int(post)
-        return '{}{}'.format(pre, '+' * index)
+        int(post)
+        return pre
     except ValueError:
         return name
 
 
+class ThreadRecord(object):
+    """Lifecycle of a single thread created while patched.
+
+    Times are from ``time.time()`` and are :data:`None` until the
+    corresponding event happens.
+    """
+
+    __slots__ = (
+        'name', 'parent', 'created', 'started', 'exited', 'tid', 'stack')
+
+    def __init__(self, name, parent, created, stack=None):
+        # name: str
+        # parent: str (the name of the creating thread)
+        # created: float
+        # stack: Optional[int] (a stack ID in ``utils.STACKS``)
+        self.name = name
+        self.parent = parent
+        self.created = created
+        self.stack = stack
+        # started: Optional[float]
+        self.started = None
+        # exited: Optional[float]
+        self.exited = None
+        # tid: Optional[int]
+        self.tid = None
+
+    def __repr__(self):
+        return '<ThreadRecord name={!r} parent={!r} tid={}>'.format(
+            self.name, self.parent, self.tid)
+
+
+class ThreadRegistry(object):
+    """Unique names and lifecycle records for every thread created.
+
+    Duplicate names get an ordinal suffix from a per-name counter, e.g.
+    the third ``Thread-gRPC-StopChannelSpin`` is named
+    ``Thread-gRPC-StopChannelSpin+2``.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # ordinals: Dict[str, int] (base name -> next ordinal)
+        self.ordinals = {}
+        # records: List[ThreadRecord] (in creation order)
+        self.records = []
+        # by_name: Dict[str, ThreadRecord]
+        self.by_name = {}
+
+    def register(self, base_name, parent, stack=None):
+        """Register a thread that is about to be created.
+
+        Args:
+            base_name (str): The requested name.
+            parent (str): The name of the creating thread.
+            stack (Optional[int]): The ID of the stack (in
+                ``utils.STACKS``) where the thread was created.
+
+        Returns:
+            ThreadRecord: The record, with a unique ``name``.
+        """
+        created = time.time()
+        with self.lock:
+            ordinal = self.ordinals.get(base_name, 0)
+            while True:
+                if ordinal == 0:
+                    name = base_name
+                else:
+                    name = '{}+{:d}'.format(base_name, ordinal)
+                ordinal += 1
+                # NOTE: A requested name may itself look like it has an
+                #       ordinal, so we still check for collisions.
+                if name not in self.by_name:
+                    break
+
+            self.ordinals[base_name] = ordinal
+            record = ThreadRecord(name, parent, created, stack=stack)
+            self.records.append(record)
+            self.by_name[name] = record
+            return record
+
+    def snapshot(self):
+        # Returns: List[ThreadRecord]
+        with self.lock:
+            return list(self.records)
+
+    def clear(self):
+        with self.lock:
+            self.ordinals.clear()
+            del self.records[:]
+            self.by_name.clear()
+
+
+REGISTRY = ThreadRegistry()
+
+
 class LogCreationTarget(object):
 
     ADD_LOGGING = False
 
     def __init__(self, to_call):
         self.to_call = to_call
+        # record: Optional[ThreadRecord] (set by ``check_thread_name()``)
+        self.record = None
 
     @staticmethod
     def _log_current():
@@ -90,11 +206,20 @@ class LogCreationTarget(object):
         return tid
 
     def __call__(self, *args, **kwargs):
+        record = self.record
+        if record is not None:
+            record.tid = get_thread_id()
+            record.started = time.time()
+
         if self.ADD_LOGGING:
             tid = self._log_current()
             logging.debug('Created TID: %s', tid)
 
-        return self.to_call(*args, **kwargs)
+        try:
+            return self.to_call(*args, **kwargs)
+        finally:
+            if record is not None:
+                record.exited = time.time()
 
 
 def update_thread_kwargs(args, kwargs):
@@ -162,25 +287,43 @@ def update_thread_kwargs(args, kwargs):
         'Unexpected target', args, kwargs)
 
 
+def capture_stack(skip=1):
+    """Capture the current stack in ``utils.STACKS``.
+
+    Args:
+        skip (int): The number of (innermost) frames to leave out, in
+            addition to this function.
+
+    Returns:
+        int: The stack ID (see ``utils.format_stack()``).
+    """
+    return utils.STACKS.capture(skip=skip + 1, limit=STACK_LIMIT)
+
+
 def check_thread_name(kwargs):
-    name = kwargs['name']
-    with threading.Lock():
-        while name in THREAD_NAMES:
-            name += '+'
-        THREAD_NAMES.append(name)
-        THREAD_PARENTS.append(threading.current_thread().name)
-        kwargs['name'] = name
+    parent = threading.current_thread().name
+    # NOTE: Skip ``check_thread_name()`` and the patched constructor.
+    stack = capture_stack(skip=2)
+    record = REGISTRY.register(kwargs['name'], parent, stack=stack)
+    kwargs['name'] = record.name
+    kwargs['target'].record = record
 
 
 def named_thread(*args, **kwargs):
+    # Threads owned by the fake server are not part of the client.
+    if fake_pubsub.is_untracked(kwargs):
+        return ORIGINAL_THREAD(*args, **kwargs)
+
     update_thread_kwargs(args, kwargs)
     check_thread_name(kwargs)
     return ORIGINAL_THREAD(*args, **kwargs)
 
 
 def named_cleanup_thread_constructor(self, behavior, *args, **kwargs):
-    update_thread_kwargs(args, kwargs)
-    check_thread_name(kwargs)
+    # NOTE: This mirrors ``named_thread()``, including the fake server guard.
+    if not fake_pubsub.is_untracked(kwargs):
+        update_thread_kwargs(args, kwargs)
+        check_thread_name(kwargs)
     ORIGINAL_THREAD.__init__(self, *args, **kwargs)
     self._behavior = behavior
 
@@ -201,16 +344,30 @@ def save_tree(directory, logger):
         directory,
         utils.PUBSUB.version(),
     )
-    assert len(THREAD_NAMES) == len(THREAD_PARENTS)
-
     root = graph_theory.Tree('MainThread', None)
     to_log = []
-    for parent, name in zip(THREAD_PARENTS, THREAD_NAMES):
-        sub_tree = root.get(parent)
-        sub_tree.add_child(name)
-        to_log.append('{} -> {}'.format(parent, name))
+    for record in REGISTRY.snapshot():
+        sub_tree = root.get(record.parent)
+        sub_tree.add_child(record.name)
+        to_log.append('{} -> {}'.format(record.parent, record.name))
 
     logger.debug(
         'Thread / Parent relationships:\n%s', '\n'.join(to_log))
 
-    root.save_graphviz(filename_base)
+    svg = os.environ.get(DEFER_SVG_ENV, '') in ('', '0')
+    root.save_graphviz(filename_base, svg=svg)
+    save_trace(filename_base, logger)
+
+
+def save_trace(filename_base, logger):
+    """Write the buffered trace events (if ``PUBSUB_TRACE`` is set).
+
+    Thread lifetimes are added from the registry just before writing.
+    """
+    tracer = trace_events.TRACER
+    if not tracer.enabled:
+        return
+    tracer.add_thread_records(REGISTRY.snapshot())
+    filename = filename_base + '-trace.json'
+    num_events = tracer.write(filename)
+    logger.info('Wrote %d trace events to %s', num_events, filename)
@@ -0,0 +1,185 @@
+# Copyright 2017 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Timeline export in the Chrome trace event (JSON) format.
+
+Events are buffered in memory while a scenario runs and written at
+teardown; the output can be loaded in ``chrome://tracing`` or Perfetto.
+Every thread gets its own track, named after the (unique) name given
+by ``thread_names``.
+
+Timestamps use the same clock as ``relativeCreated`` in the text logs.
+"""
+
+import contextlib
+import json
+import logging
+import os
+import threading
+import time
+
+
+TRACE_ENV = 'PUBSUB_TRACE'
+
+
+def _timestamp(when=None):
+    # Returns: float (microseconds since the ``logging`` module loaded)
+    if when is None:
+        when = time.time()
+    return 1e6 * (when - logging._startTime)
+
+
+class TraceRecorder(object):
+    """Buffers trace events in memory.
+
+    All methods are no-ops unless ``enabled`` is set.
+    """
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.pid = os.getpid()
+        # events: List[dict]
+        self.events = []
+        # tracks: Dict[str, int] (thread name -> track ID)
+        self.tracks = {}
+        self._lock = threading.Lock()
+
+    def track(self, thread_name=None):
+        # Returns: int
+        if thread_name is None:
+            thread_name = threading.current_thread().name
+        track_id = self.tracks.get(thread_name)
+        if track_id is None:
+            with self._lock:
+                track_id = self.tracks.setdefault(
+                    thread_name, len(self.tracks) + 1)
+        return track_id
+
+    def complete(self, name, category, start, end, args=None,
+                 thread_name=None):
+        """Record a span (a "complete" event).
+
+        Args:
+            name (str): The event name.
+            category (str): The event category.
+            start (float): The start, from ``time.time()``.
+            end (float): The end, from ``time.time()``.
+            args (Optional[dict]): Extra data to attach.
+            thread_name (Optional[str]): The track; defaults to the
+                current thread.
+        """
+        if not self.enabled:
+            return
+        event = {
+            'name': name,
+            'cat': category,
+            'ph': 'X',
+            'ts': _timestamp(start),
+            'dur': 1e6 * (end - start),
+            'pid': self.pid,
+            'tid': self.track(thread_name),
+        }
+        if args:
+            event['args'] = args
+        self.events.append(event)
+
+    def instant(self, name, category, when=None, args=None,
+                thread_name=None):
+        """Record an instant event (on the thread's track)."""
+        if not self.enabled:
+            return
+        event = {
+            'name': name,
+            'cat': category,
+            'ph': 'i',
+            's': 't',
+            'ts': _timestamp(when),
+            'pid': self.pid,
+            'tid': self.track(thread_name),
+        }
+        if args:
+            event['args'] = args
+        self.events.append(event)
+
+    @contextlib.contextmanager
+    def span(self, name, category, args=None):
+        if not self.enabled:
+            yield
+            return
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.complete(name, category, start, time.time(), args=args)
+
+    def add_thread_records(self, records, now=None):
+        """Add thread lifetimes from the thread registry.
+
+        Each thread gets a span from start to exit (or ``now`` if still
+        running) on its own track, and its creation is marked on the
+        parent's track.
+
+        Args:
+            records (Iterable[thread_names.ThreadRecord]): The threads.
+            now (Optional[float]): The end for threads still running.
+        """
+        if not self.enabled:
+            return
+        if now is None:
+            now = time.time()
+
+        for record in records:
+            self.instant(
+                'spawn ' + record.name, 'thread', when=record.created,
+                thread_name=record.parent)
+            if record.started is None:
+                continue
+            exited = record.exited
+            args = {'parent': record.parent, 'tid': record.tid}
+            if exited is None:
+                exited = now
+                args['alive'] = True
+            self.complete(
+                record.name, 'thread', record.started, exited, args=args,
+                thread_name=record.name)
+
+    def _metadata(self):
+        events = [{
+            'name': 'process_name',
+            'ph': 'M',
+            'pid': self.pid,
+            'args': {'name': 'python'},
+        }]
+        for thread_name, track_id in sorted(
+                self.tracks.items(), key=lambda item: item[1]):
+            events.append({
+                'name': 'thread_name',
+                'ph': 'M',
+                'pid': self.pid,
+                'tid': track_id,
+                'args': {'name': thread_name},
+            })
+        return events
+
+    def write(self, filename):
+        with self._lock:
+            events = self._metadata() + self.events
+        with open(filename, 'w') as file_obj:
+            json.dump(
+                {'traceEvents': events, 'displayTimeUnit': 'ms'}, file_obj)
+        return len(events)
+
+
+TRACER = TraceRecorder(
+    enabled=os.environ.get(TRACE_ENV, '') not in ('', '0'))
@@ -26,7 +26,17 @@ from google.cloud import pubsub_v1
 import pkg_resources
 import six
 
+import async_logging
+import binary_log
+import fake_pubsub
+import gil_probe
+import graph_theory
 import grpc_patches
+import heartbeat_sink
+import latency
+import profiler
+import sampler
+import stack_table
 
 
 SCOPES = ('https://www.googleapis.com/auth/pubsub',)
@@ -47,6 +57,28 @@ exception=%r"""
 MAX_TIME = 300
 DONE_HEARTBEATS = 4
 ORIGINAL_STDERR = sys.stderr
+FAKE_SERVER_ENV = 'PUBSUB_FAKE_SERVER'
+SAMPLE_RATE_ENV = 'PUBSUB_SAMPLE_RATE'
+HEARTBEAT_JSONL_ENV = 'PUBSUB_HEARTBEAT_JSONL'
+ASYNC_LOG_ENV = 'PUBSUB_ASYNC_LOG'
+ASYNC_LOG_SIZE_ENV = 'PUBSUB_ASYNC_LOG_SIZE'
+BINARY_LOG_ENV = 'PUBSUB_BINARY_LOG'
+PROFILE_RATE_ENV = 'PUBSUB_PROFILE_RATE'
+GIL_PROBE_ENV = 'PUBSUB_GIL_PROBE'
+RUN_INFO = {}
+# NOTE: Threads started by our own diagnostics are left out of heartbeats.
+DIAGNOSTIC_THREAD_NAMES = frozenset((
+    async_logging.THREAD_NAME,
+    gil_probe.THREAD_NAME,
+    profiler.THREAD_NAME,
+    sampler.THREAD_NAME,
+))
+STACKS = stack_table.StackTable()
+STACK_TEMPLATE = 'Stack %d (captured %d time(s)):\n\n%s'
+PROFILE_TEMPLATE = """\
+Profiler took %d samples (%.3fms each), wrote %d stacks to %s
+Samples per thread kind:
+%s"""
 LOGGER_BASE = logging.getLogger(
     'google.cloud.pubsub_v1.subscriber.policy.base')
 LOGGER_THREAD = logging.getLogger(
@@ -59,29 +91,156 @@ def setup_logging(directory, spin_also=False):
     #       the orchestration across threads is funky (I still do
     #       not **fully** understand it).
     logging.getLogger().setLevel(logging.DEBUG)
+    RUN_INFO['directory'] = directory
     filename = os.path.join(
         directory,
         '{}.txt'.format(PUBSUB.version()),
     )
-    logging.basicConfig(
-        format=LOG_FORMAT,
-        filename=filename,
-        filemode='w',
-    )
+    async_policy = get_async_log_policy()
+    if os.environ.get(BINARY_LOG_ENV, '') not in ('', '0'):
+        # NOTE: The binary log replaces the text log (and takes
+        #       precedence over asynchronous logging).
+        filename_base = os.path.join(directory, PUBSUB.version())
+        handler = binary_log.BinaryHandler(filename_base)
+        logging.getLogger().addHandler(handler)
+        RUN_INFO['log_handler'] = handler
+    elif async_policy is None:
+        logging.basicConfig(
+            format=LOG_FORMAT,
+            filename=filename,
+            filemode='w',
+        )
+    else:
+        capacity = int(os.environ.get(
+            ASYNC_LOG_SIZE_ENV, async_logging.DEFAULT_CAPACITY))
+        handler = async_logging.AsyncHandler(
+            filename, capacity=capacity, policy=async_policy)
+        handler.setFormatter(logging.Formatter(LOG_FORMAT))
+        logging.getLogger().addHandler(handler)
+        RUN_INFO['log_handler'] = handler
     # Redirect ``stderr`` to logging.
     sys.stderr = StdErrLogger()
+    # NOTE: Start the profiler and GIL probe before
+    #       ``thread_names.monkey_patch()`` so their threads aren't tracked.
+    start_profiler()
+    start_gil_probe()
 
     # Make the "current" logger.
     logger_name = '{}-repro'.format(os.path.basename(directory))
     return logging.getLogger(logger_name)
 
 
+def start_profiler():
+    """Start a sampling profiler, if ``PUBSUB_PROFILE_RATE`` is set.
+
+    The profiler is stopped and its output written by
+    ``stop_profiler()``, which scenarios call when tearing down.
+
+    Returns:
+        Optional[profiler.SamplingProfiler]: The profiler.
+    """
+    value = os.environ.get(PROFILE_RATE_ENV, '')
+    if value in ('', '0'):
+        return None
+    sampling_profiler = profiler.SamplingProfiler(
+        rate=float(value), kind=graph_theory.clean_name)
+    sampling_profiler.start()
+    RUN_INFO['profiler'] = sampling_profiler
+    return sampling_profiler
+
+
+def start_gil_probe():
+    """Start a GIL contention probe, if ``PUBSUB_GIL_PROBE`` is set.
+
+    Each heartbeat logs a summary of the contention since the previous
+    one. Stalls are blamed on the threads the sampling profiler observed
+    running, so the profiler is started (at its default rate) if
+    ``PUBSUB_PROFILE_RATE`` isn't set. The probe is stopped by
+    ``stop_gil_probe()``, which scenarios call when tearing down.
+
+    Returns:
+        Optional[gil_probe.GilProbe]: The probe.
+    """
+    if os.environ.get(GIL_PROBE_ENV, '') in ('', '0'):
+        return None
+    sampling_profiler = RUN_INFO.get('profiler')
+    if sampling_profiler is None:
+        sampling_profiler = profiler.SamplingProfiler(
+            kind=graph_theory.clean_name)
+        sampling_profiler.start()
+        RUN_INFO['profiler'] = sampling_profiler
+    probe = gil_probe.GilProbe(observer=sampling_profiler)
+    probe.start()
+    RUN_INFO['gil_probe'] = probe
+    return probe
+
+
+def stop_gil_probe(logger):
+    """Stop the GIL probe (if running) and log its totals."""
+    probe = RUN_INFO.pop('gil_probe', None)
+    if probe is None:
+        return
+    probe.stop()
+    logger.info('%s', probe.final_summary())
+
+
+def stop_profiler(logger):
+    """Stop the sampling profiler (if running) and write folded stacks.
+
+    The stacks are written to ``${VERSION}-profile.folded``. Call this
+    after ``stop_gil_probe()``, since the probe uses the profiler.
+    """
+    sampling_profiler = RUN_INFO.pop('profiler', None)
+    if sampling_profiler is None:
+        return
+    sampling_profiler.stop()
+    filename = output_filename('-profile.folded')
+    num_stacks = sampling_profiler.write(filename)
+    num_samples = sampling_profiler.num_samples
+    kinds = '\n'.join(
+        '  {}={:d}'.format(kind, count)
+        for kind, count in sampling_profiler.kind_totals())
+    logger.info(
+        PROFILE_TEMPLATE, num_samples,
+        1000.0 * sampling_profiler.sample_time / max(num_samples, 1),
+        num_stacks, filename, kinds)
+
+
+def get_async_log_policy():
+    """Get the queue policy for asynchronous logging, if enabled.
+
+    Set ``PUBSUB_ASYNC_LOG`` to ``block`` (or ``1``) or ``drop``.
+
+    Returns:
+        Optional[str]: The policy, or :data:`None` to log synchronously.
+    """
+    value = os.environ.get(ASYNC_LOG_ENV, '')
+    if value in ('', '0'):
+        return None
+    if value == '1':
+        return async_logging.BLOCK
+    return value
+
+
 class HeartbeatHelper(object):
 
     def __init__(self):
         self.template = ''
         self.extra_args = ()
 
+    @property
+    def sample_args(self):
+        """Numeric values recorded by ``sampler.HeartbeatSampler``.
+
+        Unlike ``extra_args``, this is read many times a second, so it
+        must be cheap and free of side effects (e.g. no CPU usage deltas
+        and no locks).
+
+        Returns:
+            Tuple[float, ...]: The values (the same number every time).
+        """
+        return ()
+
     @staticmethod
     def _base_inc(future, done_count):
         if future.done():
@@ -112,11 +271,12 @@ def heartbeat(logger, future, done_count, helper):
         exception = None
     done_count = helper.increment_done(future, done_count)
 
-    thread_count = threading.active_count()
-    parts = ['  - ' + thread.name for thread in threading.enumerate()]
-    assert thread_count == len(parts)
-    pretty_names = '\n'.join(parts)
+    thread_count = count_heartbeat_threads()
+    thread_names = [thread.name for thread in heartbeat_threads()]
+    assert thread_count == len(thread_names)
+    pretty_names = '\n'.join('  - ' + name for name in thread_names)
 
+    extra_args = tuple(helper.extra_args)
     template = HEARTBEAT_TEMPLATE + helper.template
     args = (
         template,
@@ -126,12 +286,58 @@ def heartbeat(logger, future, done_count, helper):
         pretty_names,
         exception,
     )
-    args += helper.extra_args
+    args += extra_args
     logger.info(*args)
 
+    probe = RUN_INFO.get('gil_probe')
+    if probe is not None:
+        logger.info('%s', probe.take_summary())
+
+    sink = get_heartbeat_sink()
+    if sink is not None:
+        relative_created = 1000.0 * (time.time() - logging._startTime)
+        sink.write(heartbeat_sink.heartbeat_record(
+            relative_created, is_running, is_done, thread_names, exception,
+            done_count, helper.template, extra_args))
+
     return done_count
 
 
+def heartbeat_threads():
+    # Returns: List[threading.Thread] (alive, other than diagnostics)
+    return [
+        thread for thread in threading.enumerate()
+        if thread.name not in DIAGNOSTIC_THREAD_NAMES
+    ]
+
+
+def count_heartbeat_threads():
+    # Returns: int
+    return len(heartbeat_threads())
+
+
+def get_heartbeat_sink():
+    """Get the JSON lines sink for heartbeats, if enabled.
+
+    Opened on first use and closed by ``restore()``; heartbeats after
+    that (e.g. to check for zombie threads) re-open it for appending.
+
+    Returns:
+        Optional[heartbeat_sink.JsonlSink]: The sink.
+    """
+    if os.environ.get(HEARTBEAT_JSONL_ENV, '') in ('', '0'):
+        return None
+
+    sink = RUN_INFO.get('heartbeat_sink')
+    if sink is None:
+        mode = 'a' if RUN_INFO.get('heartbeat_sink_opened') else 'w'
+        sink = heartbeat_sink.JsonlSink(
+            output_filename('-heartbeats.jsonl'), mode=mode)
+        RUN_INFO['heartbeat_sink'] = sink
+        RUN_INFO['heartbeat_sink_opened'] = True
+    return sink
+
+
 def active(consumer):
     if PUBSUB.version() in ('0.29.0', '0.29.1', '0.29.2'):
         return consumer.active
@@ -139,17 +345,68 @@ def active(consumer):
         return not consumer.stopped.is_set()
 
 
+def output_filename(suffix):
+    """Get a filename next to the log file for the current run.
+
+    Must be called after ``setup_logging()``.
+    """
+    return os.path.join(
+        RUN_INFO['directory'],
+        '{}{}'.format(PUBSUB.version(), suffix),
+    )
+
+
+def get_sample_rate():
+    # Returns: Optional[float] (in Hz)
+    value = os.environ.get(SAMPLE_RATE_ENV, '')
+    if value in ('', '0'):
+        return None
+    return float(value)
+
+
+def start_sampler(future, helper, sample_rate):
+    # NOTE: Scenarios may block on heartbeats more than once, so each
+    #       sampler gets its own file.
+    num_samplers = RUN_INFO.get('num_samplers', 0) + 1
+    RUN_INFO['num_samplers'] = num_samplers
+    filename = output_filename('-samples-{:d}.csv'.format(num_samplers))
+    # NOTE: Samplers start after ``thread_names.monkey_patch()``, so use
+    #       the original class to keep the sampler out of the thread tree
+    #       (``thread_names`` is imported here to avoid a circular import).
+    import thread_names
+    heartbeat_sampler = sampler.HeartbeatSampler(
+        future, helper, filename, rate=sample_rate,
+        count_threads=count_heartbeat_threads,
+        thread_class=thread_names.ORIGINAL_THREAD)
+    heartbeat_sampler.start()
+    return heartbeat_sampler
+
+
 def heartbeats_block(
-        logger, future, max_time=MAX_TIME, helper=HeartbeatHelper()):
+        logger, future, max_time=MAX_TIME, helper=HeartbeatHelper(),
+        sample_rate=None):
+    if sample_rate is None:
+        sample_rate = get_sample_rate()
+    heartbeat_sampler = None
+    if sample_rate is not None:
+        heartbeat_sampler = start_sampler(future, helper, sample_rate)
+
     deadline = time.time() + max_time
     done_count = 0
-    while time.time() < deadline and done_count < DONE_HEARTBEATS:
-        done_count = heartbeat(logger, future, done_count, helper)
-        time.sleep(5)
-
-    # If we exited due to the deadline, do one more heartbeat.
-    if done_count < DONE_HEARTBEATS:
-        heartbeat(logger, future, done_count, helper)
+    try:
+        while time.time() < deadline and done_count < DONE_HEARTBEATS:
+            done_count = heartbeat(logger, future, done_count, helper)
+            time.sleep(5)
+
+        # If we exited due to the deadline, do one more heartbeat.
+        if done_count < DONE_HEARTBEATS:
+            heartbeat(logger, future, done_count, helper)
+    finally:
+        if heartbeat_sampler is not None:
+            heartbeat_sampler.stop()
+            logger.info(
+                'Heartbeat sampler recorded %d samples in %s',
+                heartbeat_sampler.num_samples, heartbeat_sampler.filename)
 
 
 def make_lease_deterministic(random_mod=None):
@@ -158,15 +415,27 @@ def make_lease_deterministic(random_mod=None):
     policy.base.random = random_mod
 
 
+def use_fake_server():
+    return os.environ.get(FAKE_SERVER_ENV, '') not in ('', '0')
+
+
 def get_client_info(
         topic_name, subscription_name, credentials=None,
         policy_class=None, batch_class=None):
-    if credentials is None:
-        credentials, project = google.auth.default(scopes=SCOPES)
+    if use_fake_server():
+        # NOTE: The ``channel`` and ``credentials`` arguments are mutually
+        #       exclusive, so the credentials are ignored.
+        project = fake_pubsub.PROJECT
+        publisher_kwargs = {'channel': fake_pubsub.make_channel()}
+        subscriber_kwargs = {'channel': fake_pubsub.make_channel()}
     else:
-        _, project = google.auth.default()
+        if credentials is None:
+            credentials, project = google.auth.default(scopes=SCOPES)
+        else:
+            _, project = google.auth.default()
+        publisher_kwargs = {'credentials': credentials}
+        subscriber_kwargs = {'credentials': credentials}
 
-    publisher_kwargs = {'credentials': credentials}
     if batch_class is not None:
         publisher_kwargs['batch_class'] = batch_class
     publisher = pubsub_v1.PublisherClient(**publisher_kwargs)
@@ -175,32 +444,55 @@ def get_client_info(
     if policy_class is None:
         policy_class = Policy
     subscriber = pubsub_v1.SubscriberClient(
-        policy_class=policy_class, credentials=credentials)
+        policy_class=policy_class, **subscriber_kwargs)
     subscription_path = subscriber.subscription_path(
         project, subscription_name)
 
     return publisher, topic_path, subscriber, subscription_path
 
 
-def get_stack(num_frames):
-    # NOTE: Import at **runtime** since ``boltons`` is an optional
-    #       dependency.
-    from boltons import tbutils
+def get_stack_id(num_frames):
+    """Capture the stack of the caller's caller in ``STACKS``.
+
+    Use ``format_stack()`` to get the text, e.g. at the end of a run.
+
+    Args:
+        num_frames (int): The maximum number of frames to keep.
 
-    parts = []
-    for level in six.moves.xrange(num_frames + 2, 2, -1):
-        try:
-            callpoint = tbutils.Callpoint.from_current(level)
-            parts.append(callpoint.tb_frame_str())
-        except ValueError as exc:
-            assert exc.args == ('call stack is not deep enough',)
+    Returns:
+        int: The stack ID.
+    """
+    # NOTE: Skip ``get_stack_id()`` and its caller.
+    return STACKS.capture(skip=2, limit=num_frames)
 
-    stack_text = ''.join(parts)
-    return StdErrLogger.sanitize(stack_text)
+
+def format_stack(stack_id):
+    # Returns: str (the sanitized stack, outermost frame first)
+    return StdErrLogger.sanitize(STACKS.format(stack_id))
+
+
+def log_stacks(logger, stack_ids=None):
+    """Log captured stacks (all of them by default) with their counts."""
+    if stack_ids is None:
+        stack_ids = six.moves.xrange(len(STACKS))
+    for stack_id in stack_ids:
+        logger.debug(
+            STACK_TEMPLATE, stack_id, STACKS.count(stack_id),
+            format_stack(stack_id))
 
 
 def restore():
     sys.stderr = ORIGINAL_STDERR
+    fake_pubsub.stop()
+    # NOTE: Only flush the asynchronous or binary log handler; it is
+    #       closed by ``logging.shutdown()`` at exit since scenarios
+    #       still log after ``restore()``.
+    handler = RUN_INFO.get('log_handler')
+    if handler is not None:
+        handler.flush()
+    sink = RUN_INFO.pop('heartbeat_sink', None)
+    if sink is not None:
+        sink.close()
 
 
 class NotRandom(object):
@@ -236,6 +528,14 @@ class Policy(policy.thread.Policy):
                 'Consumer inactive, ending lease maintenance.')
         return result
 
+    def on_response(self, response):
+        if latency.TRACKER.enabled:
+            for received_message in response.received_messages:
+                latency.TRACKER.received(
+                    received_message.ack_id,
+                    received_message.message.attributes)
+        return super(Policy, self).on_response(response)
+
 
 class FlowControlPolicy(Policy):
 
@@ -0,0 +1,123 @@
+# Copyright 2017 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Detect threads that outlive ``subscription.close()``.
+
+Usage from a scenario:
+
+.. code-block:: python
+
+   subscription.close()
+   detector = zombies.ZombieDetector()
+   ...  # Other clean-up, e.g. ``thread_names.save_tree()``.
+   detector.check(logger)  # Raises if any thread is still alive.
+"""
+
+import time
+
+import graph_theory
+import thread_names
+import utils
+
+
+DEFAULT_TIMEOUT = 30.0  # seconds
+POLL_INTERVAL = 0.5  # seconds
+ZOMBIE_TEMPLATE = """\
+Zombie thread: %s
+  kind   =%s
+  parent =%s
+  tid    =%s
+  alive  =%.3fs
+  created at:
+%s"""
+
+
+class ZombieThreadsError(RuntimeError):
+    """Raised when threads are still alive after the deadline."""
+
+
+class ZombieDetector(object):
+    """Tracks the threads alive at close until they exit.
+
+    Takes a snapshot of the thread registry when created, so it should be
+    created right after ``close()`` is called. Threads created after that
+    are ignored.
+
+    Args:
+        timeout (float): Seconds (from the snapshot) that threads have to
+            exit before they are considered zombies.
+        registry (Optional[thread_names.ThreadRegistry]): The registry to
+            watch. Defaults to ``thread_names.REGISTRY``.
+    """
+
+    def __init__(self, timeout=DEFAULT_TIMEOUT, registry=None):
+        if registry is None:
+            registry = thread_names.REGISTRY
+        self.closed_at = time.time()
+        self.deadline = self.closed_at + timeout
+        # NOTE: Threads that were never started can't be zombies.
+        self.candidates = [
+            record for record in registry.snapshot()
+            if record.started is not None and record.exited is None
+        ]
+
+    def survivors(self):
+        # Returns: List[thread_names.ThreadRecord]
+        return [record for record in self.candidates if record.exited is None]
+
+    def wait(self, poll_interval=POLL_INTERVAL):
+        """Poll until every candidate has exited or the deadline passes.
+
+        Returns:
+            List[thread_names.ThreadRecord]: The threads still alive.
+        """
+        survivors = self.survivors()
+        while survivors and time.time() < self.deadline:
+            time.sleep(poll_interval)
+            survivors = self.survivors()
+        return survivors
+
+    @staticmethod
+    def _format_stack(record):
+        if record.stack is None:
+            return '    <unknown>'
+        return utils.format_stack(record.stack).rstrip('\n')
+
+    def report(self, survivors, logger):
+        now = time.time()
+        for record in survivors:
+            logger.error(
+                ZOMBIE_TEMPLATE, record.name,
+                graph_theory.clean_name(record.name), record.parent,
+                record.tid, now - record.started, self._format_stack(record))
+
+    def check(self, logger, poll_interval=POLL_INTERVAL):
+        """Wait for threads to exit and fail if any don't.
+
+        Raises:
+            ZombieThreadsError: If any thread alive at close is still
+                alive at the deadline.
+        """
+        survivors = self.wait(poll_interval=poll_interval)
+        if not survivors:
+            logger.info(
+                'No zombie threads (%d alive at close).',
+                len(self.candidates))
+            return
+
+        self.report(survivors, logger)
+        raise ZombieThreadsError(
+            '{:d} thread(s) still alive {:.1f}s after close'.format(
+                len(survivors), time.time() - self.closed_at),
+            [record.name for record in survivors])